@@ -64,35 +64,49 @@ Environment Variables:
 
 Parameters:
 
-- Year 
-- Month
-- Model (Y/N)
+- As at date
+- Time horizon(s) (months)
+- Number of worker processes for the fitting stage
+- Incremental mode (Y/N)
 
 Flow (Logit Growth Model)
 ----
 cron: (0 1 1 * *) -> first day of each month at 1 hour past midnight
 ----
-|--> Download logit inputs for the given as at date and time horizon
-|--> Administer logistic growth model fit
+|--> Register a model run for each time horizon which has not yet been fitted
+|--> Download logit inputs for the given as at date and the widest time horizon (or, in incremental mode, 
+     only those that are missing from the previous month's window)
+|--> Administer logistic growth model fit (every horizon in a single pass, slicing each narrower 
+     window out of the widest)
 |--> Upload logistic growth fit to Postgres database
+|--> Precompute the top trending / shrinking terms (and their time series) of each model run
+|--> Export per-stage timing, throughput and memory metrics (incl. failed fits) as a Prometheus textfile & Prefect artifact
 
 """
 import os
 import datetime
+import pandas as pd
 from dateutil.relativedelta import relativedelta
 from prefect import flow
 from prefect.logging import get_run_logger
 from dotenv import load_dotenv
 from pathlib import Path
 from _logit_tasks import (
-    establish_dwh_connection,
+    establish_dwh_pool,
     get_model_run_id,
     assign_model_run_id,
     get_logit_inputs,
-    fit_logit_batch,
-    ingest_logit_outputs
+    get_incremental_logit_inputs,
+    get_cube_logit_inputs,
+    fit_logit_horizons,
+    ingest_logit_outputs,
+    rank_logit_outputs
 )
 from psycopg2.errors import DatabaseError, OperationalError
+from src.model.incremental import build_state, load_state, save_state, state_path
+from src.model.schema import set_validation_level, reset_validation_level
+from src.monitoring.metrics import track_flow
+from src.monitoring.profiling import profile_flow
 load_dotenv()
 
 
@@ -101,72 +115,143 @@ FIRST = TODAY.replace(day=1)
 
 
 @flow(log_prints=True)
+@track_flow
+@profile_flow
 def main_logit_growth(
     as_at: str = str(FIRST),
-    time_horizon_months: int = 6
+    time_horizon_months: int | list[int] = 6,
+    n_workers: int = 1,
+    incremental: bool = False,
+    state_dir: str = "staging",
+    cube_dir: str | None = None,
+    validation_level: str = "full",
+    metrics_dir: str | None = None,
+    profiling: str | None = None
 ):
     """Fits a logistic growth model (and stores the results in the data warehouse) for the given
-    `as_at` and time horizon.
+    `as_at` and time horizon(s).
 
     :param as_at: as at date, defaults to `FIRST` (i.e. the first day of the 'current' month)
     :param time_horizon_months: length of time over which to compute the growth statistics;
-                                determines volume of data to train on, defaults to 6
+                                determines volume of data to train on, defaults to 6. If a list of
+                                horizons is given (e.g. `[1, 3, 6, 12]`), only the widest window is
+                                downloaded and every horizon is fitted (and registered as its own
+                                `model.run`) in a single pass
+    :param n_workers: number of processes across which to fit the terms, defaults to 1 (i.e. serial)
+    :param incremental: if True, roll forward the previous month's (widest) window (where its state is
+                        available in `state_dir`) instead of refitting from scratch, defaults to False
+    :param state_dir: directory in which window states are persisted for incremental refits, 
+                      defaults to "staging"
+    :param cube_dir: if provided, logit inputs are read from the local term cube (cf. `src.db.cube`) 
+                     located here rather than downloaded from the data warehouse, defaults to None
+    :param validation_level: amount of schema validation performed whilst fitting i.e. one of "full", 
+                             "batch", "sampled" or "off" (cf. `src.model.schema`), defaults to "full"
+    :param metrics_dir: if provided, per-stage metrics of the run are written here as a Prometheus
+                        textfile (defaults to the `METRICS_TEXTFILE_DIR` environment variable, if set)
+    :param profiling: if set, the hot paths of the run (e.g. `read_sql_typed`, `compute_batch_trend`) are
+                      profiled i.e. one of "off", "cpu", "memory" or "full" (cf. `src.monitoring.profiling`),
+                      defaults to the `PROFILING_MODE` environment variable (or else "off")
     """
     # Setup
     logger = get_run_logger()
     logit_end_date = datetime.datetime.strptime(as_at, "%Y-%m-%d")
-    logit_start_date = logit_end_date - relativedelta(months=time_horizon_months)
-    staging_path = f"{str(logit_start_date)}_{str(logit_end_date)}_logit_out.csv"
+    horizons = sorted({time_horizon_months} if isinstance(time_horizon_months, int) else set(time_horizon_months), reverse=True)
+    logit_start_dates = {horizon: logit_end_date - relativedelta(months=horizon) for horizon in horizons}
 
     # Run
+    # NB: the validation level is scoped to this flow run (rather than the whole worker process)
+    validation_token = set_validation_level(validation_level)
     try:
 
-        logger.info(f"Configuring database connection")
-        with establish_dwh_connection(
+        logger.info(f"Configuring database connection pool")
+        pool = establish_dwh_pool(
             dbname=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
             password=os.getenv("DB_PWD"),
             host="localhost"
-        ) as conn:
+        )
+        with pool.lease() as conn:
             logger.info(f"Successfully established connection to: '{str(conn)}'")
 
-            existing_model_run_id = get_model_run_id(conn, str(logit_start_date), str(logit_end_date))
-            if existing_model_run_id:
-                logger.info(f"Model already fitted (see `dwh.model.run` with id '{existing_model_run_id}')")
+            model_run_ids = {}
+            for horizon, start_date in logit_start_dates.items():
+                existing_model_run_id = get_model_run_id(conn, str(start_date), str(logit_end_date))
+                if existing_model_run_id:
+                    logger.info(f"Model already fitted over {horizon} months (see `dwh.model.run` with id '{existing_model_run_id}')")
+                else:
+                    model_run_ids[horizon] = assign_model_run_id(conn, str(start_date), str(logit_end_date))
+            if not model_run_ids:
                 return
-            else:
-                model_run_id = assign_model_run_id(conn, str(logit_start_date), str(logit_end_date))
 
-            logger.info(f"Downloading latest logit inputs as at: '{str(as_at)}' (time horizon: 6 months)")
-            logit_inputs = get_logit_inputs(
-                conn,
-                start_date=str(logit_start_date),
-                end_date=str(logit_end_date)
+            # NB: the widest outstanding window is downloaded once and every narrower window is sliced out of it
+            time_horizon = max(model_run_ids)
+            logit_start_date = logit_start_dates[time_horizon]
+            previous_state = None
+            if incremental:
+                previous_state = load_state(state_path(
+                    state_dir,
+                    (logit_start_date - relativedelta(months=1)).date(),
+                    (logit_end_date - relativedelta(months=1)).date()
+                ))
+
+            if previous_state:
+                logger.info(f"Downloading logit inputs since previous window ending: '{str(previous_state.end_date)}'")
+                logit_inputs, warm_start = get_incremental_logit_inputs(
+                    conn,
+                    state=previous_state,
+                    start_date=logit_start_date.date(),
+                    end_date=logit_end_date.date()
+                )
+            elif cube_dir:
+                logger.info(f"Reading logit inputs as at: '{str(as_at)}' from local term cube @ '{cube_dir}'")
+                logit_inputs = get_cube_logit_inputs(
+                    cube_dir,
+                    start_date=logit_start_date.date(),
+                    end_date=logit_end_date.date()
+                )
+                warm_start = None
+            else:
+                logger.info(f"Downloading latest logit inputs as at: '{str(as_at)}' (time horizon: {time_horizon} months)")
+                logit_inputs = get_logit_inputs(
+                    conn,
+                    start_date=str(logit_start_date),
+                    end_date=str(logit_end_date)
+                )
+                warm_start = None
+
+            logger.info(f"Fitting logistic growth model to every headline term / topic over {sorted(model_run_ids)} months")
+            logit_outputs = fit_logit_horizons(
+                logit_inputs,
+                shifts={horizon: (logit_start_dates[horizon] - logit_start_date).days for horizon in model_run_ids},
+                n_workers=n_workers,
+                warm_start=warm_start
             )
-
-            logger.info(f"Fitting logistic growth model to every headline term / topic")
-            logit_outputs = fit_logit_batch(logit_inputs)
-            logit_outputs["model_run_id"] = model_run_id
-
-            logger.info(f"Dumping model results into CSV format @ '{staging_path}'")
-            logit_outputs.to_csv(staging_path, sep="|", index=False)
+            if incremental:
+                save_state(
+                    state_path(state_dir, logit_start_date.date(), logit_end_date.date()),
+                    build_state(logit_start_date.date(), logit_end_date.date(), logit_inputs, logit_outputs[time_horizon])
+                )
 
             logger.info(f"Ingesting results into Postgres instance @ '{str(conn)}'")
             ingest_logit_outputs(
                 conn,
-                staging_path
+                pd.concat(
+                    [outputs.assign(model_run_id=model_run_ids[horizon]) for horizon, outputs in logit_outputs.items()],
+                    ignore_index=True
+                )
             )
 
+            logger.info(f"Ranking top trending / shrinking terms of model run(s) {sorted(model_run_ids.values())}")
+            for model_run_id in model_run_ids.values():
+                rank_logit_outputs(conn, model_run_id)
+
     except OperationalError as e:
         logger.error(f"Connectivity could not be established to DWH: '{str(e)}'")
     except DatabaseError as e:
-        conn.rollback()
+        # NB: the leased connection has already been rolled back (and returned to the pool)
         logger.error(f"Logistic fitting exercise encountered a fatal database error: '{str(e)}'")
-    else:
-        conn.commit()
     finally:
-        if conn:
-            conn.close()
+        reset_validation_level(validation_token)
 
 
 if __name__ == "__main__":
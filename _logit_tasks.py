@@ -1,67 +1,169 @@
 """Prefect tasks which form part of the logit growth model 'fitting' `flow`.
 """
+import datetime
+import numpy as np
 import pandas as pd
 from prefect import task
-from psycopg2 import sql
-from src.db.utils import open_connection, read_sql
-from src.data_loader import ingest
-from src.model import compute_batch_trend
+from psycopg2 import sql, DatabaseError
+from src.db.utils import ConnectionPool, get_pool, read_sql_typed, write_frame
+from src.db.cube import TermCube
+from src.db.rankings import refresh_rankings
+from src.model import compute_horizon_trends
+from src.model.incremental import WindowState, roll_window
+from src.monitoring.metrics import instrument, observe, count
 
 
-@task(name="establish_dwh_connection", retries=3, retry_delay_seconds=5)
-def establish_dwh_connection(
+LOGIT_INPUT_DTYPES = {
+    "publication": object,
+    "term_id": "int32",
+    "cum_time_elapsed": "int64",
+    "successes": "int64",
+    "failures": "int64"
+}
+MODEL_OUTPUT_TYPES = {
+    "term_id": "int4",
+    "coef_intercept": "numeric",
+    "coef_time": "numeric",
+    "rse_time": "numeric",
+    "p_value_time": "numeric",
+    "model_run_id": "int4"
+}
+
+
+@task(name="establish_dwh_pool", retries=3, retry_delay_seconds=5, cache_policy=None)
+def establish_dwh_pool(
     dbname: str,
     user: str,
     password: str,
     host: str = "publications-db",
-    port: int = 5432
-):
-    """Establishes connection to data warehouse
+    port: int = 5432,
+    max_size: int = 4
+) -> ConnectionPool:
+    """Establishes (or reuses) the connection pool of the data warehouse shared by every flow run in
+    this process
     """
-    return open_connection(
+    return get_pool(
         dbname,
         user,
         password,
         host,
-        port
+        port,
+        max_size=max_size
     )
 
 
 @task(name="get_logit_inputs", retries=3, retry_delay_seconds=5, cache_policy=None)
+@instrument("download")
 def get_logit_inputs(
     conn,
     start_date: str,
-    end_date: str
+    end_date: str,
+    origin_date: str | None = None,
+    term_ids: list[int] | None = None,
+    min_frequency: int = 50
 ):
     """Download the inputs to administer logistic growth on each term / topic
+
+    Only terms which appear at least `min_frequency` times *within the requested window* are
+    downloaded. Time elapsed is measured from `origin_date` (defaults to `start_date`) and,
+    optionally, the download can be restricted to a subset of `term_ids` (in which case no frequency
+    threshold is applied).
+
+    NB: terms are downloaded as their `int32` IDs (cf. `dwh.dim_terms`) rather than their text
     """
     bulk_download = sql.SQL(
         """
+            with window_inputs as (
+                select
+                    publication,
+                    term_id,
+                    publication_date,
+                    successes,
+                    failures,
+                    sum(successes) over (partition by term_id) as window_frequency
+                from dwh.fct_logit_inputs
+                where publication_date between {} and {}
+                and headline_term != ''
+                {}
+            )
             select 
                 publication,
-                headline_term,
+                term_id,
                 (publication_date - {}) as cum_time_elapsed,
                 successes,
                 failures
-            from dwh.fct_logit_inputs 
-            where headline_term_frequency >= 50
-            and publication_date between {} and {}
-            and headline_term != ''
+            from window_inputs 
+            where window_frequency >= {}
         """
     ).format(
         sql.Literal(start_date),
-        sql.Literal(start_date),
-        sql.Literal(end_date)
+        sql.Literal(end_date),
+        sql.SQL("and term_id = any({})").format(sql.Literal(term_ids)) if term_ids is not None else sql.SQL(""),
+        sql.Literal(origin_date or start_date),
+        sql.Literal(min_frequency if term_ids is None else 0)
     )
-    logit_inputs = read_sql(
+    logit_inputs = read_sql_typed(
         conn,
-        bulk_download
+        bulk_download,
+        dtypes=LOGIT_INPUT_DTYPES
     )
-    for col in ['cum_time_elapsed', 'successes', 'failures']:
-        logit_inputs[col] = logit_inputs[col].astype('int')
+    observe(rows=len(logit_inputs), nbytes=logit_inputs.memory_usage(deep=True).sum())
     return logit_inputs
 
 
+@task(name="get_cube_logit_inputs", cache_policy=None)
+@instrument("cube_read")
+def get_cube_logit_inputs(
+    cube_dir: str,
+    start_date: datetime.date,
+    end_date: datetime.date
+) -> pd.DataFrame:
+    """Produce the inputs to administer logistic growth from the local term cube (cf. `src.db.cube`)
+    rather than the data warehouse
+    """
+    logit_inputs = TermCube(cube_dir).logit_inputs(
+        start_date,
+        end_date,
+        min_frequency=50
+    )
+    observe(rows=len(logit_inputs), nbytes=logit_inputs.memory_usage(deep=True).sum())
+    return logit_inputs
+
+
+@task(name="get_incremental_logit_inputs", retries=3, retry_delay_seconds=5, cache_policy=None)
+@instrument("incremental_download")
+def get_incremental_logit_inputs(
+    conn,
+    state: WindowState,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    min_frequency: int = 50
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Download only the logit inputs that are missing from the previous window's `state` and roll
+    the window forward (cf. `src.model.incremental.roll_window()`)
+
+    NB: the frequency threshold applies to the whole new window, so the new rows are downloaded
+    unfiltered and the threshold is applied once the window has been rolled
+    """
+    new_inputs = get_logit_inputs.fn(
+        conn,
+        start_date=str(state.end_date + datetime.timedelta(days=1)),
+        end_date=str(end_date),
+        origin_date=str(start_date),
+        min_frequency=0
+    )
+    missing_term_ids = np.setdiff1d(new_inputs["term_id"].to_numpy(), state.term_ids)
+    if len(missing_term_ids):
+        history = get_logit_inputs.fn(
+            conn,
+            start_date=str(start_date),
+            end_date=str(state.end_date),
+            term_ids=missing_term_ids.tolist()
+        )
+        new_inputs = pd.concat([new_inputs, history], ignore_index=True)
+    return roll_window(state, new_inputs, start_date, end_date, min_frequency=min_frequency)
+
+
 @task(name="get_model_run_id", cache_policy=None)
 def get_model_run_id(
     conn,
@@ -114,38 +216,73 @@ def assign_model_run_id(
         return cursor.fetchone()[0]
 
 
-@task(name="fit_logit_batch")
-def fit_logit_batch(
-    logit_inputs: pd.DataFrame
-) -> pd.DataFrame:
-    """Fits logistic growth model to each headline topic and returns the results in a `pd.DataFrame`
+@task(name="fit_logit_horizons")
+@instrument("fit")
+def fit_logit_horizons(
+    logit_inputs: pd.DataFrame,
+    shifts: dict[int, int],
+    engine: str = "irls",
+    n_workers: int = 1,
+    warm_start: pd.DataFrame | None = None,
+    min_frequency: int = 50
+) -> dict[int, pd.DataFrame]:
+    """Fits logistic growth model to each headline topic over several time horizons at once (given the
+    inputs of the widest window) and returns the results of each horizon in a `pd.DataFrame`
+
+    Terms whose fit failed (or was negated) are dropped from the results and counted as `failed_fits`
+    in the flow run's metrics (cf. `drop_failed_fits()`)
     """
-    return compute_batch_trend(
-        logit_inputs
+    logit_outputs = compute_horizon_trends(
+        logit_inputs,
+        shifts,
+        min_frequency=min_frequency,
+        engine=engine,
+        n_workers=n_workers,
+        warm_start=warm_start
     )
+    observe(rows=len(logit_inputs))
+    for horizon_outputs in logit_outputs.values():
+        count("fitted_terms", len(horizon_outputs))
+    return logit_outputs
 
 
 @task(name="ingest_logit_outputs", cache_policy=None)
+@instrument("ingest")
 def ingest_logit_outputs(
     conn,
-    source_path: str
+    logit_outputs: pd.DataFrame
 ) -> None:
-    """Ingests logistic growth model outputs into Postgres instance
+    """Ingests logistic growth model outputs into Postgres instance (via binary `COPY`, so that
+    coefficients are loaded without a lossy round trip through text)
     """
-    ingest(
-        conn=conn,
+    n_rows = write_frame(
+        conn,
+        logit_outputs[list(MODEL_OUTPUT_TYPES)],
         schema="model",
         table="output",
-        columns=[
-            "headline_term", 
-            "coef_intercept", 
-            "coef_time", 
-            "rse_time", 
-            "p_value_time", 
-            "model_run_id"
-        ],
-        source_path=source_path
+        types=MODEL_OUTPUT_TYPES
     )
+    conn.commit()
+    observe(rows=n_rows)
+
+
+@task(name="rank_logit_outputs", retries=3, retry_delay_seconds=5, cache_policy=None)
+@instrument("rank")
+def rank_logit_outputs(
+    conn,
+    model_run_id: int
+) -> None:
+    """Precomputes the top trending / shrinking terms (and their time series) of a model run, from
+    which queries are served (cf. `src.db.rankings`)
+    """
+    try:
+        n_terms = refresh_rankings(conn, model_run_id)
+        conn.commit()
+    except DatabaseError:
+        # NB: roll back, so that a retry does not fail on an aborted transaction
+        conn.rollback()
+        raise
+    observe(rows=n_terms)
 
 
 if __name__ == "__main__":
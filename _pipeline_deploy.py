@@ -72,10 +72,21 @@ Flow (ELT)
 ----
 cron: (0 0 1 * *) -> first day of each month at midnight
 ----
-|--> Open connection to Postgres database (context-managed) (Task)
+|--> Lease connection from the shared Postgres connection pool (context-managed) (Task)
 |--> Extract data 'as at' the given year and month (Task)
-|--> Load extracted data into staging area of Postgres database
-|--> Transform loaded data via `dbt` framework
+|--> Load extracted data into staging area of Postgres database (optionally streamed directly, without a staging file)
+|--> Transform loaded data via `dbt` framework (incrementally, i.e. only newly loaded headlines)
+|--> (Optional) Refresh the local term cube with the month's daily counts
+|--> Export per-stage timing, throughput and memory metrics (Prometheus textfile & Prefect artifact)
+
+Flow (ELT backfill)
+----
+|--> Lease connection from the shared Postgres connection pool (context-managed) (Task)
+|--> Extract, stage and load every month between the start and end months, either
+     |--> as each download completes (default), or
+     |--> pipelined: download -> stage -> load run concurrently, connected by bounded queues (backpressure)
+|--> Transform loaded data via `dbt` once at the end (or, if pipelined, every `dbt_batch_months` months)
+|--> Export per-stage timing, throughput and memory metrics (Prometheus textfile & Prefect artifact)
 
 """
 import os
@@ -84,11 +95,18 @@ from prefect import flow
 from prefect.logging import get_run_logger
 from dotenv import load_dotenv
 from _pipeline_tasks import (
-    establish_dwh_connection, 
+    establish_dwh_pool,
     stage_nytas_archive_to_csv,
     ingest_nytas_archive,
-    trigger_dbt_flow
+    load_nytas_archive,
+    trigger_dbt_flow,
+    refresh_term_cube,
+    backfill_nytas_archives,
+    pipeline_nytas_archives
 )
+from src.data_loader.backfill import nytas_months
+from src.monitoring.metrics import track_flow
+from src.monitoring.profiling import profile_flow
 from psycopg2.errors import DatabaseError, OperationalError
 load_dotenv()
 
@@ -99,59 +117,237 @@ LATEST_PERIOD = FIRST - datetime.timedelta(days=1)
 
 
 @flow(log_prints=True)
+@track_flow
+@profile_flow
 def main_nytas(
     year: int = LATEST_PERIOD.year,
-    month: int = LATEST_PERIOD.month
+    month: int = LATEST_PERIOD.month,
+    cube_dir: str | None = None,
+    streaming: bool = False,
+    cache_dir: str | None = None,
+    direct_load: bool = False,
+    keep_staging_file: bool = False,
+    copy_workers: int = 1,
+    full_refresh: bool = False,
+    tokenize: bool = False,
+    metrics_dir: str | None = None,
+    profiling: str | None = None
 ):
     """Extracts, loads and transforms a given NYT Archive Search ('nytas') metadata archive
     for the given as at date (as prescribed by `year` and `month`)
 
     :param year: integer year of interest, defaults to LATEST_PERIOD.year
     :param month: integer month of interest, defaults to LATEST_PERIOD.month
+    :param cube_dir: if provided, the local term cube (cf. `src.db.cube`) located here is refreshed
+                     with the month's daily counts, defaults to None
+    :param streaming: if True, the archive is parsed incrementally as it is downloaded (which keeps
+                      peak memory flat regardless of the size of the archive), defaults to False
+    :param cache_dir: if provided, raw archive responses are cached on disk here (cf. 
+                      `src.data_loader.cache`) so that re-runs cost no API quota, defaults to None
+    :param direct_load: if True, filtered records are streamed straight into `COPY ... FROM STDIN`
+                        rather than being staged to disk first, defaults to False
+    :param keep_staging_file: if True (and `direct_load` is True), a copy of the streamed records is
+                              still written to the staging path for debugging or replay, defaults to False
+    :param copy_workers: number of connections over which the staged file is copied into Postgres
+                         at once (cf. `src.data_loader.load.ingest_parallel()`), defaults to 1
+    :param full_refresh: if True, the incremental `dbt` models are rebuilt from scratch rather than
+                         only processing newly loaded headlines, defaults to False
+    :param tokenize: if True, headlines are tokenized (and their terms counted) at extract time so that
+                     `dbt` skips its text processing (cf. `python_tokenization` in `dbt_project.yml`),
+                     defaults to False
+    :param metrics_dir: if provided, per-stage metrics of the run are written here as a Prometheus
+                        textfile (defaults to the `METRICS_TEXTFILE_DIR` environment variable, if set)
+    :param profiling: if set, the hot paths of the run (e.g. `nytas_filter_archive`, `ingest`, `read_sql`) are
+                      profiled i.e. one of "off", "cpu", "memory" or "full" (cf. `src.monitoring.profiling`),
+                      defaults to the `PROFILING_MODE` environment variable (or else "off")
     """
     # Setup
     logger = get_run_logger()
     source_staging_path = f"{year}_{month}_nytas.csv"
+    terms_staging_path = f"{year}_{month}_nytas_terms.csv"
 
     # Run
     try:
         
-        logger.info(f"Configuring database connection")
-        with establish_dwh_connection(
+        logger.info(f"Configuring database connection pool")
+        pool = establish_dwh_pool(
             dbname=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
             password=os.getenv("DB_PWD"),
-            host="publications-db"
-        ) as conn:
+            host="publications-db",
+            max_size=copy_workers + 1
+        )
+        with pool.lease() as conn:
             logger.info(f"Successfully established connection to: '{str(conn)}'")
 
-            logger.info(f"Staging data from NYT Archive Search locally @ '{source_staging_path}'")
-            stage_nytas_archive_to_csv(
-                nytas_api_key=os.getenv("NYTAS_API_KEY"),
-                year=year,
-                month=month,
-                staging_path=source_staging_path
-            )
-
-            logger.info(f"Ingesting data @ '{source_staging_path}' into Postgres database @ '{str(conn)}'")
-            ingest_nytas_archive(
-                conn=conn,
-                source_path=source_staging_path
-            )
+            if direct_load:
+                logger.info(f"Streaming data from NYT Archive Search into Postgres database @ '{str(conn)}'")
+                n_records = load_nytas_archive(
+                    conn=conn,
+                    nytas_api_key=os.getenv("NYTAS_API_KEY"),
+                    year=year,
+                    month=month,
+                    streaming=streaming,
+                    cache_dir=cache_dir,
+                    staging_path=source_staging_path if keep_staging_file else None,
+                    tokenize=tokenize
+                )
+                logger.info(f"Streamed {n_records} records into Postgres database")
+            else:
+                logger.info(f"Staging data from NYT Archive Search locally @ '{source_staging_path}'")
+                stage_nytas_archive_to_csv(
+                    nytas_api_key=os.getenv("NYTAS_API_KEY"),
+                    year=year,
+                    month=month,
+                    staging_path=source_staging_path,
+                    streaming=streaming,
+                    cache_dir=cache_dir,
+                    terms_staging_path=terms_staging_path if tokenize else None
+                )
+
+                logger.info(f"Ingesting data @ '{source_staging_path}' into Postgres database @ '{str(conn)}'")
+                ingest_nytas_archive(
+                    conn=conn,
+                    source_path=source_staging_path,
+                    pool=pool,
+                    n_workers=copy_workers,
+                    terms_source_path=terms_staging_path if tokenize else None
+                )
 
             logger.info(f"Running `dbt` transformation models")
-            trigger_dbt_flow()
+            trigger_dbt_flow(full_refresh=full_refresh, python_tokenization=tokenize)
+
+            if cube_dir:
+                logger.info(f"Refreshing local term cube @ '{cube_dir}'")
+                refresh_term_cube(
+                    conn=conn,
+                    cube_dir=cube_dir,
+                    year=year,
+                    month=month
+                )
     
     except OperationalError as e:
         logger.error(f"Connectivity could not be established to DWH: '{str(e)}'")
     except DatabaseError as e:
-        conn.rollback()
+        # NB: the leased connection has already been rolled back (and returned to the pool)
         logger.error(f"ELT pipeline encountered a fatal database error: '{str(e)}'")
-    else:
-        conn.commit()
-    finally:
-        if conn:
-            conn.close()
+
+
+@flow(log_prints=True)
+@track_flow
+@profile_flow
+def main_nytas_backfill(
+    start_year: int,
+    start_month: int,
+    end_year: int = LATEST_PERIOD.year,
+    end_month: int = LATEST_PERIOD.month,
+    max_workers: int = 4,
+    staging_dir: str = "staging",
+    cache_dir: str | None = None,
+    direct_load: bool = False,
+    copy_workers: int = 1,
+    full_refresh: bool = False,
+    tokenize: bool = False,
+    pipelined: bool = False,
+    queue_size: int = 1,
+    dbt_batch_months: int | None = None,
+    metrics_dir: str | None = None,
+    profiling: str | None = None
+):
+    """Extracts and loads the NYT Archive Search ('nytas') metadata archives of every month between the
+    given start and end months (inclusive) and then transforms them all in a single `dbt` run.
+
+    Archives are downloaded concurrently (within the rate limits of the NYT API) over a pooled HTTP
+    session whilst previously downloaded months are staged and ingested. If `pipelined` is True,
+    staging and ingesting run in stages of their own too, so that the network, the local disk and
+    Postgres are kept busy at once (cf. `pipeline_nytas_archives()`).
+
+    :param start_year: integer year of the first month of interest
+    :param start_month: integer first month of interest
+    :param end_year: integer year of the last month of interest, defaults to LATEST_PERIOD.year
+    :param end_month: integer last month of interest, defaults to LATEST_PERIOD.month
+    :param max_workers: number of concurrent downloads, defaults to 4
+    :param staging_dir: local directory in which to stage each month, defaults to "staging"
+    :param cache_dir: if provided, raw archive responses are cached on disk here (cf. 
+                      `src.data_loader.cache`), defaults to None
+    :param direct_load: if True, each month is streamed straight into Postgres without being staged
+                        in `staging_dir`, defaults to False
+    :param copy_workers: number of connections over which each staged month is copied into Postgres
+                         at once, defaults to 1
+    :param full_refresh: if True, the incremental `dbt` models are rebuilt from scratch, defaults to False
+    :param tokenize: if True, headlines are tokenized (and their terms counted) at extract time, defaults to False
+    :param pipelined: if True, extract, stage and load overlap across months via bounded queues, defaults to False
+    :param queue_size: (if `pipelined`) maximum number of months queued in front of each stage, defaults to 1
+    :param dbt_batch_months: (if `pipelined`) if provided, `dbt` runs after every `dbt_batch_months` loaded
+                             months rather than once at the end, defaults to None
+    :param metrics_dir: if provided, per-stage metrics of the run are written here as a Prometheus
+                        textfile (defaults to the `METRICS_TEXTFILE_DIR` environment variable, if set)
+    :param profiling: if set, the hot paths of the run (e.g. `nytas_filter_archive`, `ingest`, `read_sql`) are
+                      profiled i.e. one of "off", "cpu", "memory" or "full" (cf. `src.monitoring.profiling`),
+                      defaults to the `PROFILING_MODE` environment variable (or else "off")
+    """
+    # Setup
+    logger = get_run_logger()
+    months = nytas_months(start_year, start_month, end_year, end_month)
+
+    # Run
+    try:
+
+        logger.info(f"Configuring database connection pool")
+        pool = establish_dwh_pool(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PWD"),
+            host="publications-db",
+            max_size=copy_workers + 1
+        )
+        with pool.lease() as conn:
+            logger.info(f"Successfully established connection to: '{str(conn)}'")
+
+            if pipelined:
+                logger.info(f"Pipelining {len(months)} months of NYT Archive Search data via '{staging_dir}'")
+                failed_months = pipeline_nytas_archives(
+                    conn=conn,
+                    nytas_api_key=os.getenv("NYTAS_API_KEY"),
+                    months=months,
+                    staging_dir=staging_dir,
+                    max_workers=max_workers,
+                    queue_size=queue_size,
+                    cache_dir=cache_dir,
+                    direct_load=direct_load,
+                    pool=pool,
+                    copy_workers=copy_workers,
+                    tokenize=tokenize,
+                    dbt_batch_months=dbt_batch_months,
+                    full_refresh=full_refresh
+                )
+            else:
+                logger.info(f"Backfilling {len(months)} months of NYT Archive Search data via '{staging_dir}'")
+                failed_months = backfill_nytas_archives(
+                    conn=conn,
+                    nytas_api_key=os.getenv("NYTAS_API_KEY"),
+                    months=months,
+                    staging_dir=staging_dir,
+                    max_workers=max_workers,
+                    cache_dir=cache_dir,
+                    direct_load=direct_load,
+                    pool=pool,
+                    copy_workers=copy_workers,
+                    tokenize=tokenize
+                )
+            if failed_months:
+                logger.warning(f"Failed to backfill the following (year, month) combinations: {failed_months}")
+
+            # NB: when transforming in batches, every batch has already been run from within the pipeline
+            if not (pipelined and dbt_batch_months):
+                logger.info(f"Running `dbt` transformation models")
+                trigger_dbt_flow(full_refresh=full_refresh, python_tokenization=tokenize)
+
+    except OperationalError as e:
+        logger.error(f"Connectivity could not be established to DWH: '{str(e)}'")
+    except DatabaseError as e:
+        # NB: the leased connection has already been rolled back (and returned to the pool)
+        logger.error(f"ELT backfill encountered a fatal database error: '{str(e)}'")
 
 
 if __name__ == "__main__":
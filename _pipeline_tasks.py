@@ -1,91 +1,536 @@
 """Prefect tasks which form part of the pipeline `flow` object.
 """
+import os
+import datetime
 from prefect import task
 from prefect_dbt.cli.commands import DbtCoreOperation
 from pathlib import Path
-from src.db.utils import open_connection
+from psycopg2 import sql, DatabaseError
+from requests import RequestException
+from src.db.utils import ConnectionPool, get_pool, read_sql_typed
+from src.db.cube import refresh_cube
 from src.data_loader import (
     nytas_extract_archive, 
     nytas_filter_archive, 
+    nytas_stream_archive,
+    nytas_filter_docs,
     stage,
-    ingest
+    ingest,
+    ingest_records
 )
+from src.data_loader.load import ingest_parallel
+from src.data_loader.transform import nytas_count_terms
+from src.data_loader.backfill import (
+    NYTAS_REQUESTS_PER_MINUTE,
+    TokenBucket,
+    nytas_session,
+    nytas_download_archive,
+    nytas_backfill
+)
+from src.data_loader.pipeline import PipelineStage, run_pipeline
+from src.data_loader.cache import ArchiveCache
+from src.data_loader.batch import ArchiveBatch
+from src.monitoring.metrics import instrument, stage_timer, observe, observe_records, file_size
 
 
 PROJECT_DIR = Path(__file__).parent
 PATH_DBT_PROFILES = PROJECT_DIR / "config"
 PATH_DBT_PROJECT = PROJECT_DIR / "src" / "data_transformer"
+NYTAS_FIELD_NAMES = ["headline", "publication_date", "author", "news_desk", "url"]
+NYTAS_COLUMN_TYPES = {
+    "headline": "text",
+    "publication_date": "timestamp",
+    "author": "text",
+    "news_desk": "text",
+    "url": "text"
+}
+NYTAS_TERM_FIELD_NAMES = ["url", "headline_md5", "headline_term", "frequency"]
+NYTAS_TERM_COLUMN_TYPES = {
+    "url": "text",
+    "headline_md5": "text",
+    "headline_term": "text",
+    "frequency": "int4"
+}
 
 
-@task(name="establish_dwh_connection", retries=3, retry_delay_seconds=5)
-def establish_dwh_connection(
+@task(name="establish_dwh_pool", retries=3, retry_delay_seconds=5, cache_policy=None)
+def establish_dwh_pool(
     dbname: str,
     user: str,
     password: str,
     host: str = "publications-db",
-    port: int = 5432
-):
-    """Establishes connection to data warehouse
+    port: int = 5432,
+    max_size: int = 4
+) -> ConnectionPool:
+    """Establishes (or reuses) the connection pool of the data warehouse shared by every flow run in
+    this process
     """
-    return open_connection(
+    return get_pool(
         dbname,
         user,
         password,
         host,
-        port
+        port,
+        max_size=max_size
     )
 
 
-@task(name="stage_nytas_archive_to_csv")
-def stage_nytas_archive_to_csv(
+def extract_nytas_records(
     nytas_api_key: str,
-    year: int, 
+    year: int,
     month: int,
-    staging_path: str
-) -> None:
-    """Stages headlines for a given 'as at' date to disk (in `.csv` format)
+    streaming: bool = False,
+    cache_dir: str | None = None
+):
+    """Extracts and filters the NYT Archive Search response for a given year and month
+
+    If `streaming` is True, articles are parsed and filtered incrementally as the response is
+    downloaded (rather than holding the full archive in memory). If `cache_dir` is provided, raw
+    responses are served from (and stored in) an on-disk cache
     """
+    cache = ArchiveCache(cache_dir) if cache_dir else None
+    if streaming:
+        return nytas_filter_docs(
+            nytas_stream_archive(
+                nytas_api_key,
+                year,
+                month,
+                cache=cache
+            )
+        )
     nyt_archive = nytas_extract_archive(
         nytas_api_key,
         year,
-        month
+        month,
+        cache=cache
     )
-    filtered_archive = nytas_filter_archive(
+    return nytas_filter_archive(
         nyt_archive
     )
+
+
+def collect_term_counts(
+    records,
+    term_counts: list
+):
+    """Passes `records` through whilst collecting the term counts of each headline into `term_counts`
+    (cf. `src.data_loader.transform.nytas_count_terms()`)
+
+    An `ArchiveBatch` is counted up front and returned as is (so that it is still loaded column-wise)
+    """
+    if isinstance(records, ArchiveBatch):
+        term_counts.extend(nytas_count_terms(records))
+        return records
+    return passthrough_term_counts(records, term_counts)
+
+
+def passthrough_term_counts(
+    records,
+    term_counts: list
+):
+    for record in records:
+        term_counts.extend(nytas_count_terms((record,)))
+        yield record
+
+
+def load_term_counts(
+    conn,
+    term_counts: list,
+    commit: bool = True
+) -> int:
+    """Streams the term counts of each headline into `raw.nytas_terms`
+
+    NB: headlines and their terms must be committed in a single transaction (cf. `commit`), since the
+    incremental watermark of `dbt` would otherwise move past headlines whose terms failed to load
+    """
+    return ingest_records(
+        conn=conn,
+        schema="raw",
+        table="nytas_terms",
+        columns=NYTAS_TERM_FIELD_NAMES,
+        records=term_counts,
+        types=NYTAS_TERM_COLUMN_TYPES,
+        commit=commit
+    )
+
+
+@task(name="stage_nytas_archive_to_csv", retries=3, retry_delay_seconds=5)
+@instrument("stage")
+def stage_nytas_archive_to_csv(
+    nytas_api_key: str,
+    year: int, 
+    month: int,
+    staging_path: str,
+    streaming: bool = False,
+    cache_dir: str | None = None,
+    terms_staging_path: str | None = None
+) -> None:
+    """Stages headlines for a given 'as at' date to disk (in `.csv` format)
+
+    cf. `extract_nytas_records()` for `streaming` and `cache_dir`. If `terms_staging_path` is provided,
+    the term counts of each headline are staged there too (for the `python_tokenization` mode of `dbt`)
+    """
+    # NB: when streaming, the download is interleaved with (and hence timed as part of) staging
+    with stage_timer("extract"):
+        records = extract_nytas_records(nytas_api_key, year, month, streaming, cache_dir)
+    term_counts = []
     stage(
-        records=filtered_archive,
-        field_names=["headline", "publication_date", "author", "news_desk", "url"],
+        records=observe_records(collect_term_counts(records, term_counts) if terms_staging_path else records),
+        field_names=NYTAS_FIELD_NAMES,
         path=staging_path
     )
-    
+    observe(nbytes=file_size(staging_path))
+    if terms_staging_path:
+        stage(
+            records=term_counts,
+            field_names=NYTAS_TERM_FIELD_NAMES,
+            path=terms_staging_path
+        )
+
+
+@task(name="load_nytas_archive", retries=3, retry_delay_seconds=5, cache_policy=None)
+@instrument("load")
+def load_nytas_archive(
+    conn,
+    nytas_api_key: str,
+    year: int,
+    month: int,
+    streaming: bool = False,
+    cache_dir: str | None = None,
+    staging_path: str | None = None,
+    tokenize: bool = False
+) -> int:
+    """Streams headlines for a given 'as at' date directly into Postgres in binary `COPY` format (i.e.
+    without staging them to disk first)
+
+    If `staging_path` is provided, a copy of the streamed records is also written there (e.g. for
+    debugging or replay via `ingest_nytas_archive`). If `tokenize` is True, the term counts of each
+    headline are loaded into `raw.nytas_terms` too (in the same transaction). Returns the number of
+    records streamed
+    """
+    records = extract_nytas_records(nytas_api_key, year, month, streaming, cache_dir)
+    term_counts = []
+    n_records = ingest_records(
+        conn=conn,
+        schema="raw",
+        table="nytas",
+        columns=NYTAS_FIELD_NAMES,
+        records=collect_term_counts(records, term_counts) if tokenize else records,
+        tee_path=staging_path,
+        types=NYTAS_COLUMN_TYPES,
+        commit=not tokenize
+    )
+    if tokenize:
+        # NB: the terms are only complete once the headlines have been streamed, so they go second
+        load_term_counts(conn, term_counts)
+    observe(rows=n_records)
+    return n_records
+
 
 @task(name="ingest_nytas_archive", cache_policy=None)
+@instrument("ingest")
 def ingest_nytas_archive(
     conn,
-    source_path: str
+    source_path: str,
+    pool: ConnectionPool | None = None,
+    n_workers: int = 1,
+    terms_source_path: str | None = None
 ) -> None:
     """Ingests NYT Archive Search response into Postgres instance
+
+    If `n_workers` > 1, the staged file is split into chunks which are copied over `n_workers`
+    connections (leased from `pool`) at once (cf. `src.data_loader.load.ingest_parallel()`). If
+    `terms_source_path` is provided, the staged term counts of each headline are loaded into
+    `raw.nytas_terms` in the same transaction as the headlines
     """
-    ingest(
-        conn=conn,
-        schema="raw",
-        table="nytas",
-        columns=["headline", "publication_date", "author", "news_desk", "url"],
-        source_path=source_path
+    # NB: the staged file is removed once it has been ingested
+    observe(nbytes=file_size(source_path) + file_size(terms_source_path))
+    if terms_source_path:
+        # NB: copied first, but only committed alongside the headlines (cf. `load_term_counts()`)
+        ingest(
+            conn=conn,
+            schema="raw",
+            table="nytas_terms",
+            columns=NYTAS_TERM_FIELD_NAMES,
+            source_path=terms_source_path,
+            commit=False
+        )
+    if n_workers > 1 and pool is not None:
+        ingest_parallel(
+            conn=conn,
+            pool=pool,
+            schema="raw",
+            table="nytas",
+            columns=NYTAS_FIELD_NAMES,
+            source_path=source_path,
+            n_workers=n_workers
+        )
+    else:
+        ingest(
+            conn=conn,
+            schema="raw",
+            table="nytas",
+            columns=NYTAS_FIELD_NAMES,
+            source_path=source_path
+        )
+    if terms_source_path and not os.path.exists(source_path):
+        os.remove(terms_source_path)
+
+
+@task(name="backfill_nytas_archives", cache_policy=None)
+@instrument("backfill")
+def backfill_nytas_archives(
+    conn,
+    nytas_api_key: str,
+    months: list[tuple[int, int]],
+    staging_dir: str,
+    max_workers: int = 4,
+    cache_dir: str | None = None,
+    direct_load: bool = False,
+    pool: ConnectionPool | None = None,
+    copy_workers: int = 1,
+    tokenize: bool = False
+) -> list[tuple[int, int]]:
+    """Downloads the NYT Archive Search responses of many months concurrently, staging and ingesting
+    each month into Postgres as soon as it has been downloaded
+
+    If `direct_load` is True, each month is streamed straight into Postgres without being staged.
+    Otherwise, each staged month is copied over `copy_workers` connections (leased from `pool`).
+    If `tokenize` is True, the term counts of each headline are loaded into `raw.nytas_terms` too.
+    Returns the months which could not be downloaded or loaded (NB: a failed load is rolled back, so
+    that the remaining months are still loaded over `conn`)
+    """
+    Path(staging_dir).mkdir(parents=True, exist_ok=True)
+
+    def stage_and_ingest(year: int, month: int, nyt_archive: dict) -> None:
+        term_counts = []
+        with stage_timer("extract"):
+            records = nytas_filter_archive(nyt_archive)
+        if tokenize:
+            records = collect_term_counts(records, term_counts)
+        # NB: headlines and their terms are committed in a single transaction (cf. `load_term_counts()`)
+        if direct_load:
+            with stage_timer("load"):
+                ingest_records(
+                    conn=conn,
+                    schema="raw",
+                    table="nytas",
+                    columns=NYTAS_FIELD_NAMES,
+                    records=observe_records(records),
+                    types=NYTAS_COLUMN_TYPES,
+                    commit=not tokenize
+                )
+                if tokenize:
+                    load_term_counts(conn, term_counts)
+        else:
+            staging_path = Path(staging_dir) / f"{year}_{month}_nytas.csv"
+            with stage_timer("stage"):
+                stage(
+                    records=observe_records(records),
+                    field_names=NYTAS_FIELD_NAMES,
+                    path=staging_path
+                )
+                observe(nbytes=file_size(staging_path))
+            if tokenize:
+                load_term_counts(conn, term_counts, commit=False)
+            ingest_nytas_archive.fn(
+                conn=conn,
+                source_path=staging_path,
+                pool=pool,
+                n_workers=copy_workers
+            )
+
+    return nytas_backfill(
+        nytas_api_key,
+        months,
+        process=stage_and_ingest,
+        max_workers=max_workers,
+        cache=ArchiveCache(cache_dir) if cache_dir else None,
+        skip_on=(DatabaseError,)
     )
 
 
+@task(name="pipeline_nytas_archives", cache_policy=None)
+@instrument("pipeline")
+def pipeline_nytas_archives(
+    conn,
+    nytas_api_key: str,
+    months: list[tuple[int, int]],
+    staging_dir: str,
+    max_workers: int = 4,
+    queue_size: int = 1,
+    cache_dir: str | None = None,
+    direct_load: bool = False,
+    pool: ConnectionPool | None = None,
+    copy_workers: int = 1,
+    tokenize: bool = False,
+    dbt_batch_months: int | None = None,
+    full_refresh: bool = False
+) -> list[tuple[int, int]]:
+    """Extracts, stages and loads the NYT Archive Search responses of many months as a pipeline (cf.
+    `src.data_loader.pipeline`) i.e. whilst month N is being copied into Postgres, month N + 1 is being
+    staged and the following months are being downloaded
+
+    At most `queue_size` months are queued in front of each stage, so memory (and staging disk) stays
+    bounded however many months are processed. cf. `backfill_nytas_archives()` for `direct_load`,
+    `copy_workers` and `tokenize`. If `dbt_batch_months` is provided, `dbt` also runs after every
+    `dbt_batch_months` loaded months (and once more for any remaining months). Returns the months which
+    could not be downloaded or loaded (NB: a failed load is rolled back, so `dbt` never runs over it)
+    """
+    Path(staging_dir).mkdir(parents=True, exist_ok=True)
+    cache = ArchiveCache(cache_dir) if cache_dir else None
+    # NB: a capacity of 1 spaces requests evenly rather than bursting at the start of each minute
+    limiter = TokenBucket(NYTAS_REQUESTS_PER_MINUTE, capacity=1)
+    session = nytas_session(max_workers)
+    untransformed_months = []
+
+    def extract(year_month: tuple[int, int], _) -> tuple:
+        year, month = year_month
+        with stage_timer("download"):
+            nyt_archive = nytas_download_archive(session, limiter, nytas_api_key, year, month, cache=cache)
+        term_counts = []
+        with stage_timer("extract"):
+            records = nytas_filter_archive(nyt_archive)
+            if tokenize:
+                records = collect_term_counts(records, term_counts)
+        return records, term_counts
+
+    def stage_month(year_month: tuple[int, int], extracted: tuple) -> tuple:
+        records, term_counts = extracted
+        staging_path = Path(staging_dir) / f"{year_month[0]}_{year_month[1]}_nytas.csv"
+        with stage_timer("stage"):
+            stage(
+                records=observe_records(records),
+                field_names=NYTAS_FIELD_NAMES,
+                path=staging_path
+            )
+            observe(nbytes=file_size(staging_path))
+        return staging_path, term_counts
+
+    def transform() -> None:
+        nonlocal full_refresh
+        trigger_dbt_flow.fn(full_refresh=full_refresh, python_tokenization=tokenize)
+        full_refresh = False
+        untransformed_months.clear()
+
+    def load_month(year_month: tuple[int, int], staged: tuple) -> None:
+        records_or_path, term_counts = staged
+        # NB: headlines and their terms are committed in a single transaction (cf. `load_term_counts()`)
+        if direct_load:
+            with stage_timer("load"):
+                ingest_records(
+                    conn=conn,
+                    schema="raw",
+                    table="nytas",
+                    columns=NYTAS_FIELD_NAMES,
+                    records=observe_records(records_or_path),
+                    types=NYTAS_COLUMN_TYPES,
+                    commit=not tokenize
+                )
+                if tokenize:
+                    load_term_counts(conn, term_counts)
+        else:
+            if tokenize:
+                load_term_counts(conn, term_counts, commit=False)
+            ingest_nytas_archive.fn(
+                conn=conn,
+                source_path=records_or_path,
+                pool=pool,
+                n_workers=copy_workers
+            )
+        # NB: only reached once the month has been committed; a failed load has been rolled back (cf.
+        # `ingest_records()`) and is skipped by `run_pipeline()`, so it is neither transformed nor
+        # holds up the months behind it
+        untransformed_months.append(year_month)
+        # NB: `dbt` runs from the (single) load stage rather than a stage of its own, so that it never
+        # overlaps a `COPY`; rows committed mid-run would otherwise be stamped (via `NOW()`) before the
+        # run's `_etl_loaded_at_date` watermark and skipped by every later incremental run
+        if dbt_batch_months and len(untransformed_months) >= dbt_batch_months:
+            transform()
+
+    stages = [PipelineStage("extract", extract, workers=max_workers)]
+    if not direct_load:
+        stages.append(PipelineStage("stage", stage_month))
+    stages.append(PipelineStage("load", load_month))
+    with session:
+        _, failed = run_pipeline(months, stages, maxsize=queue_size, skip_on=(RequestException, DatabaseError))
+    if dbt_batch_months and untransformed_months:
+        transform()
+    return failed
+
+
 @task
-def trigger_dbt_flow() -> str:
+@instrument("dbt")
+def trigger_dbt_flow(
+    full_refresh: bool = False,
+    python_tokenization: bool = False
+) -> str:
     """Run all dbt models in succession
+
+    Incremental models only process headlines loaded since their last run unless `full_refresh` is
+    True, in which case every model is rebuilt from scratch. If `python_tokenization` is True, terms
+    are read from `raw.nytas_terms` rather than tokenized in Postgres
     """
+    run = "dbt run"
+    if full_refresh:
+        run += " --full-refresh"
+    if python_tokenization:
+        run += " --vars '{python_tokenization: true}'"
     return DbtCoreOperation(
-        commands=["dbt seed", "dbt run"],
+        commands=["dbt seed", run],
         project_dir=PATH_DBT_PROJECT,
         profiles_dir=PATH_DBT_PROFILES
     ).run()
 
 
+@task(name="refresh_term_cube", retries=3, retry_delay_seconds=5, cache_policy=None)
+@instrument("refresh_term_cube")
+def refresh_term_cube(
+    conn,
+    cube_dir: str,
+    year: int,
+    month: int
+) -> None:
+    """Refreshes the local term cube (cf. `src.db.cube`) with the daily counts of the given month
+    """
+    first_day = datetime.date(year, month, 1)
+    last_day = (first_day + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    daily_term_counts = read_sql_typed(
+        conn,
+        sql.SQL(
+            """
+                select
+                    fct_dtc.publication_date,
+                    dim_t.term_id,
+                    fct_dtc.headline_term,
+                    fct_dtc.frequency
+                from dwh.fct_daily_term_counts fct_dtc
+                join dwh.dim_terms dim_t on dim_t.headline_term = fct_dtc.headline_term
+                where fct_dtc.stop_word = 0
+                and fct_dtc.publication_date between {} and {}
+            """
+        ).format(sql.Literal(first_day), sql.Literal(last_day)),
+        dtypes={"publication_date": "datetime64[D]", "term_id": "int32", "frequency": "int64"}
+    )
+    daily_counts = read_sql_typed(
+        conn,
+        sql.SQL(
+            """
+                select
+                    publication_date,
+                    total_frequency
+                from dwh.fct_daily_counts
+                where publication_date between {} and {}
+            """
+        ).format(sql.Literal(first_day), sql.Literal(last_day)),
+        dtypes={"publication_date": "datetime64[D]", "total_frequency": "int64"}
+    )
+    observe(rows=len(daily_term_counts), nbytes=daily_term_counts.memory_usage(deep=True).sum())
+    if daily_counts.empty:
+        return
+    daily_term_counts["headline_term"] = daily_term_counts["headline_term"].fillna("")
+    refresh_cube(cube_dir, daily_term_counts, daily_counts)
+
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""End-to-end benchmarks of the extraction, staging, ingest and fitting stages of the pipeline.
+
+Every benchmark runs against deterministic, synthetic inputs (cf. `benchmarks.synthetic`), so
+results are comparable across machines and commits. See `benchmarks/run.py` for usage.
+"""
@@ -0,0 +1,255 @@
+"""Times the pipeline stages against synthetic inputs and compares the results against a stored baseline.
+
+The following benchmarks are run for every archive size (`--docs`) and term count (`--terms`):
+
+* `filter_archive`: `nytas_filter_archive()` over a synthetic archive
+* `stage`: `stage()` of the filtered records to a pipe-delimited CSV file
+* `ingest`: `ingest()` of the staged file into a throwaway schema (only if `--dbname` is given)
+* `compute_batch_trend`: `compute_batch_trend()` over synthetic logit inputs
+
+Results are written as JSON (cf. `--output`) and compared against `benchmarks/baseline.json`: any
+benchmark which is slower than its baseline by more than `--tolerance` is reported as a regression
+(and the command exits with a non-zero status).
+
+````
+# e.g. run the default suite (the ingest benchmark requires a local, throwaway Postgres instance)
+python -m benchmarks.run --dbname postgres --user postgres --host localhost
+
+# e.g. scale up to 1M docs and record the results as the new baseline
+python -m benchmarks.run --docs 1000 --docs 1000000 --update-baseline
+````
+"""
+import os
+import gc
+import sys
+import json
+import time
+import uuid
+import click
+import platform
+import statistics
+import subprocess
+import datetime
+import tempfile
+import logging
+from pathlib import Path
+from typing import Callable
+from psycopg2 import sql
+from src.db.utils import open_connection
+from src.data_loader import nytas_filter_archive, stage, ingest
+from src.model.algorithm import compute_batch_trend
+from benchmarks.synthetic import synthetic_archive, synthetic_logit_inputs
+
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS_DIR = Path(__file__).parent
+PATH_BASELINE = BENCHMARKS_DIR / "baseline.json"
+PATH_RESULTS = BENCHMARKS_DIR.parent / "staging" / "benchmarks" / "results.json"
+
+# NB: mirrors the DDL of `raw.nytas` (cf. `src/db/init.sql`)
+NYTAS_DDL = """
+CREATE TABLE {}.nytas (
+    headline TEXT,
+    publication_date TIMESTAMP,
+    author VARCHAR(1000),
+    news_desk VARCHAR(100),
+    url VARCHAR(2083),
+    _etl_loaded_at_date TIMESTAMP DEFAULT NOW()
+)
+"""
+
+
+def measure(
+    fn: Callable[[], object],
+    repeat: int = 3,
+    setup: Callable[[], None] | None = None
+) -> list[float]:
+    """Times `repeat` calls of `fn` (running `setup`, untimed, before each one).
+
+    :return: the wall time of each call in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(
+    timings: list[float],
+    n_items: int
+) -> dict:
+    return {
+        "seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "repeat": len(timings),
+        "items": n_items,
+        "items_per_second": n_items / min(timings)
+    }
+
+
+def bench_extract_and_stage(
+    n_docs: int,
+    repeat: int,
+    conn=None
+) -> dict:
+    """Benchmarks `nytas_filter_archive`, `stage` and (given a connection) `ingest` for an archive of
+    `n_docs` articles.
+    """
+    results = {}
+    archive = synthetic_archive(n_docs)
+    records = nytas_filter_archive(archive)
+    results[f"filter_archive[docs={n_docs}]"] = summarize(measure(lambda: nytas_filter_archive(archive), repeat), n_docs)
+
+    field_names = list(records[0])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "nytas.csv"
+        results[f"stage[docs={n_docs}]"] = summarize(measure(lambda: stage(records, field_names, path), repeat), n_docs)
+        if conn is None:
+            return results
+
+        schema = f"bench_{uuid.uuid4().hex[:8]}"
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(schema)))
+            cursor.execute(sql.SQL(NYTAS_DDL).format(sql.Identifier(schema)))
+        conn.commit()
+        try:
+            # NB: `ingest` removes the staged file on success, so it is re-staged (untimed) every time
+            timings = measure(
+                lambda: ingest(conn, schema, "nytas", field_names, path),
+                repeat,
+                setup=lambda: stage(records, field_names, path)
+            )
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("SELECT count(*) FROM {}.nytas").format(sql.Identifier(schema)))
+                n_rows = cursor.fetchone()[0]
+            if n_rows != n_docs * repeat:
+                raise RuntimeError(f"Expected {n_docs * repeat} rows to be ingested but found {n_rows}")
+            results[f"ingest[docs={n_docs}]"] = summarize(timings, n_docs)
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("DROP SCHEMA {} CASCADE").format(sql.Identifier(schema)))
+            conn.commit()
+    return results
+
+
+def bench_fitting(
+    n_terms: int,
+    repeat: int,
+    engine: str = "irls"
+) -> dict:
+    """Benchmarks `compute_batch_trend` over `n_terms` terms (in a six month window).
+    """
+    logit_inputs = synthetic_logit_inputs(n_terms)
+    timings = measure(lambda: compute_batch_trend(logit_inputs, engine=engine), repeat)
+    return {f"compute_batch_trend[terms={n_terms},engine={engine}]": summarize(timings, n_terms)}
+
+
+def environment() -> dict:
+    """Describes the machine (and commit) on which the benchmarks ran.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    tolerance: float
+) -> list[str]:
+    """Compares `results` against `baseline`, echoing one line per benchmark.
+
+    :return: names of the benchmarks which regressed by more than `tolerance`
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            click.echo(f"{name:<55} {result['seconds']:>10.4f}s {'(no baseline)':>14}")
+            continue
+        ratio = result["seconds"] / reference["seconds"]
+        status = "REGRESSION" if ratio > 1 + tolerance else "ok"
+        if status == "REGRESSION":
+            regressions.append(name)
+        click.echo(f"{name:<55} {result['seconds']:>10.4f}s {ratio:>13.2f}x {status}")
+    return regressions
+
+
+@click.command
+@click.option("--docs", "docs", type=int, multiple=True, default=(1_000, 10_000, 100_000), help="Number of articles per synthetic archive")
+@click.option("--terms", "terms", type=int, multiple=True, default=(100, 1_000, 10_000), help="Number of terms to fit")
+@click.option("--repeat", type=int, default=3, help="Number of timed runs per benchmark (the fastest is reported)")
+@click.option("--dbname", default=None, help="Throwaway Postgres database for the ingest benchmark (skipped if omitted)")
+@click.option("--user", default="postgres", help="Postgres user")
+@click.option("--password", envvar="POSTGRES_PASSWORD", default="", help="Postgres password (or $POSTGRES_PASSWORD)")
+@click.option("--host", default="localhost", help="Postgres host")
+@click.option("--port", type=int, default=5432, help="Postgres port")
+@click.option("--output", type=click.Path(path_type=Path), default=PATH_RESULTS, help="Path to write results (JSON) to")
+@click.option("--baseline", type=click.Path(path_type=Path), default=PATH_BASELINE, help="Path to the baseline results (JSON)")
+@click.option("--tolerance", type=float, default=0.25, help="Permitted slowdown relative to the baseline e.g. 0.25 (i.e. 25%)")
+@click.option("--update-baseline", is_flag=True, help="Overwrite the baseline with these results")
+def run_benchmarks(
+    docs: tuple[int, ...],
+    terms: tuple[int, ...],
+    repeat: int,
+    dbname: str | None,
+    user: str,
+    password: str,
+    host: str,
+    port: int,
+    output: Path,
+    baseline: Path,
+    tolerance: float,
+    update_baseline: bool
+) -> None:
+    conn = open_connection(dbname, user, password, host, port) if dbname else None
+    if dbname and conn is None:
+        raise click.ClickException(f"Unable to connect to '{dbname}' @ {host}:{port}")
+
+    results = {}
+    try:
+        for n_docs in docs:
+            results.update(bench_extract_and_stage(n_docs, repeat, conn))
+        for n_terms in terms:
+            results.update(bench_fitting(n_terms, repeat))
+    finally:
+        if conn is not None:
+            conn.close()
+
+    report = {"environment": environment(), "results": results}
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    click.echo(f"Wrote results to '{output}'")
+
+    reference = json.loads(baseline.read_text())["results"] if baseline.exists() else {}
+    regressions = compare(results, reference, tolerance)
+    if update_baseline:
+        # NB: benchmarks which were not run this time keep their previous baseline
+        report["results"] = {**reference, **results}
+        baseline.write_text(json.dumps(report, indent=2) + "\n")
+        click.echo(f"Updated baseline @ '{baseline}'")
+    elif regressions:
+        click.echo(f"{len(regressions)} benchmark(s) regressed by more than {tolerance:.0%}", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmarks()
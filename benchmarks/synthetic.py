@@ -0,0 +1,147 @@
+"""Deterministic generators of synthetic NYTAS archives and logit inputs.
+
+Archives match the shape of a (raw) NYTAS response as consumed by `nytas_filter_archive()` and
+`nytas_iter_docs()`, i.e. `{"response": {"docs": [...]}}` where each article carries `headline.main`,
+`pub_date`, `byline.original`, `news_desk` and `web_url`. Headline terms are drawn from a synthetic
+vocabulary with Zipfian frequencies so that term counts resemble those of real headlines.
+
+The same `seed` always yields the same output (on any machine), so benchmarks are reproducible.
+"""
+import datetime
+import calendar
+import numpy as np
+import pandas as pd
+
+
+SYLLABLES = np.array([
+    "ba", "ce", "di", "fo", "gu", "ha", "je", "ki", "lo", "mu", "na", "pe", "qui", "ro", "su",
+    "ta", "ve", "wi", "xo", "yu", "za", "bri", "cla", "dre", "fla", "gro", "pla", "tri", "sto", "spe"
+])
+NEWS_DESKS = np.array([
+    "Politics", "Foreign", "Business", "Culture", "Sports", "OpEd", "Science", "Metro", "Styles", ""
+])
+STOP_WORDS = np.array(["the", "a", "of", "to", "in", "and", "for", "on", "is", "with"])
+
+
+def synthetic_vocabulary(
+    n_terms: int,
+    seed: int = 0
+) -> np.ndarray:
+    """Generates `n_terms` distinct, lower-case pseudo-words.
+
+    :param n_terms: size of the vocabulary
+    :param seed: random seed, defaults to 0
+    :return: an array of (unique) terms
+    """
+    rng = np.random.default_rng(seed)
+    terms = {}
+    while len(terms) < n_terms:
+        # NB: draw candidates in bulk (of up to four syllables) and keep the first occurrence of each
+        syllables = rng.integers(0, len(SYLLABLES) + 1, size=(2 * n_terms, 4))
+        syllables[:, :2] %= len(SYLLABLES)
+        candidates = np.concatenate([SYLLABLES, [""]])[syllables]
+        for term in np.char.add(np.char.add(candidates[:, 0], candidates[:, 1]), np.char.add(candidates[:, 2], candidates[:, 3])):
+            terms.setdefault(str(term), None)
+    return np.array(list(terms)[:n_terms], dtype=object)
+
+
+def synthetic_headlines(
+    n_docs: int,
+    vocabulary: np.ndarray,
+    rng: np.random.Generator,
+    min_length: int = 4,
+    max_length: int = 12
+) -> list[str]:
+    """Draws `n_docs` headlines from `vocabulary` (with Zipfian term frequencies), interspersed with
+    stop words, numerals and punctuation so that tokenization does real work.
+    """
+    lengths = rng.integers(min_length, max_length + 1, size=n_docs)
+    n_words = int(lengths.sum())
+    weights = 1 / np.arange(1, len(vocabulary) + 1)
+    words = vocabulary[rng.choice(len(vocabulary), size=n_words, p=weights / weights.sum())]
+    kind = rng.random(n_words)
+    words = np.where(kind < 0.25, STOP_WORDS[rng.integers(0, len(STOP_WORDS), size=n_words)], words)
+    words = np.where(kind > 0.98, rng.integers(1, 2_025, size=n_words).astype(str), words)
+    words = np.where((kind > 0.9) & (kind <= 0.95), np.char.add(words.astype(str), "’s"), words)
+    words = np.char.capitalize(words.astype(str))
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(words[start:end]) + ":" * (i % 7 == 0) for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+def synthetic_archive(
+    n_docs: int,
+    year: int = 2024,
+    month: int = 1,
+    n_terms: int = 20_000,
+    seed: int = 0
+) -> dict:
+    """Generates a synthetic NYTAS archive of `n_docs` articles published in the given year and month.
+
+    :param n_docs: number of articles (e.g. 1k to 1M)
+    :param year: year of publication, defaults to 2024
+    :param month: month of publication, defaults to 1
+    :param n_terms: size of the headline vocabulary, defaults to 20,000
+    :param seed: random seed, defaults to 0
+    :return: a dictionary-encoded archive in the shape of the NYTAS response
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = synthetic_vocabulary(n_terms, seed=seed)
+    headlines = synthetic_headlines(n_docs, vocabulary, rng)
+    first = datetime.datetime(year, month, 1)
+    seconds = np.sort(rng.integers(0, calendar.monthrange(year, month)[1] * 86_400, size=n_docs))
+    pub_dates = (np.datetime64(first, "s") + seconds.astype("timedelta64[s]")).astype(str).tolist()
+    desks = NEWS_DESKS[rng.integers(0, len(NEWS_DESKS), size=n_docs)].tolist()
+    authors = vocabulary[rng.integers(0, len(vocabulary), size=(n_docs, 2))].tolist()
+    docs = [
+        {
+            "abstract": headline,
+            "web_url": f"https://www.nytimes.com/{year}/{month:02d}/{i % 28 + 1:02d}/synthetic/article-{seed}-{i}.html",
+            "headline": {"main": headline, "kicker": None, "print_headline": headline},
+            "pub_date": f"{pub_date}+0000",
+            "news_desk": desk,
+            "byline": {"original": f"By {first_name.title()} {last_name.title()}"},
+            "word_count": int(i % 2_000)
+        }
+        for i, (headline, pub_date, desk, (first_name, last_name)) in enumerate(zip(headlines, pub_dates, desks, authors))
+    ]
+    return {
+        "copyright": "Synthetic archive (not affiliated with The New York Times Company)",
+        "response": {"docs": docs, "meta": {"hits": n_docs}}
+    }
+
+
+def synthetic_logit_inputs(
+    n_terms: int,
+    n_days: int = 184,
+    seed: int = 0
+) -> pd.DataFrame:
+    """Simulates logit inputs (i.e. daily successes and failures with a random trend per term) in the
+    shape of the `get_logit_inputs` task.
+
+    :param n_terms: number of distinct terms
+    :param n_days: number of days in the modelling window, defaults to 184 (i.e. six months)
+    :param seed: random seed, defaults to 0
+    :return: a `pd.DataFrame` object with fields `publication`, `term_id`, `cum_time_elapsed`,
+             `successes` and `failures`
+    """
+    rng = np.random.default_rng(seed)
+    daily_totals = rng.integers(40_000, 60_000, size=n_days)
+    intercepts = rng.uniform(-9, -5, size=n_terms)
+    slopes = rng.normal(0, 0.01, size=n_terms)
+    # NB: each term appears on a random subset of days (at least 20) as in `fct_logit_inputs`
+    present = rng.random((n_terms, n_days)) < rng.uniform(0.2, 1.0, size=(n_terms, 1))
+    present[:, rng.choice(n_days, size=min(20, n_days), replace=False)] = True
+    term_idx, days = np.nonzero(present)
+    logit = intercepts[term_idx] + slopes[term_idx] * days
+    successes = rng.binomial(daily_totals[days], 1 / (1 + np.exp(-logit))) + 1
+    return pd.DataFrame({
+        "publication": "NYT",
+        "term_id": (term_idx + 1).astype(np.int32),
+        "cum_time_elapsed": days,
+        "successes": successes,
+        "failures": daily_totals[days] - successes
+    })
+
+
+if __name__ == "__main__":
+    pass
@@ -1,14 +1,49 @@
 """Responsible for ingesting data from publication outlets into the Postgres `db` service.
+
+NB: the public API is imported lazily (PEP 562), so importing the package does not import `requests`,
+`psycopg2` or `pandas` until e.g. `stage` or `ingest` is first accessed.
 """
-from .extract import (
-    nytas_extract_archive,
-    nytas_filter_archive,
-    stage
-)
-from .load import (
-    ingest
-)
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .extract import (
+        nytas_extract_archive,
+        nytas_filter_archive,
+        nytas_stream_archive,
+        nytas_filter_docs,
+        stage
+    )
+    from .load import (
+        ingest,
+        ingest_records,
+        RecordStream
+    )
+
+LAZY_ATTRIBUTES = {
+    "nytas_extract_archive": ".extract",
+    "nytas_filter_archive": ".extract",
+    "nytas_stream_archive": ".extract",
+    "nytas_filter_docs": ".extract",
+    "stage": ".extract",
+    "ingest": ".load",
+    "ingest_records": ".load",
+    "RecordStream": ".load"
+}
+__all__ = list(LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
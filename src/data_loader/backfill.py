@@ -0,0 +1,211 @@
+"""Concurrent, rate-limited extraction of many NYTAS monthly archives (i.e. a 'backfill').
+
+Archives are downloaded by a pool of threads sharing a single (connection pooled) HTTP session.
+Every request draws from a token bucket which matches the per-minute quota of the NYT API and
+throttled (429) or failed (5xx) requests are retried with exponential backoff. Downloaded archives
+are handed back to the calling thread as soon as they complete, so that staging (and loading) of
+one month overlaps with the download of the next.
+"""
+import time
+import json
+import gzip
+import zlib
+import random
+import threading
+import requests
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable
+from requests.adapters import HTTPAdapter
+from .extract import nytas_construct_url
+from .cache import ArchiveCache
+
+
+logger = logging.getLogger(__name__)
+
+# NB: see https://developer.nytimes.com/faq (5 requests per minute and 500 requests per day)
+NYTAS_REQUESTS_PER_MINUTE = 5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# NB: raised when reading a truncated or otherwise corrupt cached archive (e.g. `gzip.BadGzipFile` is
+# an `OSError` and `json.JSONDecodeError` a `ValueError`)
+CORRUPT_ARCHIVE_ERRORS = (OSError, EOFError, ValueError, zlib.error)
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    :param rate_per_minute: number of tokens replenished per minute
+    :param capacity: maximum number of tokens that can accumulate (i.e. the burst size), defaults
+                     to `rate_per_minute`
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        capacity: float | None = None
+    ):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and consumes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def nytas_session(
+    pool_size: int = 4
+) -> requests.Session:
+    """Creates an HTTP session whose connection pool is shared across download threads.
+
+    :param pool_size: maximum number of pooled connections, defaults to 4
+    :return: a `requests.Session` object
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def nytas_months(
+    start_year: int,
+    start_month: int,
+    end_year: int,
+    end_month: int
+) -> list[tuple[int, int]]:
+    """Lists every (year, month) between the given start and end months (inclusive).
+    """
+    return [
+        (i // 12, i % 12 + 1)
+        for i in range(start_year * 12 + start_month - 1, end_year * 12 + end_month)
+    ]
+
+
+def nytas_download_archive(
+    session: requests.Session,
+    limiter: TokenBucket,
+    api_key: str,
+    year: int,
+    month: int,
+    max_retries: int = 5,
+    backoff_seconds: float = 15.0,
+    cache: ArchiveCache | None = None
+) -> dict:
+    """Downloads the NYTAS archive for a given year and month, respecting the rate limit of `limiter`.
+
+    Throttled (429) and server error (5xx) responses are retried with exponential backoff (or after
+    the delay prescribed by the `Retry-After` header, where available).
+
+    :param session: HTTP session (cf. `nytas_session()`)
+    :param limiter: rate limiter shared across all download threads
+    :param api_key: API key
+    :param year: year of interest
+    :param month: month of interest
+    :param max_retries: maximum number of retries, defaults to 5
+    :param backoff_seconds: initial backoff, which doubles with every retry, defaults to 15.0
+    :param cache: optional on-disk cache of raw responses (cf. `ArchiveCache`); cached archives of closed
+                  months neither consume a request from `limiter` nor count towards the API quota
+    :return: a dictionary-encoded collection of name-value pairs in the JSON response
+    :raises requests.RequestException: if the archive could not be downloaded
+    :raises CORRUPT_ARCHIVE_ERRORS: if the cached archive is corrupt (once it has been evicted from `cache`)
+    """
+    url = nytas_construct_url(year, month)
+
+    def request(headers: dict) -> requests.Response:
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            res = session.get(url, params={'api-key': api_key}, headers=headers, stream=True)
+            if res.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return res
+            res.close()
+            retry_after = res.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff_seconds * 2 ** attempt
+            delay *= random.uniform(1.0, 1.25)
+            logger.warning(f"NYT 'Archive Search' responded {res.status_code} for {year}-{month:02d}; retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+    if cache:
+        path = cache.fetch(request, "v1", year, month)
+        try:
+            with gzip.open(path, "rb") as gz:
+                return json.load(gz)
+        except CORRUPT_ARCHIVE_ERRORS:
+            cache.evict("v1", year, month)
+            raise
+    with request({}) as res:
+        res.raise_for_status()
+        return res.json()
+
+
+def nytas_backfill(
+    api_key: str,
+    months: list[tuple[int, int]],
+    process: Callable[[int, int, dict], None],
+    max_workers: int = 4,
+    requests_per_minute: float = NYTAS_REQUESTS_PER_MINUTE,
+    cache: ArchiveCache | None = None,
+    skip_on: tuple[type[Exception], ...] = ()
+) -> list[tuple[int, int]]:
+    """Downloads the archives of `months` concurrently and passes each one to `process` (in the calling
+    thread) as soon as it has been downloaded.
+
+    At most `2 * max_workers` archives are in flight (or awaiting processing) at any one time, which
+    bounds memory usage when processing is slower than downloading.
+
+    :param api_key: API key
+    :param months: list of (year, month) tuples (cf. `nytas_months()`)
+    :param process: callable invoked with `(year, month, nyt_archive)` e.g. to stage and load the archive
+    :param max_workers: number of download threads, defaults to 4
+    :param requests_per_minute: request quota of the NYT API, defaults to `NYTAS_REQUESTS_PER_MINUTE`
+    :param cache: optional on-disk cache of raw responses (cf. `ArchiveCache`), defaults to None
+    :param skip_on: exceptions raised by `process` upon which a month is recorded as failed rather than
+                    the backfill stopped (e.g. a failed load), defaults to ()
+    :return: list of (year, month) tuples that could not be downloaded (or processed)
+    """
+    # NB: a capacity of 1 spaces requests evenly rather than bursting at the start of each minute
+    limiter = TokenBucket(requests_per_minute, capacity=1)
+    session = nytas_session(max_workers)
+    pending_months = list(reversed(months))
+    failed = []
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        while pending_months or in_flight:
+            while pending_months and len(in_flight) < 2 * max_workers:
+                year, month = pending_months.pop()
+                future = executor.submit(nytas_download_archive, session, limiter, api_key, year, month, cache=cache)
+                in_flight[future] = (year, month)
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                year, month = in_flight.pop(future)
+                try:
+                    nyt_archive = future.result()
+                except requests.RequestException as err:
+                    logger.error(f"Bad API request to NYT 'Archive Search' for {year}-{month:02d}: '{err}'")
+                    failed.append((year, month))
+                    continue
+                except CORRUPT_ARCHIVE_ERRORS as err:
+                    logger.error(f"Corrupt cached archive of NYT 'Archive Search' for {year}-{month:02d}; evicted: '{err}'")
+                    failed.append((year, month))
+                    continue
+                try:
+                    process(year, month, nyt_archive)
+                except skip_on as err:
+                    logger.error(f"Failed to process the archive of {year}-{month:02d}: '{err}'")
+                    failed.append((year, month))
+    return failed
+
+
+if __name__ == "__main__":
+    pass
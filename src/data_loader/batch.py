@@ -0,0 +1,190 @@
+"""Columnar representation of a filtered NYTAS archive (cf. `nytas_filter_archive()`).
+
+Rather than one dictionary (and one `datetime` object) per article, an `ArchiveBatch` holds one array
+per field:
+
+* `headline`, `author` and `url` as object arrays of strings
+* `publication_date` as a `datetime64[s]` array of local (i.e. as published) wall times alongside
+  `utc_offset`, the offset of each date from UTC in minutes, both parsed in a single vectorized pass
+* `news_desk` as integer codes into `news_desks`, so each distinct desk is stored (and interned) once
+  (with null desks coded as the trailing `None` of `news_desks`)
+
+Consumers which only need records (e.g. `nytas_count_terms()`) can still iterate over a batch, which
+yields the same dictionaries as `nytas_filter_article()`, whilst `stage()` and `ingest_records()`
+consume the arrays directly.
+"""
+import csv
+import sys
+import datetime
+import numpy as np
+import pandas as pd
+from typing import Iterable, Iterator, TextIO
+
+
+NYTAS_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+def nytas_normalize_dates(
+    raw_dates: Iterable[str]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Parses raw NYTAS publication dates (e.g. "2022-09-01T00:25:54+0000") in a single vectorized pass.
+
+    Only the (few) distinct UTC offsets are parsed one at a time, with the same strictness as
+    `nytas_transform_date()`.
+
+    :param raw_dates: raw (publication) dates as strings
+    :return: a tuple of (a) the local wall times as `datetime64[s]` and (b) their offsets from UTC in minutes
+    :raises ValueError: if any date does not match `NYTAS_DATE_FORMAT`
+    """
+    raw = pd.Series(raw_dates, dtype=object)
+    wall_times = pd.to_datetime(raw.str[:19], format="%Y-%m-%dT%H:%M:%S").to_numpy(dtype="datetime64[s]")
+    codes, suffixes = pd.factorize(raw.str[19:])
+    offsets = np.array(
+        [datetime.datetime.strptime(f"2000-01-01T00:00:00{suffix}", NYTAS_DATE_FORMAT).utcoffset() // datetime.timedelta(minutes=1) for suffix in suffixes],
+        dtype=np.int16
+    )
+    return wall_times, offsets[codes] if len(raw) else np.zeros(0, dtype=np.int16)
+
+
+def nytas_format_dates(
+    wall_times: np.ndarray,
+    utc_offset: np.ndarray
+) -> np.ndarray:
+    """Formats local wall times (and their UTC offsets) in ISO format e.g. "2022-09-01T00:25:54+00:00"
+    (i.e. the same output as `nytas_transform_date()`).
+    """
+    codes, offsets = pd.factorize(utc_offset)
+    suffixes = np.array([f"{'-' if offset < 0 else '+'}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}" for offset in offsets], dtype=str)
+    return np.char.add(np.datetime_as_string(wall_times, unit="s"), suffixes[codes] if len(codes) else "")
+
+
+class ArchiveBatch:
+    """Filtered NYTAS archive records held as parallel arrays (one per field).
+
+    :param headline: main headline of each article
+    :param publication_date: local wall time of publication (cf. `nytas_normalize_dates()`)
+    :param utc_offset: offset of each publication date from UTC in minutes
+    :param author: author of each article (without the 'By ' prefix)
+    :param news_desk_codes: code of the news desk of each article (i.e. an index into `news_desks`)
+    :param news_desks: distinct news desks
+    :param url: URL of each article
+    """
+
+    FIELD_NAMES = ["headline", "publication_date", "author", "news_desk", "url"]
+
+    def __init__(
+        self,
+        headline: np.ndarray,
+        publication_date: np.ndarray,
+        utc_offset: np.ndarray,
+        author: np.ndarray,
+        news_desk_codes: np.ndarray,
+        news_desks: np.ndarray,
+        url: np.ndarray
+    ):
+        self.headline = headline
+        self.publication_date = publication_date
+        self.utc_offset = utc_offset
+        self.author = author
+        self.news_desk_codes = news_desk_codes
+        self.news_desks = news_desks
+        self.url = url
+
+    @classmethod
+    def from_articles(
+        cls,
+        articles: Iterable[dict]
+    ) -> "ArchiveBatch":
+        """Filters `articles` (from `response.docs`) into a batch in a single pass.
+
+        :raises KeyError: if an article is missing any of the relevant fields
+        """
+        headlines, raw_dates, authors, desks, urls = [], [], [], [], []
+        for article in articles:
+            headlines.append(article["headline"]["main"])
+            raw_dates.append(article["pub_date"])
+            authors.append(article["byline"]["original"])
+            desks.append(article["news_desk"])
+            urls.append(article["web_url"])
+        publication_date, utc_offset = nytas_normalize_dates(raw_dates)
+        codes, news_desks = pd.factorize(pd.Series(desks, dtype=object))
+        # NB: null desks (code -1) map to a trailing `None` (rather than `NaN`), which `stage()` writes
+        # as an empty field just like a `None` in a record
+        codes[codes == -1] = len(news_desks)
+        news_desks = [sys.intern(desk) for desk in news_desks] + [None]
+        return cls(
+            headline=np.array(headlines, dtype=object),
+            publication_date=publication_date,
+            utc_offset=utc_offset,
+            author=np.array([author.replace("By ", "") for author in authors], dtype=object),
+            news_desk_codes=codes.astype(np.int32),
+            news_desks=np.array(news_desks, dtype=object),
+            url=np.array(urls, dtype=object)
+        )
+
+    def __len__(self) -> int:
+        return len(self.headline)
+
+    def column(
+        self,
+        name: str
+    ) -> np.ndarray:
+        """Returns field `name` in the same format as `nytas_filter_article()`.
+        """
+        if name == "publication_date":
+            return nytas_format_dates(self.publication_date, self.utc_offset)
+        if name == "news_desk":
+            return self.news_desks[self.news_desk_codes]
+        if name in ("headline", "author", "url"):
+            return getattr(self, name)
+        raise KeyError(name)
+
+    def __iter__(self) -> Iterator[dict]:
+        columns = [self.column(name) for name in self.FIELD_NAMES]
+        for values in zip(*columns):
+            yield dict(zip(self.FIELD_NAMES, (str(value) if isinstance(value, np.str_) else value for value in values)))
+
+    def __getitem__(
+        self,
+        i: int
+    ) -> dict:
+        return {
+            "headline": self.headline[i],
+            "publication_date": str(nytas_format_dates(self.publication_date[i:i + 1], self.utc_offset[i:i + 1])[0]),
+            "author": self.author[i],
+            "news_desk": self.news_desks[self.news_desk_codes[i]],
+            "url": self.url[i]
+        }
+
+    def to_frame(
+        self,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        """Returns (a subset of) the batch as a `pd.DataFrame`, where `publication_date` holds the local
+        wall times (i.e. as stored in a `timestamp` column when staged records are loaded via `COPY`,
+        which ignores their UTC offsets).
+        """
+        fields = {
+            "headline": self.headline,
+            "publication_date": self.publication_date,
+            "author": self.author,
+            "news_desk": self.column("news_desk"),
+            "url": self.url
+        }
+        return pd.DataFrame({name: fields[name] for name in columns or self.FIELD_NAMES})
+
+    def write_csv(
+        self,
+        fp: TextIO,
+        field_names: list[str] | None = None
+    ) -> None:
+        """Writes the batch (header included) in the pipe-delimited CSV format of `stage()`.
+        """
+        field_names = field_names or self.FIELD_NAMES
+        writer = csv.writer(fp, delimiter="|")
+        writer.writerow(field_names)
+        writer.writerows(zip(*(self.column(name) for name in field_names)))
+
+
+if __name__ == "__main__":
+    pass
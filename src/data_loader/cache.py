@@ -0,0 +1,204 @@
+"""On-disk cache of raw NYTAS archive responses.
+
+Responses are stored gzip-compressed and content-addressed (i.e. named after the SHA-256 digest of
+the raw response body) under `<root>/objects`, whilst `<root>/index.json` maps each
+`(version, year, month)` key to its object and HTTP validators (`ETag` / `Last-Modified`):
+
+* archives of 'closed' months (i.e. months that ended at least `closed_after_days` ago) are
+  treated as immutable and served without contacting the API at all
+* archives of open months are revalidated with a conditional request (a `304 Not Modified`
+  response is served from the cache)
+* once the cache exceeds `max_bytes`, the least recently used entries are evicted
+
+The cache is safe to share between threads (e.g. during a backfill) but not between processes.
+"""
+import os
+import json
+import gzip
+import hashlib
+import datetime
+import tempfile
+import threading
+import logging
+from pathlib import Path
+from typing import Callable, Iterator
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveCache:
+    """Content-addressed, size-bounded (LRU) cache of raw archive responses located at `root`.
+
+    :param root: root directory of the cache (created if it does not exist)
+    :param max_bytes: maximum (compressed) size of the cache, defaults to 2GiB
+    :param closed_after_days: number of days after the end of a month beyond which its archive is
+                              treated as immutable, defaults to 7
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        max_bytes: int = 2 * 1024 ** 3,
+        closed_after_days: int = 7
+    ):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.json"
+        self.max_bytes = max_bytes
+        self.closed_after_days = closed_after_days
+        self.lock = threading.Lock()
+        self.index = json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+
+    def is_closed(
+        self,
+        year: int,
+        month: int,
+        today: datetime.date | None = None
+    ) -> bool:
+        """Determines whether the archive of the given month can no longer change.
+        """
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        return (today or datetime.date.today()) >= next_month + datetime.timedelta(days=self.closed_after_days)
+
+    def object_path(
+        self,
+        digest: str
+    ) -> Path:
+        return self.objects / f"{digest}.json.gz"
+
+    def fetch(
+        self,
+        request: Callable[[dict], requests.Response],
+        version: str,
+        year: int,
+        month: int
+    ) -> Path:
+        """Returns the path to the (compressed) archive of the given month, only issuing `request`
+        where the cache does not hold an immutable copy.
+
+        :param request: callable which issues the HTTP request with the given (conditional) headers
+                        e.g. `lambda headers: session.get(url, headers=headers, stream=True)`
+        :param version: version tag of the API e.g. 'v1'
+        :param year: year of interest
+        :param month: month of interest
+        :return: path to a gzip-compressed copy of the raw response body
+        :raises requests.RequestException: if the archive is not cached and cannot be downloaded
+        """
+        key = f"{version}/{year}/{month}"
+        with self.lock:
+            entry = self.index.get(key)
+        headers = {}
+        if entry and self.object_path(entry["digest"]).exists():
+            if entry["immutable"]:
+                self._touch(key)
+                return self.object_path(entry["digest"])
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with request(headers) as res:
+            if res.status_code == 304 and headers:
+                logger.info(f"Archive '{key}' not modified; serving from cache @ '{self.root}'")
+                self._touch(key)
+                return self.object_path(entry["digest"])
+            res.raise_for_status()
+            digest, size = self._write(res.iter_content(chunk_size=2 ** 16))
+            with self.lock:
+                self.index[key] = {
+                    "digest": digest,
+                    "size": size,
+                    "etag": res.headers.get("ETag"),
+                    "last_modified": res.headers.get("Last-Modified"),
+                    "immutable": self.is_closed(year, month),
+                    "last_access": datetime.datetime.now().timestamp()
+                }
+                self._evict()
+                self._save_index()
+        return self.object_path(digest)
+
+    def evict(
+        self,
+        version: str,
+        year: int,
+        month: int
+    ) -> None:
+        """Evicts the archive of the given month (e.g. once its object turned out to be corrupt), so that
+        it is downloaded afresh by the next `fetch()`.
+        """
+        key = f"{version}/{year}/{month}"
+        with self.lock:
+            entry = self.index.pop(key, None)
+            if entry is None:
+                return
+            if all(other["digest"] != entry["digest"] for other in self.index.values()):
+                self.object_path(entry["digest"]).unlink(missing_ok=True)
+            self._save_index()
+        logger.info(f"Evicted archive '{key}' from cache @ '{self.root}'")
+
+    def _write(
+        self,
+        chunks: Iterator[bytes]
+    ) -> tuple[str, int]:
+        """Streams `chunks` into a compressed object, returning its digest and (compressed) size.
+        """
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp, gzip.GzipFile(fileobj=fp, mode="wb", mtime=0) as gz:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    gz.write(chunk)
+            digest = sha256.hexdigest()
+            os.replace(tmp_path, self.object_path(digest))
+        except BaseException:
+            # NB: e.g. a dropped download; partial objects are never indexed (nor counted towards `max_bytes`)
+            os.unlink(tmp_path)
+            raise
+        return digest, self.object_path(digest).stat().st_size
+
+    def _touch(
+        self,
+        key: str
+    ) -> None:
+        with self.lock:
+            self.index[key]["last_access"] = datetime.datetime.now().timestamp()
+            self._save_index()
+
+    def _evict(self) -> None:
+        """Evicts least recently used entries until the cache fits within `max_bytes` (NB: objects
+        are only deleted once no key references them).
+        """
+        sizes = {entry["digest"]: entry["size"] for entry in self.index.values()}
+        total = sum(sizes.values())
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes or len(self.index) == 1:
+                break
+            del self.index[key]
+            if all(other["digest"] != entry["digest"] for other in self.index.values()):
+                self.object_path(entry["digest"]).unlink(missing_ok=True)
+                total -= entry["size"]
+            logger.info(f"Evicted archive '{key}' from cache @ '{self.root}'")
+
+    def _save_index(self) -> None:
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(self.index))
+        os.replace(tmp_path, self.index_path)
+
+
+def iter_cached_chunks(
+    path: str | Path,
+    chunk_size: int = 2 ** 16
+) -> Iterator[bytes]:
+    """Reads a cached (compressed) archive back as raw byte chunks (cf. `nytas_iter_docs()`).
+    """
+    with gzip.open(path, "rb") as gz:
+        while chunk := gz.read(chunk_size):
+            yield chunk
+
+
+if __name__ == "__main__":
+    pass
@@ -6,7 +6,15 @@ Note that "New York Times 'Archive Search'" is often abbreviated to "NYTAS" for
 import requests
 import logging
 import csv
+import json
+import codecs
+import re
+import gzip
 from pathlib import Path
+from typing import Iterable, Iterator
+from src.monitoring.profiling import profiled
+from .cache import ArchiveCache, iter_cached_chunks
+from .batch import ArchiveBatch
 from .transform import (
     nytas_transform_author,
     nytas_transform_date
@@ -15,6 +23,11 @@ from .transform import (
 
 logger = logging.getLogger(__name__)
 
+# NB: matches the opening of the `response.docs` array (an unescaped `"docs"` followed by `:` can 
+# only ever be an object key in valid JSON)
+DOCS_ARRAY_PATTERN = re.compile(r'"docs"\s*:\s*\[')
+DOCS_SEPARATOR_PATTERN = re.compile(r'[\s,]*')
+
 
 def nytas_construct_url(
     year: int,
@@ -34,27 +47,134 @@ def nytas_construct_url(
 def nytas_extract_archive(
     api_key: str,
     year: int,
-    month: int
+    month: int,
+    session: requests.Session | None = None,
+    cache: ArchiveCache | None = None
 ):
     """Extracts metadata 'archive' from NYTAS (for a given year and month).
 
     :param api_key: API key
     :param year: year of interest
     :param month: month of interest
+    :param session: optional HTTP session to reuse pooled connections, defaults to None
+    :param cache: optional on-disk cache of raw responses (cf. `ArchiveCache`), defaults to None
     :return: a dictionary-encoded collection of name-value pairs in the JSON response
     """
     url = nytas_construct_url(year, month)
     try:
-        res = requests.get(url, params={'api-key': api_key})
+        if cache:
+            path = cache.fetch(
+                lambda headers: (session or requests).get(url, params={'api-key': api_key}, headers=headers, stream=True),
+                "v1",
+                year,
+                month
+            )
+            with gzip.open(path, "rb") as gz:
+                return json.load(gz)
+        res = (session or requests).get(url, params={'api-key': api_key})
         res.raise_for_status()
         return res.json()
     except requests.RequestException as err: 
         logger.error(f"Bad API request to NYT 'Archive Search': '{err}'")   
 
 
+def nytas_iter_docs(
+    chunks: Iterable[bytes]
+) -> Iterator[dict]:
+    """Incrementally parses the `response.docs` array of a (raw) NYTAS response, yielding one article 
+    at a time so that the full archive is never held in memory.
+
+    :param chunks: an iterable of raw (UTF-8 encoded) byte chunks of the JSON response body
+    :return: an iterator of dictionary-encoded articles
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, in_docs = "", 0, False
+    for chunk in chunks:
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        if not in_docs:
+            match = DOCS_ARRAY_PATTERN.search(buffer)
+            if not match:
+                # NB: retain a short tail in case the `"docs": [` token straddles two chunks
+                pos = max(len(buffer) - 64, 0)
+                continue
+            pos, in_docs = match.end(), True
+        while True:
+            pos = DOCS_SEPARATOR_PATTERN.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                article, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # NB: the article is incomplete so wait for the next chunk
+                break
+            yield article
+    raise ValueError("NYTAS response ended before the end of `response.docs` was reached")
+
+
+def nytas_stream_archive(
+    api_key: str,
+    year: int,
+    month: int,
+    chunk_size: int = 2 ** 16,
+    cache: ArchiveCache | None = None
+) -> Iterator[dict]:
+    """Streams the articles of the metadata 'archive' from NYTAS (for a given year and month) as they
+    are downloaded (cf. `nytas_iter_docs()`).
+
+    :param api_key: API key
+    :param year: year of interest
+    :param month: month of interest
+    :param chunk_size: number of bytes to read from the HTTP body at a time, defaults to 64KiB
+    :param cache: optional on-disk cache of raw responses (cf. `ArchiveCache`); if provided, the response
+                  is streamed into the cache and then parsed incrementally from disk, defaults to None
+    :return: an iterator of dictionary-encoded articles
+    :raises requests.RequestException: if the archive could not be (fully) downloaded
+    """
+    url = nytas_construct_url(year, month)
+    try:
+        if cache:
+            path = cache.fetch(
+                lambda headers: requests.get(url, params={'api-key': api_key}, headers=headers, stream=True),
+                "v1",
+                year,
+                month
+            )
+            yield from nytas_iter_docs(iter_cached_chunks(path, chunk_size=chunk_size))
+            return
+        with requests.get(url, params={'api-key': api_key}, stream=True) as res:
+            res.raise_for_status()
+            yield from nytas_iter_docs(res.iter_content(chunk_size=chunk_size))
+    except requests.RequestException as err: 
+        # NB: re-raised, since a connection dropped mid-download would otherwise pass for a complete month
+        logger.error(f"Bad API request to NYT 'Archive Search': '{err}'")
+        raise
+
+
+def nytas_filter_article(
+    article: dict
+) -> dict:
+    """Filters a single NYTAS article on the relevant fields (cf. `nytas_filter_archive()`).
+
+    :param article: dictionary-encoded article from `response.docs`
+    :return: a filtered dictionary-encoded record
+    """
+    return {
+        "headline": article["headline"]["main"],
+        "publication_date": nytas_transform_date(article["pub_date"]),
+        "author": nytas_transform_author(article["byline"]["original"]),
+        "news_desk": article["news_desk"],
+        "url": article["web_url"]
+    }
+
+
+@profiled()
 def nytas_filter_archive(
     nyt_archive: dict
-) -> list[dict]:
+) -> ArchiveBatch:
     """Filters the NYTAS response on the following relevant fields:
 
     * `headline`
@@ -64,36 +184,51 @@ def nytas_filter_archive(
     * `url`
 
     :param nyt_archive: JSON encoded response from NYTAS (cf. `nytas_extract_archive()`)
-    :return: a filtered dictionary-encoded collection of name-value pairs in the JSON response
+    :return: a columnar batch of the filtered records (cf. `ArchiveBatch`), which iterates over the
+             same dictionary-encoded records as `nytas_filter_article()`
     """
     try:
         articles = nyt_archive["response"]["docs"]
-        return [
-            {
-                "headline": article["headline"]["main"],
-                "publication_date": nytas_transform_date(article["pub_date"]),
-                "author": nytas_transform_author(article["byline"]["original"]),
-                "news_desk": article["news_desk"],
-                "url": article["web_url"]
-            } 
-            for article in articles
-        ]
+        return ArchiveBatch.from_articles(articles)
+    except KeyError as err:
+        logger.error(f"Unable to process `nyt_archive` input (reconsider input structure): '{err}'")
+
+
+def nytas_filter_docs(
+    articles: Iterable[dict]
+) -> Iterator[dict]:
+    """Lazily filters a stream of NYTAS articles (cf. `nytas_stream_archive()`) on the same fields as
+    `nytas_filter_archive()`.
+
+    :param articles: an iterable of dictionary-encoded articles
+    :return: an iterator of filtered dictionary-encoded records
+    :raises KeyError: if an article lacks one of the relevant fields
+    """
+    try:
+        for article in articles:
+            yield nytas_filter_article(article)
     except KeyError as err:
+        # NB: re-raised, since a malformed article would otherwise truncate the month
         logger.error(f"Unable to process `nyt_archive` input (reconsider input structure): '{err}'")
+        raise
 
 
 def stage(
-    records: list[dict],
+    records: Iterable[dict],
     field_names: list[str],
     path: Path
 ) -> None:
     """Stage filtered JSON records as a pipe-delimited CSV file for further manipulation downstream.
 
-    :param records: an iterable list of dictionary-based 'records'
+    :param records: an iterable (e.g. a list or a stream) of dictionary-based 'records' or an
+                    `ArchiveBatch` (which is written column-wise, without building any records)
     :param field_names: the names of the fields contained in each record (i.e. the dictionary keys)
     :param path: file path to act as a staging area
     """
     with open(path, 'w') as fp:
+        if isinstance(records, ArchiveBatch):
+            records.write_csv(fp, field_names)
+            return
         writer = csv.DictWriter(fp, fieldnames=field_names, delimiter="|") 
         writer.writeheader() 
         writer.writerows(records)
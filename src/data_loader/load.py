@@ -1,9 +1,25 @@
 """Loads data from a CSV file into a remote Postgres database instance efficiently with `COPY`
+
+Records can alternatively be streamed straight into `COPY ... FROM STDIN` (cf. `ingest_records()`)
+without being written to a staging file first, either as CSV or in binary format (cf. `src.db.utils`).
+
+Large staging files can also be split into row-aligned chunks which are loaded over several
+connections at once (cf. `ingest_parallel()`).
 """
 import psycopg2
 import os
+import io
+import csv
+import uuid
+import contextlib
+import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, TextIO
 from psycopg2 import sql
+from src.db.utils import ConnectionPool, copy_records, write_frame
+from src.monitoring.profiling import profiled
+from .batch import ArchiveBatch
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,7 +28,8 @@ logger = logging.getLogger(__name__)
 def construct_copy_statement(
     schema: str,
     table: str,
-    columns: list
+    columns: list,
+    header: bool = True
 ) -> sql.SQL:
     """Constructs the copy statement for efficient loading of CSV into Postgres using
     safe query interpolation.
@@ -22,21 +39,24 @@ def construct_copy_statement(
     bulk_insert = sql.SQL(
         """
             COPY {}.{} ({})
-            FROM STDIN WITH (FORMAT csv, DELIMITER '|', HEADER true);
+            FROM STDIN WITH (FORMAT csv, DELIMITER '|', HEADER {});
         """).format(
         sql.Identifier(schema),
         sql.Identifier(table),
-        columns_sql
+        columns_sql,
+        sql.SQL("true" if header else "false")
     )
     return bulk_insert
 
 
+@profiled()
 def ingest(
     conn,
     schema: str,
     table: str,
     columns: list,
-    source_path: Path
+    source_path: Path,
+    commit: bool = True
 ) -> None:
     """Loads data extracted in a CSV format into Postgres.
 
@@ -45,7 +65,10 @@ def ingest(
     :param table: name of the target table
     :param source_path: path to CSV file for upload
     :param columns: list of columns to be included in the COPY command
+    :param commit: if False, the `COPY` is left uncommitted (and the staged file in place) so that the
+                   caller can commit it alongside other writes, defaults to True
     :return: null
+    :raises psycopg2.errors.DatabaseError: if the `COPY` failed (once the transaction has been rolled back)
     """
     try:
         with conn.cursor() as cursor, open(source_path, "r") as staged_csv:
@@ -56,10 +79,323 @@ def ingest(
             )
             cursor.copy_expert(bulk_insert, staged_csv)
     except psycopg2.errors.DatabaseError as err:
+        # NB: roll back, so that the connection can be reused (e.g. for the next month of a backfill)
+        conn.rollback()
         logger.error(f"Failed to upload staged file to Postgres: '{err}'")
-    else:  
+        raise
+    else:
+        if commit:
+            conn.commit()
+            os.remove(source_path)
+
+
+class RecordStream(io.TextIOBase):
+    """Read-only file-like adapter which lazily serializes `records` into the same pipe-delimited CSV
+    format as `stage()` (header included) as `COPY` consumes it.
+
+    :param records: an iterable (e.g. a stream) of dictionary-based 'records'
+    :param columns: the names of the fields contained in each record (i.e. the dictionary keys)
+    :param tee: optional file handle to which the serialized CSV is also written (e.g. for debugging
+                or replay), defaults to None
+    :param batch_size: number of records to serialize at a time, defaults to 1000
+    """
+
+    def __init__(
+        self,
+        records: Iterable[dict],
+        columns: list,
+        tee: TextIO | None = None,
+        batch_size: int = 1000
+    ):
+        self.records: Iterator[dict] = iter(records)
+        self.tee = tee
+        self.batch_size = batch_size
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=columns, delimiter="|")
+        self.writer.writeheader()
+        self.pending = self.buffer.getvalue()
+        if self.tee:
+            self.tee.write(self.pending)
+        self.exhausted = False
+        self.rows = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _serialize_batch(self) -> str:
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        for _, record in zip(range(self.batch_size), self.records):
+            self.writer.writerow(record)
+            self.rows += 1
+        self.exhausted = self.buffer.tell() == 0
+        return self.buffer.getvalue()
+
+    def read(
+        self,
+        size: int = -1
+    ) -> str:
+        chunks = [self.pending]
+        length = len(self.pending)
+        while (size < 0 or length < size) and not self.exhausted:
+            chunk = self._serialize_batch()
+            if self.tee:
+                self.tee.write(chunk)
+            chunks.append(chunk)
+            length += len(chunk)
+        data = "".join(chunks)
+        if size < 0:
+            self.pending = ""
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+
+def tee_records(
+    records: Iterable[dict],
+    columns: list,
+    fp: TextIO
+) -> Iterator[dict]:
+    """Passes `records` through whilst also writing them to `fp` in the format of `stage()`.
+    """
+    writer = csv.DictWriter(fp, fieldnames=columns, delimiter="|")
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield record
+
+
+@profiled()
+def ingest_records(
+    conn,
+    schema: str,
+    table: str,
+    columns: list,
+    records: Iterable[dict],
+    tee_path: Path | None = None,
+    types: dict[str, str] | None = None,
+    commit: bool = True
+) -> int:
+    """Streams records directly into Postgres via `COPY ... FROM STDIN` (i.e. without a staging file).
+
+    :param conn: connection object (inherited from `psycopg2`)
+    :param schema: schema of the target table
+    :param table: name of the target table
+    :param columns: list of columns to be included in the COPY command (i.e. the record keys)
+    :param records: an iterable (e.g. a stream) of dictionary-based 'records' or an `ArchiveBatch`
+                    (which, given `types`, is encoded column-wise without building any records)
+    :param tee_path: optional path to which the streamed CSV is also written (for debugging or replay
+                     via `ingest()`), defaults to None
+    :param types: if provided, records are encoded in binary `COPY` format according to the Postgres
+                  type of each column (cf. `src.db.utils.copy_records()`) rather than as CSV, defaults to None
+    :param commit: if False, the `COPY` is left uncommitted so that the caller can commit it alongside
+                   other writes (e.g. the terms of the same headlines), defaults to True
+    :return: number of records streamed
+    :raises psycopg2.errors.DatabaseError: if the `COPY` failed (once the transaction has been rolled back)
+    """
+    with open(tee_path, "w", newline="") if tee_path else contextlib.nullcontext() as tee:
+        if types and isinstance(records, ArchiveBatch):
+            if tee:
+                records.write_csv(tee, columns)
+            df = records.to_frame(columns)
+            try:
+                # NB: empty strings are uploaded as `NULL` (as per `copy_records()`)
+                n_records = write_frame(conn, df.mask(df.eq("")), schema, table, types)
+            except psycopg2.errors.DatabaseError as err:
+                conn.rollback()
+                logger.error(f"Failed to stream records to Postgres: '{err}'")
+                raise
+            if commit:
+                conn.commit()
+            return n_records
+        if types:
+            n_records = 0
+            try:
+                n_records = copy_records(
+                    conn,
+                    schema,
+                    table,
+                    columns,
+                    types,
+                    tee_records(records, columns, tee) if tee else records
+                )
+            except psycopg2.errors.DatabaseError as err:
+                conn.rollback()
+                logger.error(f"Failed to stream records to Postgres: '{err}'")
+                raise
+            except Exception:
+                # NB: e.g. a dropped download; roll back the partial `COPY` so the month can be retried
+                conn.rollback()
+                raise
+            else:
+                if commit:
+                    conn.commit()
+            return n_records
+        stream = RecordStream(records, columns, tee=tee)
+        try:
+            with conn.cursor() as cursor:
+                bulk_insert = construct_copy_statement(
+                    schema,
+                    table,
+                    columns
+                )
+                cursor.copy_expert(bulk_insert, stream)
+        except psycopg2.errors.DatabaseError as err:
+            conn.rollback()
+            logger.error(f"Failed to stream records to Postgres: '{err}'")
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        else:
+            if commit:
+                conn.commit()
+    return stream.rows
+
+
+
+def split_csv(
+    source_path: Path,
+    n_chunks: int,
+    block_size: int = 2 ** 24
+) -> list[tuple[int, int]]:
+    """Splits a staged CSV file into (at most) `n_chunks` row-aligned byte ranges of similar size.
+
+    A newline only ends a row if it is preceded by an even number of quote characters (i.e. it is not
+    part of a quoted field), so the file is scanned once in blocks whilst tracking quote parity.
+
+    :param source_path: path to CSV file
+    :param n_chunks: number of chunks
+    :param block_size: number of bytes to scan at a time, defaults to 16MiB
+    :return: list of (start, end) byte offsets (the first chunk includes the header)
+    """
+    size = os.path.getsize(source_path)
+    targets = [size * i // n_chunks for i in range(1, n_chunks)]
+    boundaries = [0]
+    with open(source_path, "rb") as fp:
+        offset, parity = 0, 0
+        while targets and (block := fp.read(block_size)):
+            data = np.frombuffer(block, dtype=np.uint8)
+            quotes = np.cumsum(data == ord('"')) + parity
+            row_ends = np.flatnonzero((data == ord("\n")) & (quotes % 2 == 0)) + offset + 1
+            while targets:
+                idx = np.searchsorted(row_ends, max(targets[0], boundaries[-1] + 1))
+                if idx == len(row_ends):
+                    break
+                boundaries.append(int(row_ends[idx]))
+                targets.pop(0)
+            offset, parity = offset + len(data), int(quotes[-1] % 2)
+    boundaries = sorted(set(boundary for boundary in boundaries if boundary < size) | {size})
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class FileRange(io.RawIOBase):
+    """Read-only file-like view of the bytes [`start`, `end`) of the file at `path`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        start: int,
+        end: int
+    ):
+        self.fp = open(path, "rb")
+        self.fp.seek(start)
+        self.remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def read(
+        self,
+        size: int = -1
+    ) -> bytes:
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.fp.close()
+        super().close()
+
+
+def ingest_parallel(
+    conn,
+    pool: ConnectionPool,
+    schema: str,
+    table: str,
+    columns: list,
+    source_path: Path,
+    n_workers: int = 4
+) -> int:
+    """Loads a staged CSV file into Postgres over `n_workers` connections at once.
+
+    The file is split into row-aligned chunks (cf. `split_csv()`) which are each copied into their
+    own `UNLOGGED` staging table (in a separate transaction). Only once every chunk has been loaded
+    are the staging tables moved into the target table in a single `INSERT ... SELECT` transaction on
+    `conn`, so a failure part way through leaves the target table unchanged.
+
+    :param conn: connection object (inherited from `psycopg2`) on which the final transaction is run
+    :param pool: connection pool from which the chunks' connections are leased (cf. `src.db.utils.get_pool()`)
+    :param schema: schema of the target table
+    :param table: name of the target table
+    :param columns: list of columns to be included in the COPY command
+    :param source_path: path to CSV file for upload
+    :param n_workers: number of concurrent connections (NB: `pool` should allow at least as many
+                      connections, in addition to `conn`), defaults to 4
+    :return: number of rows loaded
+    :raises psycopg2.errors.DatabaseError: if any chunk failed to load (once the transaction has been rolled back)
+    """
+    chunks = split_csv(source_path, n_workers)
+    run_id = uuid.uuid4().hex[:8]
+    staging_tables = [
+        sql.Identifier(schema, f"_{table}_stage_{run_id}_{i}") for i in range(len(chunks))
+    ]
+    column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+
+    def load_chunk(i: int) -> None:
+        with pool.lease() as chunk_conn, chunk_conn.cursor() as cursor, \
+                contextlib.closing(FileRange(source_path, *chunks[i])) as chunk:
+            cursor.execute(
+                sql.SQL("CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(
+                    staging_tables[i],
+                    sql.Identifier(schema, table)
+                )
+            )
+            cursor.copy_expert(
+                construct_copy_statement(schema, staging_tables[i].strings[1], columns, header=i == 0),
+                chunk
+            )
+
+    n_rows = 0
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(load_chunk, range(len(chunks))))
+        with conn.cursor() as cursor:
+            for staging_table in staging_tables:
+                cursor.execute(
+                    sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+                        sql.Identifier(schema, table),
+                        column_list,
+                        column_list,
+                        staging_table
+                    )
+                )
+                n_rows += cursor.rowcount
         conn.commit()
+    except psycopg2.errors.DatabaseError as err:
+        conn.rollback()
+        logger.error(f"Failed to upload staged file to Postgres in parallel: '{err}'")
+        raise
+    else:
         os.remove(source_path)
+    finally:
+        with conn.cursor() as cursor:
+            for staging_table in staging_tables:
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(staging_table))
+        conn.commit()
+    return n_rows
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+"""Pipelined processing of a sequence of items (e.g. months) through a series of stages.
+
+Every stage runs in its own thread(s) and hands its output to the next stage via a bounded queue, so
+that e.g. month N + 1 is being extracted whilst month N is being copied into Postgres. Once a queue is
+full, the stage which feeds it blocks (i.e. backpressure), so at most
+`sum(stage.workers) + maxsize * len(stages)` items are in flight at any one time, however many items
+are processed.
+
+Items which fail with one of the `skip_on` exceptions (e.g. a failed download) are skipped. Any other
+exception stops every stage and is re-raised in the calling thread once all threads have stopped.
+"""
+import queue
+import threading
+import contextvars
+import logging
+from typing import Any, Callable, Iterable, NamedTuple
+
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 0.1
+DONE = object()
+
+
+class PipelineStage(NamedTuple):
+    """A stage of a pipeline.
+
+    `fn` is called with `(item, value)`, where `value` is the output of the previous stage for `item`
+    (or None for the first stage), and returns the input of the next stage.
+    """
+    name: str
+    fn: Callable[[Any, Any], Any]
+    workers: int = 1
+
+
+def run_pipeline(
+    items: Iterable,
+    stages: list[PipelineStage],
+    maxsize: int = 1,
+    skip_on: tuple[type[Exception], ...] = ()
+) -> tuple[list[tuple], list]:
+    """Passes every item through `stages` in order, with the stages running concurrently.
+
+    NB: each thread runs in a copy of the calling thread's context, so that e.g. the metrics of the
+    current flow run (cf. `src.monitoring.metrics`) are recorded from every stage
+
+    :param items: items to process (e.g. (year, month) tuples), in order of submission
+    :param stages: stages to pass each item through (cf. `PipelineStage`)
+    :param maxsize: maximum number of items queued in front of each stage, defaults to 1
+    :param skip_on: exceptions upon which an item is skipped rather than the pipeline stopped, defaults to ()
+    :return: the `(item, output)` pairs of the last stage (in order of completion) and the skipped items
+    :raises Exception: the first exception (other than `skip_on`) raised by any stage
+    """
+    queues = [queue.Queue(maxsize=maxsize) for _ in stages]
+    remaining = [stage.workers for stage in stages]
+    outputs, skipped, errors = [], [], []
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def put(q: queue.Queue, entry) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return DONE
+
+    def fail(err: Exception) -> None:
+        with lock:
+            errors.append(err)
+        stop.set()
+
+    def feed() -> None:
+        try:
+            for item in items:
+                if not put(queues[0], (item, None)):
+                    return
+        except Exception as err:
+            fail(err)
+        for _ in range(stages[0].workers):
+            put(queues[0], DONE)
+
+    def work(index: int) -> None:
+        stage = stages[index]
+        downstream = queues[index + 1] if index + 1 < len(stages) else None
+        while (entry := get(queues[index])) is not DONE:
+            item, value = entry
+            try:
+                value = stage.fn(item, value)
+            except skip_on as err:
+                logger.error(f"Stage '{stage.name}' failed for {item}; skipping: '{err}'")
+                with lock:
+                    skipped.append(item)
+                continue
+            except Exception as err:
+                logger.error(f"Stage '{stage.name}' failed for {item}; stopping the pipeline: '{err}'")
+                fail(err)
+                break
+            if downstream is None:
+                with lock:
+                    outputs.append((item, value))
+            elif not put(downstream, (item, value)):
+                break
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        # NB: the last worker of a stage to finish signals every worker of the next stage
+        if last and downstream is not None:
+            for _ in range(stages[index + 1].workers):
+                put(downstream, DONE)
+
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(feed,), name="pipeline-feed")]
+    for index, stage in enumerate(stages):
+        threads += [
+            threading.Thread(target=contextvars.copy_context().run, args=(work, index), name=f"pipeline-{stage.name}-{i}")
+            for i in range(stage.workers)
+        ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        stop.set()
+        raise
+    if errors:
+        raise errors[0]
+    return outputs, skipped
+
+
+if __name__ == "__main__":
+    pass
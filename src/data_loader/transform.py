@@ -2,8 +2,20 @@
 
 Note that whilst the capital T 'transformation' piece of the ELT pipeline is primarily delegated to  
 `dbt`, some minor transformations take place prior to the initial load.
+
+Optionally, headlines can also be tokenized here (cf. `nytas_tokenize_headline()`) which mirrors the
+`int_nyt_unnested` -> `int_nyt_cleansed` models exactly, so that `dbt` can skip its text processing.
 """
+import re
+import hashlib
+from collections import Counter
 from datetime import datetime
+from typing import Iterable, Iterator
+
+# NB: terms are only stripped of specials once numeric terms have been dropped, so removing possessives
+# and specials in a single (left to right) pass is equivalent to the two passes of `int_nyt_cleansed`
+TERM_NUMERIC_PATTERN = re.compile(r"[0-9]")
+TERM_CLEANSE_PATTERN = re.compile(r"’s|[^A-Za-z0-9]")
 
 
 def nytas_transform_date(raw_date: str) -> datetime:
@@ -22,4 +34,50 @@ def nytas_transform_author(raw_author: str) -> str:
     :param raw_author: original author tag, normally written as e.g. "By Johnny Breen"
     :return: the name of the author e.g. "Johnny Breen"
     """
-    return raw_author.replace("By ", "")
\ No newline at end of file
+    return raw_author.replace("By ", "")
+
+
+def nytas_tokenize_headline(headline: str) -> list[str]:
+    """Splits a headline into cleansed terms exactly as per `int_nyt_unnested` and `int_nyt_cleansed`:
+
+    * split on single spaces (i.e. consecutive spaces yield empty terms)
+    * drop terms containing digits
+    * remove possessives ('’s') and then any character other than A-Z, a-z and 0-9
+    * convert to lower case
+
+    :param headline: headline e.g. "Biden’s 2 Big Tests"
+    :return: list of terms e.g. ["biden", "big", "tests"]
+    """
+    if not headline:
+        return []
+    return [
+        TERM_CLEANSE_PATTERN.sub("", term).lower()
+        for term in headline.split(" ")
+        if not TERM_NUMERIC_PATTERN.search(term)
+    ]
+
+
+def nytas_count_terms(
+    records: Iterable[dict]
+) -> Iterator[dict]:
+    """Pre-aggregates the terms of each filtered record (cf. `nytas_filter_archive()`) into one row
+    per URL and term.
+
+    Rows carry the MD5 digest of the headline, so `dbt` can match them to the version of each URL
+    that survives `stg_nyt` (NB: identical to Postgres' `md5(headline)`).
+
+    :param records: an iterable of filtered dictionary-encoded records
+    :return: an iterator of records with fields `url`, `headline_md5`, `headline_term` and `frequency`
+    """
+    for record in records:
+        headline = record["headline"]
+        if not headline:
+            continue
+        headline_md5 = hashlib.md5(headline.encode("utf-8")).hexdigest()
+        for term, frequency in Counter(nytas_tokenize_headline(headline)).items():
+            yield {
+                "url": record["url"],
+                "headline_md5": headline_md5,
+                "headline_term": term,
+                "frequency": frequency
+            }
@@ -0,0 +1,39 @@
+{% macro loaded_since(relation) %}
+
+{#- NB: an empty relation (e.g. one whose rows were all pruned by `delete_affected_rows`) has no
+    watermark, in which case every row counts as newly loaded -#}
+_etl_loaded_at_date > coalesce((select max(_etl_loaded_at_date) from {{ relation }}), '-infinity'::timestamp)
+
+{% endmacro %}
+
+
+{% macro updated_keys(key, parent, relation) %}
+
+select {{ key }}
+from {{ parent }}
+where {{ loaded_since(relation) }}
+
+{% endmacro %}
+
+
+{% macro nyt_affected_dates(relation) %}
+
+{#- NB: includes the previous publication date of any URL that has since been updated -#}
+select distinct publication_date::DATE as publication_date
+from {{ source('src_nyt', 'nytas') }}
+where url in ({{ updated_keys('url', source('src_nyt', 'nytas'), relation) }})
+
+{% endmacro %}
+
+
+{% macro delete_affected_rows(key, affected_keys) %}
+
+{#- NB: `delete+insert` only deletes the keys that the new batch produces rows for, so a key whose
+    rows all disappear (e.g. a URL whose latest headline is null, or a date that every headline has
+    left) would otherwise keep its stale rows; hence every affected key is deleted up front -#}
+{% if is_incremental() %}
+delete from {{ this }}
+where {{ key }} in ({{ affected_keys }})
+{% endif %}
+
+{% endmacro %}
@@ -1,6 +1,20 @@
+{{
+    config(
+        enabled=not var('python_tokenization', false),
+        materialized='incremental',
+        unique_key='headline_id',
+        incremental_strategy='delete+insert',
+        pre_hook="{{ delete_affected_rows('headline_id', updated_keys('headline_id', ref('int_nyt_unnested'), this)) }}",
+        indexes=[{'columns': ['headline_id']}]
+    )
+}}
+
 with int_nyt_unnested as (
 
     select * from {{ ref('int_nyt_unnested') }}
+    {% if is_incremental() %}
+    where {{ loaded_since(this) }}
+    {% endif %}
     
 ),
 
@@ -8,7 +22,8 @@ remove_missing_values as (
 
     select
         headline_id,
-        headline_term
+        headline_term,
+        _etl_loaded_at_date
     from int_nyt_unnested
     where headline_term != ''
     or headline_term is not null
@@ -19,7 +34,8 @@ remove_numeric_values as (
 
     select
         headline_id,
-        headline_term
+        headline_term,
+        _etl_loaded_at_date
     from remove_missing_values
     where headline_term !~ '[0-9]'
 
@@ -29,7 +45,8 @@ remove_possessives as (
 
     select
         headline_id,
-        regexp_replace(headline_term, '’s', '', 'g') as headline_term
+        regexp_replace(headline_term, '’s', '', 'g') as headline_term,
+        _etl_loaded_at_date
     from remove_numeric_values
     
 ),
@@ -38,7 +55,8 @@ remove_specials as (
 
     select
         headline_id,
-        regexp_replace(headline_term, '[^A-Za-z0-9]', '', 'g') as headline_term
+        regexp_replace(headline_term, '[^A-Za-z0-9]', '', 'g') as headline_term,
+        _etl_loaded_at_date
     from remove_possessives
 
 ),
@@ -47,7 +65,8 @@ convert_term_case_to_lower as (
 
     select
         headline_id,
-        lower(headline_term) as headline_term
+        lower(headline_term) as headline_term,
+        _etl_loaded_at_date
     from remove_specials
 
 )
@@ -0,0 +1,50 @@
+{{
+    config(
+        enabled=var('python_tokenization', false),
+        materialized='incremental',
+        unique_key='headline_id',
+        incremental_strategy='delete+insert',
+        pre_hook="{{ delete_affected_rows('headline_id', updated_keys('headline_id', ref('stg_nyt'), this)) }}",
+        indexes=[{'columns': ['headline_id']}]
+    )
+}}
+
+with stg_nyt as (
+
+    select * from {{ ref('stg_nyt') }}
+    {% if is_incremental() %}
+    where {{ loaded_since(this) }}
+    {% endif %}
+
+),
+
+-- NB: re-loading the same headline (e.g. re-running a month) yields identical term counts
+nytas_terms as (
+
+    select distinct
+        url,
+        headline_md5,
+        headline_term,
+        frequency
+    from {{ source('src_nyt', 'nytas_terms') }}
+    {% if is_incremental() %}
+    -- NB: only the terms of the headlines in the incremental slice, so that the distinct stays small
+    where url in (select url from stg_nyt)
+    {% endif %}
+
+),
+
+final as (
+
+    select
+        stg_nyt.headline_id,
+        nytas_terms.headline_term,
+        nytas_terms.frequency,
+        stg_nyt._etl_loaded_at_date
+    from stg_nyt
+    join nytas_terms on nytas_terms.url = stg_nyt.url
+                     and nytas_terms.headline_md5 = md5(stg_nyt.headline)
+
+)
+
+select * from final
@@ -1,6 +1,20 @@
+{{
+    config(
+        enabled=not var('python_tokenization', false),
+        materialized='incremental',
+        unique_key='headline_id',
+        incremental_strategy='delete+insert',
+        pre_hook="{{ delete_affected_rows('headline_id', updated_keys('headline_id', ref('stg_nyt'), this)) }}",
+        indexes=[{'columns': ['headline_id']}]
+    )
+}}
+
 with stg_nyt as (
 
     select * from {{ ref('stg_nyt') }}
+    {% if is_incremental() %}
+    where {{ loaded_since(this) }}
+    {% endif %}
     
 ),
 
@@ -8,7 +22,8 @@ split_nyt_headlines as (
 
     select
         headline_id,
-        string_to_array(headline, ' ') as headline_split
+        string_to_array(headline, ' ') as headline_split,
+        _etl_loaded_at_date
     from stg_nyt
 
 ),
@@ -17,7 +32,8 @@ unnest_nyt_headlines as (
 
     select 
         headline_id,
-        unnest(headline_split) as headline_term
+        unnest(headline_split) as headline_term,
+        _etl_loaded_at_date
     from split_nyt_headlines
 
 )
@@ -0,0 +1,59 @@
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='append',
+        full_refresh=false,
+        indexes=[
+            {'columns': ['term_id'], 'unique': True},
+            {'columns': ['headline_term'], 'unique': True}
+        ]
+    )
+}}
+
+-- NB: `term_id`s are assigned once (in order of first appearance) and never reassigned, so that they
+-- remain stable across runs and can be persisted downstream (e.g. in `model.output`); hence this model
+-- only ever appends new terms and is exempt from `--full-refresh`
+
+with fct_daily_term_counts as (
+
+    select * from {{ ref('fct_daily_term_counts') }}
+    {% if is_incremental() %}
+    -- NB: coalesced (cf. `loaded_since()`), as an empty `dim_terms` would otherwise never take on new terms
+    where {{ loaded_since(this) }}
+    {% endif %}
+
+),
+
+new_terms as (
+
+    select
+        headline_term,
+        min(publication_date) as first_publication_date,
+        max(_etl_loaded_at_date) as _etl_loaded_at_date
+    from fct_daily_term_counts fct_dtc
+    {% if is_incremental() %}
+    where not exists (
+        select 1
+        from {{ this }} dim_t
+        where dim_t.headline_term = fct_dtc.headline_term
+    )
+    {% endif %}
+    group by headline_term
+
+),
+
+final as (
+
+    select
+        (
+            {% if is_incremental() %}(select coalesce(max(term_id), 0) from {{ this }}){% else %}0{% endif %}
+            + row_number() over (order by first_publication_date, headline_term)
+        )::INT as term_id,
+        headline_term,
+        first_publication_date,
+        _etl_loaded_at_date
+    from new_terms
+
+)
+
+select * from final
@@ -1,14 +1,56 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='publication_date',
+        incremental_strategy='delete+insert',
+        pre_hook="{{ delete_affected_rows('publication_date', nyt_affected_dates(this)) }}",
+        indexes=[{'columns': ['publication_date']}]
+    )
+}}
+
+-- depends_on: {{ source('src_nyt', 'nytas') }}
+
+{% if is_incremental() %}
+with affected_dates as (
+
+    -- NB: includes the previous publication date of any URL that has since been updated, so that
+    -- its stale counts are recomputed as well
+    {{ nyt_affected_dates(this) }}
+
+),
+
+stg_nyt as (
+
+    select * from {{ ref('stg_nyt') }}
+    where publication_date in (select publication_date from affected_dates)
+
+),
+{% else %}
 with stg_nyt as (
 
     select * from {{ ref('stg_nyt') }}
 
 ),
+{% endif %}
 
-int_nyt_cleansed as (
+{% if var('python_tokenization', false) %}
+-- NB: terms were tokenized and counted per headline at extract time (cf. `src.data_loader.transform`)
+int_nyt_terms as (
 
-    select * from {{ ref('int_nyt_cleansed') }}
+    select * from {{ ref('int_nyt_terms') }}
+
+),
+{% else %}
+int_nyt_terms as (
+
+    select
+        headline_id,
+        headline_term,
+        1 as frequency
+    from {{ ref('int_nyt_cleansed') }}
 
 ),
+{% endif %}
 
 -- NB: this requires pre-seeding with `dbt seed`
 stop_words as (
@@ -22,9 +64,11 @@ nyt_headline_terms_dated as (
     select
         'NYT' as publication,
         stg_nyt.publication_date,
-        int_nytc.headline_term
+        int_nytt.headline_term,
+        int_nytt.frequency,
+        stg_nyt._etl_loaded_at_date
     from stg_nyt 
-    join int_nyt_cleansed int_nytc on int_nytc.headline_id = stg_nyt.headline_id
+    join int_nyt_terms int_nytt on int_nytt.headline_id = stg_nyt.headline_id
     
 ),
 
@@ -34,7 +78,8 @@ nyt_headline_terms_agg as (
         publication,
         publication_date,
         headline_term,
-        count(*) as frequency
+        sum(frequency) as frequency,
+        max(_etl_loaded_at_date) as _etl_loaded_at_date
     from nyt_headline_terms_dated
     group by 
         publication,
@@ -53,7 +98,8 @@ final as (
             when stop_words.stop_word is not null then 1
             else 0
         end as stop_word,
-        frequency
+        frequency,
+        _etl_loaded_at_date
     from nyt_headline_terms_agg nyt_agg
     left join stop_words on stop_words.stop_word = nyt_agg.headline_term
 
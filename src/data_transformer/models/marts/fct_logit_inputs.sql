@@ -1,4 +1,13 @@
-{{ config(materialized='view') }}
+{{
+    config(
+        materialized='table',
+        indexes=[
+            {'columns': ['publication_date']},
+            {'columns': ['headline_term']},
+            {'columns': ['term_id']}
+        ]
+    )
+}}
 
 with fct_daily_term_counts as (
 
@@ -18,10 +27,17 @@ fct_term_counts as (
 
 ),
 
+dim_terms as (
+
+    select * from {{ ref('dim_terms') }}
+
+),
+
 fct_logit_inputs as (
 
     select
         fct_dtc.publication,
+        dim_t.term_id,
         fct_dtc.headline_term,
         fct_dtc.publication_date,
         fct_dtc.frequency as successes,
@@ -34,6 +50,7 @@ fct_logit_inputs as (
                                  and fct_dc.publication_date = fct_dtc.publication_date
     join fct_term_counts fct_tc on fct_tc.publication = fct_dtc.publication
                                 and fct_tc.headline_term = fct_dtc.headline_term
+    join dim_terms dim_t on dim_t.headline_term = fct_dtc.headline_term
     where fct_dtc.stop_word = 0
 
 )
@@ -1,21 +1,44 @@
-with versioned_nytas as (
+{{
+    config(
+        materialized='incremental',
+        unique_key='url',
+        incremental_strategy='delete+insert',
+        pre_hook="{{ delete_affected_rows('url', updated_keys('url', source('src_nyt', 'nytas'), this)) }}",
+        indexes=[{'columns': ['url']}, {'columns': ['_etl_loaded_at_date']}]
+    )
+}}
+
+with nytas as (
+
+    select * from {{ source('src_nyt', 'nytas') }}
+    {% if is_incremental() %}
+    -- NB: every version of each URL loaded since the last run is re-ranked (so that late-arriving
+    -- updates to existing URLs replace the previous version)
+    where url in ({{ updated_keys('url', source('src_nyt', 'nytas'), this) }})
+    {% endif %}
+
+),
+
+versioned_nytas as (
 
     select
-        row_number() over (partition by url order by publication_date desc) as headline_version,
+        row_number() over (partition by url order by publication_date desc, _etl_loaded_at_date desc) as headline_version,
+        max(_etl_loaded_at_date) over (partition by url) as _etl_loaded_at_date_latest,
         *
-    from {{ source('src_nyt', 'nytas') }}
+    from nytas
 
 ),
 
 final as (
 
     select
-        row_number() over (order by publication_date) as headline_id,
+        md5(url) as headline_id,
         headline,
         publication_date::DATE,
         coalesce(author, 'Unknown') as author,
         coalesce(news_desk, 'Unknown') as news_desk,
-        url
+        url,
+        _etl_loaded_at_date_latest as _etl_loaded_at_date
     from versioned_nytas
     where headline_version = 1
     and headline is not null
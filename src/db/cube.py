@@ -0,0 +1,211 @@
+"""Local, memory-mapped store of daily headline term counts (the 'term cube').
+
+The cube mirrors the inputs behind `dwh.fct_logit_inputs` as a dense day × term matrix of daily
+successes (i.e. `fct_daily_term_counts.frequency` excluding stop words) alongside a vector of
+daily totals (i.e. `fct_daily_counts.total_frequency`). Each day is a contiguous row, so any window
+of days is a zero-copy slice of the memory-mapped arrays and no database round trip is required.
+
+On-disk layout (one 'generation' per refresh, swapped atomically via the `CURRENT` pointer):
+
+    <root>/CURRENT                                  -> name of the live generation
+    <root>/generations/<generation>/counts.npy      -> int32 (n_days, n_terms) daily successes
+    <root>/generations/<generation>/day_totals.npy  -> int64 (n_days,) daily totals across all terms
+    <root>/generations/<generation>/term_totals.npy -> int64 (n_terms,) all-time successes of each term
+    <root>/generations/<generation>/first_day.npy   -> datetime64[D] date of the first row
+    <root>/generations/<generation>/term_ids.npy    -> int32 (n_terms,) ID of each term (cf. `dwh.dim_terms`), in column order
+    <root>/generations/<generation>/terms.txt       -> term vocabulary (one term per line, in column order)
+
+Only directories under `<root>/generations` whose names match `GENERATION_PATTERN` are ever removed,
+so `root` may be shared with other data (e.g. the default `staging` directory).
+"""
+import os
+import re
+import shutil
+import datetime
+import uuid
+import numpy as np
+import pandas as pd
+import logging
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+GENERATIONS_DIR = "generations"
+GENERATION_PATTERN = re.compile(r"[0-9a-f]{32}")
+MAX_OPEN_ATTEMPTS = 3
+
+
+class TermCube:
+    """Read-only view of the live generation of a term cube located at `root`.
+    """
+
+    def __init__(
+        self,
+        root: str | Path
+    ):
+        self.root = Path(root)
+        # NB: a generation is only retired two refreshes after it was swapped out, so a reader can only
+        # lose its generation mid-open if it is slower than that; `CURRENT` is then re-resolved
+        for attempt in range(MAX_OPEN_ATTEMPTS):
+            try:
+                self.open((self.root / "CURRENT").read_text().strip())
+                return
+            except FileNotFoundError:
+                if attempt == MAX_OPEN_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"Term cube generation @ '{self.root}' was retired whilst opening; retrying")
+
+    def open(
+        self,
+        generation_name: str
+    ) -> None:
+        self.generation_name = generation_name
+        generation = self.root / GENERATIONS_DIR / generation_name
+        self.counts = np.load(generation / "counts.npy", mmap_mode="r")
+        self.day_totals = np.load(generation / "day_totals.npy", mmap_mode="r")
+        self.term_totals = np.load(generation / "term_totals.npy", mmap_mode="r")
+        self.first_day = np.load(generation / "first_day.npy").item()
+        self.term_ids = np.load(generation / "term_ids.npy")
+        self.terms = np.array((generation / "terms.txt").read_text().split("\n")[:-1], dtype=object)
+
+    @classmethod
+    def exists(
+        cls,
+        root: str | Path
+    ) -> bool:
+        return (Path(root) / "CURRENT").exists()
+
+    def day_index(
+        self,
+        day: datetime.date
+    ) -> int:
+        """Row index of `day` (clipped to the extent of the cube).
+        """
+        return min(max((day - self.first_day).days, 0), len(self.day_totals))
+
+    def window(
+        self,
+        start_date: datetime.date,
+        end_date: datetime.date
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Zero-copy slice of the cube covering [`start_date`, `end_date`].
+
+        :param start_date: first day of the window
+        :param end_date: last day of the window (inclusive)
+        :return: a tuple of (a) the (n_days, n_terms) daily successes and (b) the (n_days,) daily totals
+        """
+        first, last = self.day_index(start_date), self.day_index(end_date + datetime.timedelta(days=1))
+        return self.counts[first:last], self.day_totals[first:last]
+
+    def logit_inputs(
+        self,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        min_frequency: int = 50
+    ) -> pd.DataFrame:
+        """Produces logit inputs for the window [`start_date`, `end_date`] in the same shape as the
+        `get_logit_inputs` task (i.e. one row per term and day on which the term appeared).
+
+        :param start_date: first day of the window (i.e. the origin of `cum_time_elapsed`)
+        :param end_date: last day of the window (inclusive)
+        :param min_frequency: minimum frequency of each term within the window, defaults to 50
+        :return: a `pd.DataFrame` object with fields `publication`, `term_id`, `cum_time_elapsed`,
+                 `successes` and `failures`
+        """
+        counts, day_totals = self.window(start_date, end_date)
+        window_totals = counts.sum(axis=0, dtype=np.int64)
+        columns = np.flatnonzero((window_totals >= min_frequency) & (self.terms != ""))
+        # NB: transposing yields term-major (i.e. group-sorted) rows once non-zero entries are located
+        term_counts = counts[:, columns].T
+        term_idx, day_idx = np.nonzero(term_counts)
+        successes = term_counts[term_idx, day_idx].astype(np.int64)
+        offset = self.day_index(start_date) - (start_date - self.first_day).days
+        return pd.DataFrame({
+            "publication": "NYT",
+            "term_id": self.term_ids[columns[term_idx]],
+            "cum_time_elapsed": day_idx + offset,
+            "successes": successes,
+            "failures": day_totals[day_idx] - successes
+        })
+
+
+def refresh_cube(
+    root: str | Path,
+    daily_term_counts: pd.DataFrame,
+    daily_counts: pd.DataFrame
+) -> None:
+    """Merges (or overwrites) the counts of the days covered by `daily_counts` into the cube at `root`.
+
+    A new generation is written and swapped in atomically, so a reader opens either the previous or
+    the new generation. The previous generation is retained until the next refresh (for readers which
+    resolved `CURRENT` just before the swap) and older generations are then removed. Terms and days
+    that are not yet present extend the cube.
+
+    :param root: root directory of the cube (created if it does not exist)
+    :param daily_term_counts: a `pd.DataFrame` object with fields `publication_date`, `term_id`,
+                              `headline_term` and `frequency` (excluding stop words)
+    :param daily_counts: a `pd.DataFrame` object with fields `publication_date` and `total_frequency`
+    """
+    root = Path(root)
+    (root / GENERATIONS_DIR).mkdir(parents=True, exist_ok=True)
+    days = pd.to_datetime(daily_counts["publication_date"]).dt.date
+    term_days = pd.to_datetime(daily_term_counts["publication_date"]).dt.date
+
+    if TermCube.exists(root):
+        cube = TermCube(root)
+        first_day = min(cube.first_day, days.min())
+        last_day = max(cube.first_day + datetime.timedelta(days=len(cube.day_totals) - 1), days.max())
+        term_ids, terms = list(cube.term_ids), list(cube.terms)
+    else:
+        cube = None
+        first_day, last_day = days.min(), days.max()
+        term_ids, terms = [], []
+    vocabulary = {term_id: i for i, term_id in enumerate(term_ids)}
+    new_terms = daily_term_counts.drop_duplicates("term_id")
+    for term_id, term in zip(new_terms["term_id"], new_terms["headline_term"]):
+        if term_id not in vocabulary:
+            vocabulary[term_id] = len(term_ids)
+            term_ids.append(term_id)
+            terms.append(term)
+
+    generation_name = uuid.uuid4().hex
+    generation = root / GENERATIONS_DIR / generation_name
+    generation.mkdir()
+    shape = ((last_day - first_day).days + 1, len(terms))
+    counts = np.lib.format.open_memmap(generation / "counts.npy", mode="w+", dtype=np.int32, shape=shape)
+    day_totals = np.zeros(shape[0], dtype=np.int64)
+    if cube is not None:
+        first = (cube.first_day - first_day).days
+        counts[first:first + cube.counts.shape[0], :cube.counts.shape[1]] = cube.counts
+        day_totals[first:first + len(cube.day_totals)] = cube.day_totals
+
+    rows = np.array([(day - first_day).days for day in days])
+    counts[rows] = 0
+    day_totals[rows] = daily_counts["total_frequency"].to_numpy()
+    counts[
+        np.array([(day - first_day).days for day in term_days], dtype=np.int64),
+        daily_term_counts["term_id"].map(vocabulary).to_numpy()
+    ] = daily_term_counts["frequency"].to_numpy()
+    counts.flush()
+
+    np.save(generation / "day_totals.npy", day_totals)
+    np.save(generation / "term_totals.npy", counts.sum(axis=0, dtype=np.int64))
+    np.save(generation / "first_day.npy", np.datetime64(first_day, "D"))
+    np.save(generation / "term_ids.npy", np.array(term_ids, dtype=np.int32))
+    (generation / "terms.txt").write_text("".join(f"{term}\n" for term in terms))
+    del counts
+
+    # NB: `os.replace` is atomic, so readers either see the previous or the new generation
+    pointer = root / f"CURRENT.{generation_name}"
+    pointer.write_text(generation_name)
+    os.replace(pointer, root / "CURRENT")
+    retained = {generation_name, cube.generation_name if cube is not None else None}
+    for stale in (root / GENERATIONS_DIR).iterdir():
+        if stale.is_dir() and GENERATION_PATTERN.fullmatch(stale.name) and stale.name not in retained:
+            shutil.rmtree(stale, ignore_errors=True)
+    logger.info(f"Refreshed term cube @ '{root}' ({shape[0]} days x {shape[1]} terms)")
+
+
+if __name__ == "__main__":
+    pass
@@ -36,6 +36,22 @@ CREATE TABLE raw.nytas (
     _etl_loaded_at_date TIMESTAMP DEFAULT NOW()
 );
 
+-- NB: supports the incremental `dbt` models, which only process URLs loaded since their last run
+CREATE INDEX idx_nytas_url ON raw.nytas (url);
+CREATE INDEX idx_nytas_etl_loaded_at_date ON raw.nytas (_etl_loaded_at_date);
+
+-- Stores the terms of each NYT headline (as tokenized and counted at extract time) for the
+-- (optional) `python_tokenization` mode of `dbt`
+CREATE TABLE raw.nytas_terms (
+    url VARCHAR(2083),
+    headline_md5 CHAR(32),
+    headline_term TEXT,
+    frequency INT,
+    _etl_loaded_at_date TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX idx_nytas_terms_url ON raw.nytas_terms (url);
+
 -- Logs metadata on when the trending algorithm was run (and with which publication date params)
 CREATE TABLE model.run (
     model_run_id SERIAL PRIMARY KEY,
@@ -49,7 +65,8 @@ CREATE TABLE model.run (
 
 CREATE TABLE model.output (
     model_output_id SERIAL PRIMARY KEY,
-    headline_term VARCHAR(50) NOT NULL,
+    -- NB: references `dwh.dim_terms.term_id` (which is materialized by `dbt`, hence no foreign key)
+    term_id INT NOT NULL,
     coef_intercept NUMERIC NOT NULL,
     coef_time NUMERIC NOT NULL,
     rse_time NUMERIC NOT NULL,
@@ -57,3 +74,30 @@ CREATE TABLE model.output (
     model_run_id INT NOT NULL,
     FOREIGN KEY (model_run_id) REFERENCES model.run(model_run_id)
 );
+
+CREATE INDEX idx_output_model_run_id ON model.output (model_run_id);
+
+-- Precomputed rankings of the (filtered) terms of each model run and the time series of the top
+-- ranked terms across the run's window (cf. `src.db.rankings`)
+CREATE TABLE model.ranking (
+    model_run_id INT NOT NULL,
+    term_id INT NOT NULL,
+    headline_term TEXT NOT NULL,
+    coef_time DOUBLE PRECISION NOT NULL,
+    rank_trending INT NOT NULL,
+    rank_shrinking INT NOT NULL,
+    PRIMARY KEY (model_run_id, term_id),
+    FOREIGN KEY (model_run_id) REFERENCES model.run(model_run_id)
+);
+
+CREATE INDEX idx_ranking_trending ON model.ranking (model_run_id, rank_trending);
+CREATE INDEX idx_ranking_shrinking ON model.ranking (model_run_id, rank_shrinking);
+
+CREATE TABLE model.ranking_series (
+    model_run_id INT NOT NULL,
+    term_id INT NOT NULL,
+    publication_date DATE NOT NULL,
+    relative_frequency DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (model_run_id, term_id, publication_date),
+    FOREIGN KEY (model_run_id, term_id) REFERENCES model.ranking(model_run_id, term_id) ON DELETE CASCADE
+);
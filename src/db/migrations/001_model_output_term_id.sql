@@ -0,0 +1,18 @@
+-- Migrates `model.output` of an existing deployment from `headline_term VARCHAR(50)` to `term_id INT`
+-- (cf. `src/db/init.sql`), backfilling the ids from `dwh.dim_terms`.
+--
+-- NB: run `dbt` first, so that `dwh.dim_terms` holds every term of `fct_daily_term_counts`. Should any
+-- output not map onto a term, `SET NOT NULL` fails and the whole migration is rolled back.
+BEGIN;
+
+ALTER TABLE model.output ADD COLUMN term_id INT;
+
+UPDATE model.output AS output
+SET term_id = dim_t.term_id
+FROM dwh.dim_terms AS dim_t
+WHERE dim_t.headline_term = output.headline_term;
+
+ALTER TABLE model.output ALTER COLUMN term_id SET NOT NULL;
+ALTER TABLE model.output DROP COLUMN headline_term;
+
+COMMIT;
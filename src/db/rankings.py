@@ -0,0 +1,357 @@
+"""Precomputed top-N trending / shrinking terms of each model run and a cached query API on top of them.
+
+Rather than re-ranking all of `model.output` (and joining back to `dwh.fct_logit_inputs`) on every
+request, the terms of each model run are ranked once, after the run is ingested (cf.
+`refresh_rankings()`):
+
+* `model.ranking`: the `MAX_RANK` most trending and most shrinking terms of the run (after dropping
+  volatile fits i.e. `rse_time >= MAX_RSE` and the names of months) and their rank in both directions
+* `model.ranking_series`: the relative frequency of each ranked term on each day of the run's window
+
+Queries are then served by `RankingCache`, an in-process LRU cache of results keyed by model run. A
+single `max(model_run_id)` lookup is made per query: when a new `model.run` row appears, the whole
+cache is invalidated (so that e.g. a refit of a previously missing window is picked up).
+"""
+import datetime
+import threading
+import pandas as pd
+import logging
+from collections import OrderedDict
+from dateutil.relativedelta import relativedelta
+from psycopg2 import sql
+from src.db.utils import ConnectionPool, read_sql_typed
+
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ("trending", "shrinking")
+MAX_RANK = 100
+MAX_RSE = 0.30
+# NB: names of months are trivially 'trending' at the start of every month
+EXCLUDED_TERMS = (
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december"
+)
+RANKING_DTYPES = {
+    "rank": "int32",
+    "term_id": "int32",
+    "coef_time": "float64"
+}
+SERIES_DTYPES = {
+    "term_id": "int32",
+    "publication_date": "datetime64[D]",
+    "relative_frequency": "float64"
+}
+
+
+def refresh_rankings(
+    conn,
+    model_run_id: int,
+    max_rank: int = MAX_RANK,
+    max_rse: float = MAX_RSE
+) -> int:
+    """(Re-)computes the rankings (and the time series of the ranked terms) of a model run.
+
+    NB: takes a transaction-level advisory lock on the model run, so that concurrent refreshes of the
+    same run (e.g. `rank_logit_outputs` and `RankingCache.ensure_ranked()`) are serialized rather than
+    colliding on the primary key of `model.ranking`; the lock is released once the caller commits
+
+    :param conn: a connection object (inherited from `psycopg2`)
+    :param model_run_id: ID of the model run (cf. `model.run`)
+    :param max_rank: number of terms to retain in each direction, defaults to `MAX_RANK`
+    :param max_rse: terms whose relative standard error is at least `max_rse` are dropped, defaults
+                    to `MAX_RSE`
+    :return: the number of ranked terms
+    """
+    params = {
+        "model_run_id": model_run_id,
+        "max_rank": max_rank,
+        "max_rse": max_rse,
+        "excluded_terms": list(EXCLUDED_TERMS)
+    }
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('model.ranking'), %(model_run_id)s)", params)
+        cursor.execute("DELETE FROM model.ranking WHERE model_run_id = %(model_run_id)s", params)
+        cursor.execute(
+            """
+                INSERT INTO model.ranking (
+                    model_run_id,
+                    term_id,
+                    headline_term,
+                    coef_time,
+                    rank_trending,
+                    rank_shrinking
+                )
+                SELECT * FROM (
+                    SELECT
+                        mo.model_run_id,
+                        mo.term_id,
+                        dim_t.headline_term,
+                        mo.coef_time::DOUBLE PRECISION,
+                        ROW_NUMBER() OVER (ORDER BY mo.coef_time DESC, mo.term_id) AS rank_trending,
+                        ROW_NUMBER() OVER (ORDER BY mo.coef_time ASC, mo.term_id) AS rank_shrinking
+                    FROM model.output mo
+                    JOIN dwh.dim_terms dim_t ON dim_t.term_id = mo.term_id
+                    WHERE mo.model_run_id = %(model_run_id)s
+                    -- NB: failed fits are stored as 'NaN', which never compares below `max_rse`
+                    AND mo.rse_time < %(max_rse)s
+                    AND dim_t.headline_term <> ALL(%(excluded_terms)s)
+                ) ranked
+                WHERE rank_trending <= %(max_rank)s
+                OR rank_shrinking <= %(max_rank)s
+            """,
+            params
+        )
+        n_terms = cursor.rowcount
+        cursor.execute(
+            """
+                INSERT INTO model.ranking_series (
+                    model_run_id,
+                    term_id,
+                    publication_date,
+                    relative_frequency
+                )
+                SELECT
+                    mr.model_run_id,
+                    r.term_id,
+                    fct.publication_date,
+                    fct.p_estimate::DOUBLE PRECISION
+                FROM model.ranking r
+                JOIN model.run mr ON mr.model_run_id = r.model_run_id
+                JOIN dwh.fct_logit_inputs fct ON fct.term_id = r.term_id
+                                              AND fct.publication_date BETWEEN mr.min_publication_date
+                                                                          AND mr.max_publication_date
+                WHERE r.model_run_id = %(model_run_id)s
+            """,
+            params
+        )
+    logger.info(f"Ranked {n_terms} terms of model run {model_run_id}")
+    return n_terms
+
+
+def get_latest_model_run_id(conn) -> int:
+    """Returns the ID of the latest model run (or 0 if there is none).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(model_run_id), 0) FROM model.run")
+        return cursor.fetchone()[0]
+
+
+def find_model_run_id(
+    conn,
+    as_at: datetime.date,
+    time_horizon_months: int = 6
+) -> int:
+    """Returns the ID of the model run fitted as at `as_at` over the given time horizon (or 0 if there
+    is none).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+                SELECT model_run_id
+                FROM model.run
+                WHERE min_publication_date = %s
+                AND max_publication_date = %s
+            """,
+            (as_at - relativedelta(months=time_horizon_months), as_at)
+        )
+        result = cursor.fetchone()
+        return result[0] if result else 0
+
+
+def read_top_terms(
+    conn,
+    model_run_id: int,
+    n: int = 10,
+    direction: str = "trending"
+) -> pd.DataFrame:
+    """Downloads the top `n` ranked terms of a model run in the given direction.
+
+    :return: a `pd.DataFrame` object with fields `rank`, `term_id`, `headline_term` and `coef_time`
+             (in order of rank)
+    """
+    rank = sql.Identifier(f"rank_{direction}")
+    return read_sql_typed(
+        conn,
+        sql.SQL(
+            """
+                SELECT
+                    {} AS rank,
+                    term_id,
+                    headline_term,
+                    coef_time
+                FROM model.ranking
+                WHERE model_run_id = {}
+                AND {} <= {}
+                ORDER BY {}
+            """
+        ).format(rank, sql.Literal(model_run_id), rank, sql.Literal(n), rank),
+        dtypes=RANKING_DTYPES
+    )
+
+
+def read_top_series(
+    conn,
+    model_run_id: int,
+    n: int = 10,
+    direction: str = "trending"
+) -> pd.DataFrame:
+    """Downloads the time series of the top `n` ranked terms of a model run in the given direction.
+
+    :return: a `pd.DataFrame` object with fields `term_id`, `headline_term`, `publication_date` and
+             `relative_frequency` (in order of term and date, as per `src/view/trending_topics.sql`)
+    """
+    rank = sql.Identifier(f"rank_{direction}")
+    return read_sql_typed(
+        conn,
+        sql.SQL(
+            """
+                SELECT
+                    r.term_id,
+                    r.headline_term,
+                    rs.publication_date,
+                    rs.relative_frequency
+                FROM model.ranking r
+                JOIN model.ranking_series rs ON rs.model_run_id = r.model_run_id
+                                             AND rs.term_id = r.term_id
+                WHERE r.model_run_id = {}
+                AND r.{} <= {}
+                ORDER BY r.headline_term, rs.publication_date
+            """
+        ).format(sql.Literal(model_run_id), rank, sql.Literal(n)),
+        dtypes=SERIES_DTYPES
+    )
+
+
+class RankingCache:
+    """Serves top-N trending / shrinking queries from an in-process LRU cache.
+
+    Every query first checks the latest `model_run_id`; if it has changed since the previous query,
+    the whole cache is invalidated. Model runs whose rankings have not been precomputed (e.g. runs
+    which predate `model.ranking`) are ranked on first request.
+
+    :param pool: connection pool of the data warehouse (cf. `get_pool()`)
+    :param maxsize: maximum number of cached results, defaults to 128
+    :param max_rank: number of terms ranked in each direction (cf. `refresh_rankings()`), defaults to
+                     `MAX_RANK`
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        maxsize: int = 128,
+        max_rank: int = MAX_RANK
+    ):
+        self.pool = pool
+        self.maxsize = maxsize
+        self.max_rank = max_rank
+        self.entries: OrderedDict[tuple, object] = OrderedDict()
+        self.latest_model_run_id = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def lookup(
+        self,
+        key: tuple,
+        conn,
+        compute
+    ):
+        """Returns the cached result for `key` (or computes, caches and returns it via `compute(conn)`).
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = compute(conn)
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def ensure_ranked(
+        self,
+        conn,
+        model_run_id: int
+    ) -> bool:
+        """Ranks the terms of a model run unless its rankings have already been precomputed.
+        """
+        if read_top_terms(conn, model_run_id, n=1).empty:
+            logger.info(f"Rankings of model run {model_run_id} have not been precomputed; ranking now")
+            refresh_rankings(conn, model_run_id, self.max_rank)
+        return True
+
+    def query(
+        self,
+        kind: str,
+        as_at: datetime.date,
+        n: int,
+        direction: str,
+        time_horizon_months: int
+    ) -> pd.DataFrame:
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction '{direction}' (expected one of {DIRECTIONS})")
+        if not 0 < n <= self.max_rank:
+            raise ValueError(f"Only the top {self.max_rank} terms are ranked (requested {n})")
+        read = read_top_terms if kind == "terms" else read_top_series
+        with self.pool.lease() as conn:
+            latest_model_run_id = get_latest_model_run_id(conn)
+            with self.lock:
+                if latest_model_run_id != self.latest_model_run_id:
+                    if self.latest_model_run_id is not None:
+                        logger.info(f"New model run {latest_model_run_id} detected; invalidating cached rankings")
+                    self.entries.clear()
+                    self.latest_model_run_id = latest_model_run_id
+            model_run_id = self.lookup(
+                ("run", as_at, time_horizon_months),
+                conn,
+                lambda conn: find_model_run_id(conn, as_at, time_horizon_months)
+            )
+            if not model_run_id:
+                raise LookupError(f"No model run as at '{as_at}' over {time_horizon_months} months")
+            self.lookup(("ranked", model_run_id), conn, lambda conn: self.ensure_ranked(conn, model_run_id))
+            result = self.lookup(
+                (kind, model_run_id, n, direction),
+                conn,
+                lambda conn: read(conn, model_run_id, n=n, direction=direction)
+            )
+        return result.copy()
+
+    def top_terms(
+        self,
+        as_at: datetime.date,
+        n: int = 10,
+        direction: str = "trending",
+        time_horizon_months: int = 6
+    ) -> pd.DataFrame:
+        """Returns the top `n` trending (or shrinking) terms as at `as_at` (cf. `read_top_terms()`).
+
+        :raises LookupError: if no model has been fitted as at `as_at` over the given time horizon
+        """
+        return self.query("terms", as_at, n, direction, time_horizon_months)
+
+    def top_series(
+        self,
+        as_at: datetime.date,
+        n: int = 10,
+        direction: str = "trending",
+        time_horizon_months: int = 6
+    ) -> pd.DataFrame:
+        """Returns the time series of the top `n` trending (or shrinking) terms as at `as_at` (cf.
+        `read_top_series()`).
+
+        :raises LookupError: if no model has been fitted as at `as_at` over the given time horizon
+        """
+        return self.query("series", as_at, n, direction, time_horizon_months)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,12 +1,43 @@
 """Dedicated module which contains connectivity logic for the remote Postgres database.
+
+Connections can either be opened one at a time (cf. `open_connection()`) or leased from a shared,
+health-checked pool (cf. `ConnectionPool` and `get_pool()`), which avoids paying the connection and
+authentication cost on every flow run, retry and parallel task.
+
+Query results can be downloaded either with type inference (cf. `read_sql()`) or, given an explicit
+map of column data types, streamed straight from `COPY ... TO STDOUT` into NumPy arrays (cf.
+`read_sql_typed()` and `iter_sql_typed()`).
+
+Besides downloads, typed data can be uploaded in PostgreSQL's binary `COPY`
+format (cf. `write_frame()` and `copy_records()`), which avoids formatting (and re-parsing) every
+value as text and preserves floats exactly. The following column types are supported:
+
+* `int2`, `int4` and `int8`
+* `float8`
+* `numeric`
+* `text` (also valid for `varchar` columns)
+* `date` and `timestamp` (NB: as with text input to a `timestamp` column, any UTC offset is ignored
+  i.e. the wall time is stored)
 """
+import io
+import re
+import queue
+import struct
+import threading
+import contextlib
 import psycopg2
+import psycopg2.pool
 import tempfile
+import numpy as np
 import pandas as pd
 import logging
+from decimal import Decimal
+from itertools import islice
+from typing import Iterable, Iterator
 
 from psycopg2 import sql
-from psycopg2.errors import OperationalError
+from psycopg2.errors import OperationalError, InterfaceError
+from src.monitoring.profiling import profiled
 
 
 logger = logging.getLogger(__name__)
@@ -43,6 +74,141 @@ def open_connection(
     return conn
 
 
+class ConnectionPool:
+    """Thread-safe pool of connections to a Postgres database.
+
+    Connections are health-checked (with `SELECT 1`) as they are checked out and replaced if they
+    turn out to be broken (e.g. after a database restart). Checking out a connection blocks whilst
+    all `max_size` connections are leased.
+
+    :param dbname: name of database (see `container_name` property)
+    :param user: username of service account (typically 'postgres')
+    :param password: password of service account (see `POSTGRES_PASSWORD_FILE` property)
+    :param host: address of database instance, defaults to "publications-db"
+    :param port: port on which the database listens for incoming connections, defaults to 5432
+    :param min_size: number of connections opened up front (and kept open), defaults to 1
+    :param max_size: maximum number of connections, defaults to 4
+    :param health_check: if True, connections are checked for liveness on checkout, defaults to True
+    :raises OperationalError: if the initial connections cannot be established
+    """
+
+    def __init__(
+        self,
+        dbname: str,
+        user: str,
+        password: str,
+        host: str = "publications-db",
+        port: int = 5432,
+        min_size: int = 1,
+        max_size: int = 4,
+        health_check: bool = True
+    ):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            min_size,
+            max_size,
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=str(port)
+        )
+        self.max_size = max_size
+        self.health_check = health_check
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    def is_alive(
+        self,
+        conn
+    ) -> bool:
+        """Checks whether `conn` can still execute queries.
+        """
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            return False
+
+    def getconn(self):
+        """Checks out a live connection (reconnecting where necessary).
+
+        :raises OperationalError: if no live connection can be established
+        """
+        self.slots.acquire()
+        try:
+            for _ in range(self.max_size + 1):
+                conn = self.pool.getconn()
+                if self.is_alive(conn):
+                    return conn
+                logger.warning(f"Discarding broken connection to DWH: '{str(conn)}'")
+                self.pool.putconn(conn, close=True)
+            raise OperationalError("Could not check out a live connection to DWH")
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(
+        self,
+        conn
+    ) -> None:
+        """Returns `conn` to the pool (NB: an open transaction is rolled back).
+        """
+        try:
+            self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Context-managed checkout: the transaction is committed if the block succeeds (and rolled
+        back otherwise) before the connection is returned to the pool.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def close(self) -> None:
+        """Closes every connection in the pool.
+        """
+        self.pool.closeall()
+
+
+POOLS: dict[tuple, ConnectionPool] = {}
+POOLS_LOCK = threading.Lock()
+
+
+def get_pool(
+    dbname: str,
+    user: str,
+    password: str,
+    host: str = "publications-db",
+    port: int = 5432,
+    min_size: int = 1,
+    max_size: int = 4
+) -> ConnectionPool:
+    """Returns the connection pool shared by every caller (within the current process) with the
+    same connection parameters, creating it on first use (cf. `ConnectionPool`).
+    """
+    key = (dbname, user, password, host, port, min_size, max_size)
+    with POOLS_LOCK:
+        if key not in POOLS or POOLS[key].pool.closed:
+            POOLS[key] = ConnectionPool(dbname, user, password, host, port, min_size, max_size)
+        return POOLS[key]
+
+
+@profiled()
 def read_sql(
     conn, 
     query: str | sql.SQL
@@ -62,6 +228,469 @@ def read_sql(
         return df
 
 
+
+COPY_TEXT_ESCAPES = {b"b": b"\b", b"f": b"\f", b"n": b"\n", b"r": b"\r", b"t": b"\t", b"v": b"\v", b"\\": b"\\"}
+COPY_TEXT_ESCAPE_PATTERN = re.compile(rb"\\([bfnrtv\\])")
+
+
+def parse_copy_column(
+    data: bytes,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    dtype
+) -> np.ndarray:
+    """Parses a single column of `COPY ... TO STDOUT` (text format) output into a NumPy array.
+
+    Non-text fields are gathered into a fixed-width bytes array and converted by NumPy in bulk, so
+    no per-value Python objects are created (NB: `NULL` is only supported by float columns, as `NaN`,
+    and text columns, as `None`).
+
+    :param data: raw output of `COPY`
+    :param starts: offset of the first byte of the field in each row
+    :param ends: offset one past the last byte of the field in each row
+    :param dtype: NumPy data type of the column (`object` for text)
+    :return: an array of length `len(starts)`
+    """
+    widths = ends - starts
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    null = (widths == 2) & (buffer[starts] == ord("\\")) & (buffer[np.minimum(starts + 1, len(buffer) - 1)] == ord("N"))
+    dtype = np.dtype(dtype)
+    if dtype == object:
+        values = np.empty(len(starts), dtype=object)
+        for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            field = data[start:end]
+            if b"\\" in field:
+                field = COPY_TEXT_ESCAPE_PATTERN.sub(lambda match: COPY_TEXT_ESCAPES[match.group(1)], field)
+            values[i] = field.decode("utf-8")
+        values[null] = None
+        return values
+    max_width = int(widths.max(initial=1)) or 1
+    offsets = np.arange(max_width)
+    chars = np.where(
+        offsets < widths[:, None],
+        buffer[np.minimum(starts[:, None] + offsets, len(buffer) - 1)],
+        0
+    ).astype(np.uint8)
+    fields = chars.view(f"S{max_width}").ravel()
+    if null.any():
+        if dtype.kind not in "fmM":
+            raise ValueError(f"Column of type '{dtype}' contains NULL values")
+        fields[null] = b"nan" if dtype.kind == "f" else b"NaT"
+    return fields.astype(dtype)
+
+
+def parse_copy_text(
+    data: bytes,
+    columns: list[str],
+    dtypes: dict
+) -> pd.DataFrame:
+    """Parses complete rows of `COPY ... TO STDOUT` (text format) output into a `pd.DataFrame` object.
+
+    Row and field boundaries are located in a single vectorized pass (NB: `COPY` escapes tabs and
+    newlines inside fields, so every row contains exactly `len(columns) - 1` tabs).
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    row_ends = np.flatnonzero(buffer == ord("\n"))
+    tabs = np.flatnonzero(buffer == ord("\t"))
+    if len(tabs) != len(row_ends) * (len(columns) - 1):
+        raise ValueError(f"Expected {len(columns)} fields in every row of `COPY` output")
+    tabs = tabs.reshape(len(row_ends), len(columns) - 1)
+    row_starts = np.concatenate([[0], row_ends + 1])[:len(row_ends)].astype(np.int64)
+    starts = np.column_stack([row_starts, tabs + 1])
+    ends = np.column_stack([tabs, row_ends])
+    return pd.DataFrame({
+        name: parse_copy_column(data, starts[:, j], ends[:, j], dtypes.get(name, object))
+        for j, name in enumerate(columns)
+    })
+
+
+class CopyQueueWriter:
+    """Write-only file-like adapter which hands the output of `COPY ... TO STDOUT` to another thread
+    through a bounded queue (i.e. applying backpressure to the download).
+
+    Once `cancelled` is set, any further output is discarded (i.e. the download never blocks on a
+    queue which is no longer consumed).
+    """
+
+    def __init__(
+        self,
+        chunks: queue.Queue,
+        cancelled: threading.Event | None = None
+    ):
+        self.chunks = chunks
+        self.cancelled = cancelled or threading.Event()
+
+    def write(
+        self,
+        data: bytes
+    ) -> int:
+        if not self.cancelled.is_set():
+            self.chunks.put(bytes(data))
+        return len(data)
+
+
+def iter_sql_typed(
+    conn,
+    query: str | sql.SQL,
+    dtypes: dict,
+    chunk_bytes: int = 2 ** 26,
+    max_pending: int = 64
+) -> Iterator[pd.DataFrame]:
+    """Streams the results of a 'SELECT' `query` as a sequence of typed `pd.DataFrame` chunks.
+
+    `COPY ... TO STDOUT` runs in a background thread whilst complete rows are parsed (cf.
+    `parse_copy_text()`) in the calling thread, so neither a temporary file nor type inference is
+    required.
+
+    :param conn: a connection object (inherited from `psycopg2`)
+    :param query: `SELECT` query on Postgres instance
+    :param dtypes: NumPy data type of each column e.g. `{"successes": "int64"}`; columns that are
+                   not listed are read as text (`object`)
+    :param chunk_bytes: approximate size (of raw `COPY` output) of each chunk, defaults to 64MiB
+    :param max_pending: maximum number of raw blocks buffered between the threads, defaults to 64
+    :return: an iterator of `pd.DataFrame` objects (NB: an empty query yields a single empty chunk)
+
+    NB: if the iterator is not exhausted (e.g. `break` or `close()`), the `COPY` is cancelled and its
+    transaction rolled back, so that `conn` can be reused (or returned to its pool)
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT * FROM ({}) AS q LIMIT 0").format(query))
+        columns = [column.name for column in cursor.description]
+
+    chunks = queue.Queue(maxsize=max_pending)
+    cancelled = threading.Event()
+    errors = []
+
+    def download() -> None:
+        try:
+            with conn.cursor() as cursor:
+                bulk_download = sql.SQL("COPY ({}) TO STDOUT").format(query)
+                cursor.copy_expert(bulk_download, CopyQueueWriter(chunks, cancelled))
+        except Exception as err:
+            errors.append(err)
+        finally:
+            chunks.put(None)
+
+    downloader = threading.Thread(target=download, daemon=True)
+    downloader.start()
+    pending, n_pending, n_chunks = [], 0, 0
+    finished = False
+    try:
+        while (chunk := chunks.get()) is not None:
+            pending.append(chunk)
+            n_pending += len(chunk)
+            if n_pending >= chunk_bytes:
+                data = b"".join(pending)
+                cut = data.rfind(b"\n") + 1
+                pending, n_pending = [data[cut:]], len(data) - cut
+                n_chunks += 1
+                yield parse_copy_text(data[:cut], columns, dtypes)
+        finished = True
+    finally:
+        if not finished:
+            # NB: the consumer stopped early, so the query is cancelled and the queue drained until the
+            # downloader exits (rather than leaving it blocked on a full queue, mid-`COPY`)
+            cancelled.set()
+            conn.cancel()
+            while chunks.get() is not None:
+                pass
+        downloader.join()
+        if not finished and errors:
+            conn.rollback()
+    if errors:
+        raise errors[0]
+    if n_pending or not n_chunks:
+        yield parse_copy_text(b"".join(pending), columns, dtypes)
+
+
+@profiled()
+def read_sql_typed(
+    conn,
+    query: str | sql.SQL,
+    dtypes: dict
+) -> pd.DataFrame:
+    """Efficiently download the results of a 'SELECT' `query` into a `pd.DataFrame` object with the
+    given column data types (cf. `iter_sql_typed()`).
+
+    :param conn: a connection object (inherited from `psycopg2`)
+    :param query: `SELECT` query on Postgres instance
+    :param dtypes: NumPy data type of each column; unlisted columns are read as text (`object`)
+    :return: a dataframe object mirroring the result of the `SELECT` query
+    """
+    chunks = list(iter_sql_typed(conn, query, dtypes))
+    return chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+
+
+PG_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PG_COPY_TRAILER = struct.pack(">h", -1)
+PG_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+PG_INT_WIDTHS = {"int2": 2, "int4": 4, "int8": 8}
+# NB: the UTC offset (if any) which trails the time of an ISO-formatted timestamp
+UTC_OFFSET_PATTERN = re.compile(r"(?<=\d\d:\d\d)((?::\d\d)?(?:\.\d+)?)(?:Z|[+-]\d\d(?::?\d\d)?)$")
+PG_NUMERIC_NAN, PG_NUMERIC_POS, PG_NUMERIC_NEG, PG_NUMERIC_PINF, PG_NUMERIC_NINF = 0xC000, 0x0000, 0x4000, 0xD000, 0xF000
+
+
+def encode_numeric(
+    value: float | int | Decimal
+) -> bytes:
+    """Encodes a single value in the binary format of the Postgres `numeric` type (i.e. base-10000
+    digits alongside a weight, sign and display scale).
+
+    NB: floats are converted via their shortest round-trip representation, so they are stored exactly
+    as Python prints them (e.g. `0.1` rather than `0.1000000000000000055511151231257827`).
+    """
+    number = Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+    if number.is_nan():
+        return struct.pack(">hhHh", 0, 0, PG_NUMERIC_NAN, 0)
+    if number.is_infinite():
+        return struct.pack(">hhHh", 0, 0, PG_NUMERIC_NINF if number < 0 else PG_NUMERIC_PINF, 0)
+    sign, digits, exponent = number.as_tuple()
+    dscale = max(-exponent, 0)
+    # NB: rescale to an integer number of base-10000 'fractional' digits
+    n_groups = -(-dscale // 4)
+    scaled = int("".join(map(str, digits)) or "0") * 10 ** (4 * n_groups + exponent)
+    groups = []
+    while scaled:
+        scaled, group = divmod(scaled, 10000)
+        groups.append(group)
+    groups.reverse()
+    weight = len(groups) - 1 - n_groups
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    return struct.pack(
+        f">hhHh{len(groups)}h",
+        len(groups),
+        weight,
+        PG_NUMERIC_NEG if sign and groups else PG_NUMERIC_POS,
+        dscale,
+        *groups
+    )
+
+
+def encode_column(
+    values: pd.Series,
+    pg_type: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """Encodes a column of values in binary `COPY` format (where nulls and NaNs are encoded as `NULL`).
+
+    :param values: `pd.Series` object holding the values of the column
+    :param pg_type: Postgres type of the target column (see module docstring)
+    :return: a tuple of (a) the length of every encoded value (-1 for `NULL`) and (b) the encoded
+             non-null values concatenated into a single `np.uint8` array
+    """
+    null = values.isna().to_numpy()
+    valid = values[~null]
+    if pg_type in PG_INT_WIDTHS:
+        width = PG_INT_WIDTHS[pg_type]
+        array = valid.to_numpy(dtype=np.int64)
+        info = np.iinfo(f"i{width}")
+        if array.size and (array.min() < info.min or array.max() > info.max):
+            raise OverflowError(f"Values of series '{values.name}' do not fit into `{pg_type}`")
+        payload = array.astype(f">i{width}").view(np.uint8)
+        return np.where(null, -1, width).astype(np.int32), payload
+    if pg_type == "float8":
+        payload = valid.to_numpy(dtype=np.float64).astype(">f8").view(np.uint8)
+        return np.where(null, -1, 8).astype(np.int32), payload
+    if pg_type in ("date", "timestamp"):
+        # NB: offsets are dropped (rather than converted to UTC), so that the same wall time is stored as
+        # when staged records are loaded via a text `COPY` (cf. `src.data_loader.load.ingest()`)
+        if valid.dtype == object:
+            valid = valid.astype(str).str.replace(UTC_OFFSET_PATTERN, r"\1", regex=True)
+        timestamps = pd.to_datetime(valid, format="ISO8601")
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_localize(None)
+        timestamps = timestamps.to_numpy(dtype="datetime64[us]")
+        if pg_type == "date":
+            days = (timestamps.astype("datetime64[D]") - PG_EPOCH.astype("datetime64[D]")).astype(np.int64)
+            return np.where(null, -1, 4).astype(np.int32), days.astype(">i4").view(np.uint8)
+        micros = (timestamps - PG_EPOCH).astype(np.int64)
+        return np.where(null, -1, 8).astype(np.int32), micros.astype(">i8").view(np.uint8)
+    if pg_type == "numeric":
+        encoded = [encode_numeric(value) for value in valid]
+    elif pg_type == "text":
+        encoded = [str(value).encode("utf-8") for value in valid]
+    else:
+        raise ValueError(f"Unsupported type '{pg_type}' for series '{values.name}'")
+    lengths = np.full(len(values), -1, dtype=np.int32)
+    lengths[~null] = np.fromiter(map(len, encoded), dtype=np.int32, count=len(encoded))
+    return lengths, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def encode_rows(
+    df: pd.DataFrame,
+    types: dict[str, str]
+) -> bytes:
+    """Encodes every row of `df` as a binary `COPY` tuple (excluding the file header and trailer).
+
+    All columns are encoded in bulk (cf. `encode_column()`) and then scattered into a single buffer,
+    so no per-row Python objects are created.
+    """
+    columns = [encode_column(df[name], types[name]) for name in df.columns]
+    n_rows = len(df)
+    row_sizes = 2 + sum(4 + np.maximum(lengths, 0).astype(np.int64) for lengths, _ in columns)
+    row_starts = np.cumsum(row_sizes) - row_sizes
+    buffer = np.empty(int(np.sum(row_sizes)), dtype=np.uint8)
+
+    buffer[row_starts[:, None] + np.arange(2)] = np.full(n_rows, len(columns), dtype=">i2").view(np.uint8).reshape(n_rows, 2)
+    position = row_starts + 2
+    for lengths, payload in columns:
+        buffer[position[:, None] + np.arange(4)] = lengths.astype(">i4").view(np.uint8).reshape(n_rows, 4)
+        position += 4
+        valid_lengths = np.maximum(lengths, 0).astype(np.int64)
+        value_starts = position[lengths >= 0]
+        value_lengths = valid_lengths[lengths >= 0]
+        payload_starts = np.cumsum(value_lengths) - value_lengths
+        buffer[np.repeat(value_starts - payload_starts, value_lengths) + np.arange(payload.size)] = payload
+        position += valid_lengths
+    return buffer.tobytes()
+
+
+class BinaryCopyStream(io.RawIOBase):
+    """Read-only file-like adapter which lazily concatenates the binary `COPY` header, the encoded
+    `batches` of rows and the trailer as `COPY ... FROM STDIN` consumes it.
+    """
+
+    def __init__(
+        self,
+        batches: Iterator[bytes]
+    ):
+        self.batches = batches
+        self.pending = PG_COPY_HEADER
+        self.finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(
+        self,
+        size: int = -1
+    ) -> bytes:
+        chunks = [self.pending]
+        length = len(self.pending)
+        while (size < 0 or length < size) and not self.finished:
+            chunk = next(self.batches, None)
+            if chunk is None:
+                chunk, self.finished = PG_COPY_TRAILER, True
+            chunks.append(chunk)
+            length += len(chunk)
+        data = b"".join(chunks)
+        if size < 0:
+            self.pending = b""
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+
+def infer_pg_types(
+    df: pd.DataFrame
+) -> dict[str, str]:
+    """Infers the Postgres type of every column of `df` from its `dtype` (cf. `write_frame()`).
+    """
+    types = {}
+    for name, dtype in df.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype):
+            types[name] = {1: "int2", 2: "int2", 4: "int4"}.get(dtype.itemsize, "int8")
+        elif pd.api.types.is_float_dtype(dtype):
+            types[name] = "float8"
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            types[name] = "timestamp"
+        else:
+            types[name] = "text"
+    return types
+
+
+def copy_binary(
+    conn,
+    schema: str,
+    table: str,
+    columns: list,
+    batches: Iterator[bytes]
+) -> None:
+    """Streams encoded `batches` of rows (cf. `encode_rows()`) into `schema.table` via binary `COPY`.
+    """
+    bulk_insert = sql.SQL("COPY {}.{} ({}) FROM STDIN WITH (FORMAT binary)").format(
+        sql.Identifier(schema),
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    with conn.cursor() as cursor:
+        cursor.copy_expert(bulk_insert, BinaryCopyStream(batches))
+
+
+def write_frame(
+    conn,
+    df: pd.DataFrame,
+    schema: str,
+    table: str,
+    types: dict[str, str] | None = None,
+    batch_size: int = 100_000
+) -> int:
+    """Efficiently upload `df` into `schema.table` via binary `COPY` (i.e. without a staging file).
+
+    NB: the transaction is left open, so the caller is responsible for committing (or rolling back).
+
+    :param conn: a connection object (inherited from `psycopg2`)
+    :param df: `pd.DataFrame` object whose columns are named after the target columns
+    :param schema: schema of the target table
+    :param table: name of the target table
+    :param types: Postgres type of each column (see module docstring); types that are not provided
+                  are inferred from the `dtype` of the column, defaults to None
+    :param batch_size: number of rows to encode at a time, defaults to 100_000
+    :return: number of rows uploaded
+    """
+    types = {**infer_pg_types(df), **(types or {})}
+    copy_binary(
+        conn,
+        schema,
+        table,
+        list(df.columns),
+        (encode_rows(df.iloc[i:i + batch_size], types) for i in range(0, len(df), batch_size))
+    )
+    return len(df)
+
+
+def copy_records(
+    conn,
+    schema: str,
+    table: str,
+    columns: list,
+    types: dict[str, str],
+    records: Iterable[dict],
+    batch_size: int = 10_000,
+    empty_as_null: bool = True
+) -> int:
+    """Efficiently upload a stream of dictionary-based `records` into `schema.table` via binary `COPY`.
+
+    Records are encoded in batches of `batch_size`, so the stream is never held in memory in full.
+
+    :param conn: a connection object (inherited from `psycopg2`)
+    :param schema: schema of the target table
+    :param table: name of the target table
+    :param columns: list of columns to be uploaded (i.e. the record keys)
+    :param types: Postgres type of each column (see module docstring)
+    :param records: an iterable (e.g. a stream) of dictionary-based 'records'
+    :param batch_size: number of records to encode at a time, defaults to 10_000
+    :param empty_as_null: if True, empty strings are uploaded as `NULL` (as per a CSV `COPY`), defaults to True
+    :return: number of records uploaded
+    """
+    records = iter(records)
+    n_records = 0
+
+    def batches() -> Iterator[bytes]:
+        nonlocal n_records
+        while batch := list(islice(records, batch_size)):
+            df = pd.DataFrame.from_records(batch, columns=columns)
+            if empty_as_null:
+                df = df.mask(df.eq(""))
+            n_records += len(df)
+            yield encode_rows(df, types)
+
+    copy_binary(conn, schema, table, columns, batches())
+    return n_records
+
+
 if __name__ == "__main__":
     
     open_connection(
@@ -1,3 +1,28 @@
 """Contains the core logic required to fit a logistic growth model to the appropriate input data.
+
+NB: the public API is imported lazily (PEP 562), so importing the package does not import `pandas` et al.
 """
-from src.model.algorithm import compute_batch_trend
\ No newline at end of file
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.model.algorithm import compute_batch_trend
+    from src.model.horizons import compute_horizon_trends
+
+LAZY_ATTRIBUTES = {
+    "compute_batch_trend": "src.model.algorithm",
+    "compute_horizon_trends": "src.model.horizons"
+}
+__all__ = list(LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
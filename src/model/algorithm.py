@@ -1,15 +1,18 @@
 import pandas as pd
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
 import src.model.schema as schema
+import numpy as np
 import logging
-from pandera import check_input, check_output
+from functools import partial
+from src.model.irls import TermBatch, group_terms, fit_logit_irls
+from src.model.parallel import fit_batch_parallel
+from src.monitoring.metrics import count
+from src.monitoring.profiling import profiled
 
 
 logger = logging.getLogger(__name__)
 
 
-@check_input(schema.TERM_DF)
+@schema.check_input("TERM_DF", scope="term")
 def compute_term_trend(
     term_df: pd.DataFrame
 ) -> dict[str, float]:
@@ -27,6 +30,9 @@ def compute_term_trend(
                     * `cum_time_elapsed`
     :return: a dictionary of 
     """
+    # NB: `statsmodels` is slow to import and only required by the reference engine
+    import statsmodels.api as sm
+    import statsmodels.formula.api as smf
     model = smf.glm(
         "successes + failures ~ cum_time_elapsed", 
         family=sm.families.Binomial(), 
@@ -41,31 +47,92 @@ def compute_term_trend(
     }
     
 
-@check_input(schema.LOGIT_INPUTS)
-@check_output(schema.LOGIT_OUTPUTS)
+def fit_term_batch(
+    batch: TermBatch,
+    engine: str = "irls"
+) -> pd.DataFrame:
+    """Fits the logistic growth model to every term in a group-sorted `batch` with the given engine.
+
+    :param batch: group-sorted inputs (cf. `group_terms()`)
+    :param engine: name of the fitting engine (cf. `compute_batch_trend()`), defaults to "irls"
+    :return: statistical fitting output (one row per term, in the order of `batch.terms`)
+    """
+    if engine == "irls":
+        return fit_logit_irls(batch).drop(columns="converged")
+    if engine != "statsmodels":
+        raise ValueError(f"Unknown fitting engine: '{engine}'")
+    trend_factors = []
+    for term, start, stop in zip(batch.terms, batch.offsets[:-1], batch.offsets[1:]):
+        term_df = pd.DataFrame({
+            "successes": batch.successes[start:stop].astype(np.int64),
+            "failures": batch.failures[start:stop].astype(np.int64),
+            "cum_time_elapsed": batch.cum_time_elapsed[start:stop].astype(np.int64)
+        })
+        try:
+            trend_factors.append(compute_term_trend(term_df))
+        except RuntimeWarning:
+            logger.warning(f"Erroneous fitting detected for term ID {term}; negating output.")
+            trend_factors.append({})
+    return pd.DataFrame(
+        trend_factors, 
+        columns=["coef_intercept", "coef_time", "rse_time", "p_value_time"], 
+        dtype=float
+    )
+
+
+def drop_failed_fits(
+    logit_outputs: pd.DataFrame
+) -> pd.DataFrame:
+    """Drops (and logs) the terms whose fit failed or was negated i.e. whose statistics are `NaN`, which
+    are counted as `failed_fits` in the metrics of the current flow run (if tracked).
+
+    NB: `LOGIT_OUTPUTS` (and `model.output`) are non-nullable, so a single failed fit (e.g. a term
+    observed on a single day) would otherwise fail the whole run
+    """
+    failed = logit_outputs[["coef_intercept", "coef_time", "rse_time", "p_value_time"]].isna().any(axis=1)
+    count("failed_fits", int(failed.sum()))
+    if failed.any():
+        logger.warning(f"Dropping {int(failed.sum())} term(s) whose fit failed: term IDs {logit_outputs.loc[failed, 'term_id'].tolist()}")
+    return logit_outputs[~failed].reset_index(drop=True)
+
+
+@profiled()
+@schema.check_input("LOGIT_INPUTS")
+@schema.check_output("LOGIT_OUTPUTS")
 def compute_batch_trend(
-    logit_inputs: pd.DataFrame
+    logit_inputs: pd.DataFrame,
+    engine: str = "irls",
+    n_workers: int = 1,
+    warm_start: pd.DataFrame | None = None
 ) -> pd.DataFrame:
-    """Runs the trend fitting exercise (via `compute_term_trend()`) across a series of terms.
+    """Runs the trend fitting exercise across a series of terms.
+
+    Two fitting engines are available:
+
+    * `irls`: fits every term at once via batched IRLS (cf. `src.model.irls`)
+    * `statsmodels`: fits each term in turn via `compute_term_trend()` (the reference implementation)
 
     :param logit_inputs: A `pd.DataFrame` object with fields: 
-                         * `headline_term`
+                         * `term_id` (`int32`, cf. `dwh.dim_terms`)
                          * `successes`
                          * `failures`
                          * `cum_time_elapsed`
-    :return: statistical fitting output associated with each `headline_term`
+    :param engine: name of the fitting engine, defaults to "irls"
+    :param n_workers: number of processes to fit across (cf. `src.model.parallel`), defaults to 1
+    :param warm_start: optional starting values for IRLS with fields `term_id`, `coef_intercept`
+                       and `coef_time` (cf. `src.model.incremental`); ignored by `statsmodels`
+    :return: statistical fitting output associated with each `term_id` (excluding failed fits, cf.
+             `drop_failed_fits()`)
     """
-    terms = list(logit_inputs["headline_term"].unique())
-    trend_factors = {}
-    for term in terms:
-        term_df = logit_inputs[logit_inputs["headline_term"] == term]
-        try:
-            trend_factors[term] = compute_term_trend(term_df)
-        except RuntimeWarning:
-            logger.warning(f"Erroneous fitting detected for term '{term}'; negating output.")
-            trend_factors[term] = None
-    logit_outputs = pd.DataFrame.from_dict(trend_factors, orient="index").reset_index(names="headline_term")
-    return logit_outputs
+    if engine not in ("irls", "statsmodels"):
+        raise ValueError(f"Unknown fitting engine: '{engine}'")
+    batch = group_terms(logit_inputs, warm_start=warm_start)
+    if n_workers > 1:
+        logit_outputs = fit_batch_parallel(batch, partial(fit_term_batch, engine=engine), n_workers)
+    else:
+        logit_outputs = fit_term_batch(batch, engine)
+    logit_outputs.insert(0, "term_id", batch.terms)
+    return drop_failed_fits(logit_outputs)
 
 
 if __name__ == '__main__':
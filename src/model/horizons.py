@@ -0,0 +1,124 @@
+"""Fits the logistic growth model over several time horizons (e.g. 1, 3, 6 and 12 months) at once.
+
+Every horizon ends on the same `as_at` date, so each window is a suffix of the widest one. Only the
+widest window is downloaded. The inputs of each narrower window are derived from its group-sorted
+arrays by dropping the rows before its start date, re-expressing `cum_time_elapsed` (and any warm
+start) relative to that date and re-applying the frequency threshold. Since counts are non-negative,
+the threshold of a narrower window only ever removes terms from the widest window.
+
+The windows are then stacked into a single `TermBatch`, so every horizon is fitted in one pass
+(and, where `n_workers > 1`, with one process pool).
+"""
+import numpy as np
+import pandas as pd
+import logging
+from functools import partial
+import src.model.schema as schema
+from src.model.algorithm import fit_term_batch, drop_failed_fits
+from src.model.irls import TermBatch, group_terms
+from src.model.parallel import fit_batch_parallel
+from src.monitoring.profiling import profiled
+
+
+logger = logging.getLogger(__name__)
+
+
+def slice_batch(
+    batch: TermBatch,
+    shift: int,
+    min_frequency: int = 0
+) -> TermBatch:
+    """Derives the inputs of a narrower window from the group-sorted inputs of a wider window which
+    ends on the same date.
+
+    :param batch: group-sorted inputs of the wider window (cf. `group_terms()`)
+    :param shift: number of days between the start of the wider window and that of the narrower window
+    :param min_frequency: minimum frequency of each term within the narrower window, defaults to 0
+    :return: a `TermBatch` whose `cum_time_elapsed` is measured from the start of the narrower window
+    """
+    group = np.repeat(np.arange(len(batch.terms)), np.diff(batch.offsets))
+    keep = batch.cum_time_elapsed >= shift
+    n_rows = np.bincount(group, weights=keep, minlength=len(batch.terms))
+    frequency = np.bincount(group, weights=np.where(keep, batch.successes, 0), minlength=len(batch.terms))
+    terms = (n_rows > 0) & (frequency >= min_frequency)
+    rows = keep & terms[group]
+    offsets = np.zeros(terms.sum() + 1, dtype=np.int64)
+    np.cumsum(n_rows[terms].astype(np.int64), out=offsets[1:])
+    # NB: logit(p) = a + b * (t + shift), so the warm start is re-expressed as (a + b * shift, b)
+    return TermBatch(
+        terms=batch.terms[terms],
+        offsets=offsets,
+        cum_time_elapsed=batch.cum_time_elapsed[rows] - shift,
+        successes=batch.successes[rows],
+        failures=batch.failures[rows],
+        init_intercept=None if batch.init_intercept is None else (batch.init_intercept + batch.init_time * shift)[terms],
+        init_time=None if batch.init_time is None else batch.init_time[terms]
+    )
+
+
+def stack_batches(
+    batches: list[TermBatch]
+) -> TermBatch:
+    """Concatenates `batches` into a single `TermBatch` (in which a term may appear more than once).
+    """
+    offsets = [np.zeros(1, dtype=np.int64)]
+    for batch in batches:
+        offsets.append(batch.offsets[1:] + offsets[-1][-1])
+    warm = all(batch.init_intercept is not None for batch in batches)
+    return TermBatch(
+        terms=np.concatenate([batch.terms for batch in batches]),
+        offsets=np.concatenate(offsets),
+        cum_time_elapsed=np.concatenate([batch.cum_time_elapsed for batch in batches]),
+        successes=np.concatenate([batch.successes for batch in batches]),
+        failures=np.concatenate([batch.failures for batch in batches]),
+        init_intercept=np.concatenate([batch.init_intercept for batch in batches]) if warm else None,
+        init_time=np.concatenate([batch.init_time for batch in batches]) if warm else None
+    )
+
+
+@profiled()
+@schema.check_input("LOGIT_INPUTS")
+def compute_horizon_trends(
+    logit_inputs: pd.DataFrame,
+    shifts: dict[int, int],
+    min_frequency: int = 0,
+    engine: str = "irls",
+    n_workers: int = 1,
+    warm_start: pd.DataFrame | None = None
+) -> dict[int, pd.DataFrame]:
+    """Runs the trend fitting exercise across a series of terms for several windows which end on the
+    same date, given the inputs of the widest window.
+
+    :param logit_inputs: inputs of the widest window (cf. `compute_batch_trend()`)
+    :param shifts: the number of days between the start of the widest window and that of each window,
+                   keyed by horizon (e.g. `{12: 0, 6: 182, 1: 334}`)
+    :param min_frequency: minimum frequency of each term within each window, defaults to 0
+    :param engine: name of the fitting engine (cf. `compute_batch_trend()`), defaults to "irls"
+    :param n_workers: number of processes to fit across (cf. `src.model.parallel`), defaults to 1
+    :param warm_start: optional starting values for IRLS *over the widest window* with fields `term_id`,
+                       `coef_intercept` and `coef_time`; ignored by `statsmodels`
+    :return: statistical fitting output associated with each `term_id` (excluding failed fits, cf.
+             `drop_failed_fits()`), keyed by horizon
+    """
+    if engine not in ("irls", "statsmodels"):
+        raise ValueError(f"Unknown fitting engine: '{engine}'")
+    batch = group_terms(logit_inputs, warm_start=warm_start)
+    windows = {horizon: slice_batch(batch, shift, min_frequency) for horizon, shift in shifts.items()}
+    stacked = stack_batches(list(windows.values()))
+    logger.info(f"Fitting {len(stacked.terms)} term windows across {len(windows)} horizon(s) in a single pass")
+    if n_workers > 1:
+        stacked_outputs = fit_batch_parallel(stacked, partial(fit_term_batch, engine=engine), n_workers)
+    else:
+        stacked_outputs = fit_term_batch(stacked, engine)
+    stacked_outputs.insert(0, "term_id", stacked.terms)
+
+    logit_outputs, start = {}, 0
+    for horizon, window in windows.items():
+        stop = start + len(window.terms)
+        logit_outputs[horizon] = schema.validate(drop_failed_fits(stacked_outputs.iloc[start:stop]), "LOGIT_OUTPUTS")
+        start = stop
+    return logit_outputs
+
+
+if __name__ == '__main__':
+    pass
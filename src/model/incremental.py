@@ -0,0 +1,175 @@
+"""Incremental (rolling window) refits of the logistic growth model.
+
+Consecutive `as_at` dates share most of their training window e.g. a 6-month window rolled forward
+by one month shares five months of data with its predecessor. Rather than re-downloading the whole
+window, the per-term daily `successes` / `failures` of the previous window (i.e. the sufficient
+statistics of each term's model *for that window*) are persisted locally alongside the fitted
+coefficients. A refit then only requires:
+
+* the rows which fall inside the new window but after the previous window (i.e. the 'new month')
+* the full history of any term which was not part of the previous window
+
+The expired rows are dropped and IRLS is warm-started from the previous coefficients.
+
+Note: this assumes that the data in the overlapping period is unchanged between runs (which holds
+for 'closed' months).
+"""
+import datetime
+import numpy as np
+import pandas as pd
+import logging
+from pathlib import Path
+from typing import NamedTuple
+from src.model.irls import group_terms
+
+
+logger = logging.getLogger(__name__)
+
+
+class WindowState(NamedTuple):
+    """Inputs and outputs of a logistic growth fit over a given window.
+
+    `cum_time_elapsed` is measured in days from `start_date` and rows are group-sorted by term
+    (i.e. the rows of `term_ids[g]` are located at `offsets[g]:offsets[g + 1]`).
+    """
+    start_date: datetime.date
+    end_date: datetime.date
+    term_ids: np.ndarray
+    offsets: np.ndarray
+    cum_time_elapsed: np.ndarray
+    successes: np.ndarray
+    failures: np.ndarray
+    coef_intercept: np.ndarray
+    coef_time: np.ndarray
+
+
+def state_path(
+    state_dir: str | Path,
+    start_date: datetime.date,
+    end_date: datetime.date
+) -> Path:
+    """Constructs the path at which the state of a given window is persisted.
+    """
+    return Path(state_dir) / f"{start_date.isoformat()}_{end_date.isoformat()}_logit_state.npz"
+
+
+def build_state(
+    start_date: datetime.date,
+    end_date: datetime.date,
+    logit_inputs: pd.DataFrame,
+    logit_outputs: pd.DataFrame
+) -> WindowState:
+    """Captures the inputs and outputs of a fit over [`start_date`, `end_date`] as a `WindowState`.
+
+    :param start_date: start of the window (i.e. the origin of `cum_time_elapsed`)
+    :param end_date: end of the window
+    :param logit_inputs: inputs to the fit (cf. `compute_batch_trend()`)
+    :param logit_outputs: outputs of the fit (cf. `compute_batch_trend()`)
+    :return: a `WindowState` object
+    """
+    batch = group_terms(logit_inputs, warm_start=logit_outputs)
+    return WindowState(
+        start_date=start_date,
+        end_date=end_date,
+        term_ids=batch.terms.astype(np.int32),
+        offsets=batch.offsets,
+        cum_time_elapsed=batch.cum_time_elapsed.astype(np.int32),
+        successes=batch.successes.astype(np.int64),
+        failures=batch.failures.astype(np.int64),
+        coef_intercept=batch.init_intercept,
+        coef_time=batch.init_time
+    )
+
+
+def save_state(
+    path: str | Path,
+    state: WindowState
+) -> None:
+    """Persists `state` to disk in (compressed) `.npz` format.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fields = state._asdict()
+    fields["start_date"] = np.datetime64(state.start_date)
+    fields["end_date"] = np.datetime64(state.end_date)
+    with open(path, "wb") as fp:
+        np.savez_compressed(fp, **fields)
+
+
+def load_state(
+    path: str | Path
+) -> WindowState | None:
+    """Loads a `WindowState` previously persisted via `save_state()`.
+
+    :param path: path to the `.npz` file
+    :return: a `WindowState` object or `None` if no state has been persisted at `path` (or if it was
+             persisted in an outdated format e.g. keyed by term text rather than `term_id`)
+    """
+    if not Path(path).exists():
+        return None
+    with np.load(path) as npz:
+        if not set(WindowState._fields).issubset(npz.files):
+            logger.warning(f"Ignoring outdated window state @ '{path}'")
+            return None
+        fields = {name: npz[name] for name in WindowState._fields}
+    fields["start_date"] = fields["start_date"].item()
+    fields["end_date"] = fields["end_date"].item()
+    return WindowState(**fields)
+
+
+def roll_window(
+    state: WindowState,
+    new_inputs: pd.DataFrame,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    min_frequency: int = 0
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Rolls the window of `state` forward to [`start_date`, `end_date`].
+
+    Rows of `state` that fall before `start_date` are dropped, `new_inputs` are appended, terms whose
+    total successes over the new window fall short of `min_frequency` are dropped and the previous
+    coefficients are re-expressed relative to the new origin. Since
+    `logit(p) = a + b * (t + shift)` where `shift` is the number of days between the two origins,
+    the warm start for the new window is `(a + b * shift, b)`.
+
+    :param state: state of the previous window
+    :param new_inputs: a `pd.DataFrame` object with fields `term_id`, `successes`, `failures` and
+                       `cum_time_elapsed` (measured from `start_date`) covering every row of the new
+                       window which is *not* part of `state`
+    :param start_date: start of the new window
+    :param end_date: end of the new window
+    :param min_frequency: minimum frequency of each term over the new window, defaults to 0
+    :return: a tuple of (a) the logit inputs of the new window and (b) warm start coefficients
+    """
+    if not (state.start_date <= start_date <= state.end_date <= end_date):
+        raise ValueError(
+            f"Cannot roll window [{state.start_date}, {state.end_date}] to [{start_date}, {end_date}]"
+        )
+    shift = (start_date - state.start_date).days
+    retained_inputs = pd.DataFrame({
+        "term_id": np.repeat(state.term_ids, np.diff(state.offsets)),
+        "cum_time_elapsed": state.cum_time_elapsed.astype(np.int64) - shift,
+        "successes": state.successes,
+        "failures": state.failures
+    })
+    retained_inputs = retained_inputs[retained_inputs["cum_time_elapsed"] >= 0]
+    logit_inputs = pd.concat(
+        [retained_inputs, new_inputs[retained_inputs.columns]],
+        ignore_index=True
+    )
+    if min_frequency:
+        window_frequency = logit_inputs.groupby("term_id")["successes"].transform("sum")
+        logit_inputs = logit_inputs[window_frequency >= min_frequency].reset_index(drop=True)
+    warm_start = pd.DataFrame({
+        "term_id": state.term_ids,
+        "coef_intercept": state.coef_intercept + state.coef_time * shift,
+        "coef_time": state.coef_time
+    })
+    logger.info(
+        f"Rolled window forward by {shift} days: retained {len(retained_inputs)} rows "
+        f"and appended {len(new_inputs)} rows"
+    )
+    return logit_inputs, warm_start
+
+
+if __name__ == '__main__':
+    pass
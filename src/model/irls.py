@@ -0,0 +1,166 @@
+"""Batched binomial-logit fitter which estimates the two-parameter model behind `compute_term_trend()`
+for every term at once via iteratively reweighted least squares ("IRLS").
+
+Rather than building one `statsmodels` model per term, the inputs are sorted into contiguous
+per-term segments and every IRLS step is expressed as a handful of segment-wise sums
+(cf. `np.add.reduceat`), so the cost of a full batch is a few passes over flat NumPy arrays.
+"""
+import numpy as np
+import pandas as pd
+import logging
+from typing import NamedTuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class TermBatch(NamedTuple):
+    """Group-sorted (i.e. term-contiguous) arrays describing the logit inputs of a batch of terms.
+
+    `terms` holds the ID of each term (cf. `dwh.dim_terms`) and the rows belonging to `terms[g]` are
+    located at `offsets[g]:offsets[g + 1]` of each array. Optionally, `init_intercept` and `init_time`
+    carry per-term starting values for IRLS.
+    """
+    terms: np.ndarray
+    offsets: np.ndarray
+    cum_time_elapsed: np.ndarray
+    successes: np.ndarray
+    failures: np.ndarray
+    init_intercept: np.ndarray | None = None
+    init_time: np.ndarray | None = None
+
+
+def group_terms(
+    logit_inputs: pd.DataFrame,
+    term_col: str = "term_id",
+    warm_start: pd.DataFrame | None = None
+) -> TermBatch:
+    """Sorts the long-format logit inputs into contiguous per-term segments.
+
+    Terms retain the order in which they first appear in `logit_inputs` (i.e. the same order as
+    `logit_inputs[term_col].unique()`) and rows retain their relative order within each term.
+
+    :param logit_inputs: A `pd.DataFrame` object with fields `term_col`, `successes`, `failures` and
+                         `cum_time_elapsed`
+    :param term_col: name of the field that identifies each term, defaults to "term_id"
+    :param warm_start: optional `pd.DataFrame` with fields `term_col`, `coef_intercept` and `coef_time`
+                       holding starting values for (some of) the terms
+    :return: a `TermBatch` of group-sorted arrays
+    """
+    codes, terms = pd.factorize(logit_inputs[term_col], sort=False)
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(terms)), out=offsets[1:])
+    init_intercept, init_time = None, None
+    if warm_start is not None:
+        init = warm_start.set_index(term_col).reindex(terms)
+        init_intercept = init["coef_intercept"].to_numpy(dtype=np.float64)
+        init_time = init["coef_time"].to_numpy(dtype=np.float64)
+    return TermBatch(
+        terms=np.asarray(terms),
+        offsets=offsets,
+        cum_time_elapsed=logit_inputs["cum_time_elapsed"].to_numpy(dtype=np.float64)[order],
+        successes=logit_inputs["successes"].to_numpy(dtype=np.float64)[order],
+        failures=logit_inputs["failures"].to_numpy(dtype=np.float64)[order],
+        init_intercept=init_intercept,
+        init_time=init_time
+    )
+
+
+def fit_logit_irls(
+    batch: TermBatch,
+    max_iter: int = 100,
+    tol: float = 1e-10
+) -> pd.DataFrame:
+    """Fits `logit(p) = coef_intercept + coef_time * t` to every term in `batch` simultaneously.
+
+    Each iteration solves the weighted least squares problem of every term in closed form (the
+    design matrix only has two columns) so no per-term Python code is executed. Standard errors
+    and p-values follow the same (Wald) definitions as `statsmodels` with a binomial family.
+
+    Terms whose fit does not converge (or whose design is degenerate, e.g. a single day of data)
+    are returned with `NaN` statistics.
+
+    When `batch` carries starting values (i.e. a 'warm start'), IRLS is initialised from them;
+    terms with `NaN` starting values fall back to the default initialisation.
+
+    :param batch: group-sorted inputs (cf. `group_terms()`)
+    :param max_iter: maximum number of IRLS iterations, defaults to 100
+    :param tol: convergence tolerance on the (relative) change in coefficients, defaults to 1e-10
+    :return: a `pd.DataFrame` with fields `coef_intercept`, `coef_time`, `rse_time`, `p_value_time`
+             and `converged` (one row per term, in the order of `batch.terms`)
+    """
+    starts = batch.offsets[:-1]
+    n_terms = len(batch.terms)
+    group = np.repeat(np.arange(n_terms), np.diff(batch.offsets))
+    t = batch.cum_time_elapsed
+    trials = batch.successes + batch.failures
+
+    def segment_sum(values: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(values, starts) if n_terms else np.zeros(0)
+
+    # NB: default starting values mirror `statsmodels` i.e. mu = (successes + 0.5) / (trials + 1)
+    mu = (batch.successes + 0.5) / (trials + 1)
+    eta = np.log(mu / (1 - mu))
+    coef_intercept = np.full(n_terms, np.nan)
+    coef_time = np.full(n_terms, np.nan)
+    if batch.init_intercept is not None and batch.init_time is not None:
+        warm = np.isfinite(batch.init_intercept) & np.isfinite(batch.init_time)
+        coef_intercept[warm] = batch.init_intercept[warm]
+        coef_time[warm] = batch.init_time[warm]
+        warm_rows = warm[group]
+        eta[warm_rows] = coef_intercept[group[warm_rows]] + coef_time[group[warm_rows]] * t[warm_rows]
+        mu[warm_rows] = 1 / (1 + np.exp(-eta[warm_rows]))
+
+    converged = np.zeros(n_terms, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(max_iter):
+            weights = trials * mu * (1 - mu)
+            working = eta + (batch.successes - trials * mu) / weights
+            s_w = segment_sum(weights)
+            s_wt = segment_sum(weights * t)
+            s_wtt = segment_sum(weights * t * t)
+            s_wz = segment_sum(weights * working)
+            s_wtz = segment_sum(weights * t * working)
+            det = s_w * s_wtt - s_wt ** 2
+            next_time = (s_w * s_wtz - s_wt * s_wz) / det
+            next_intercept = (s_wz - next_time * s_wt) / s_w
+            step = np.maximum(
+                np.abs(next_intercept - coef_intercept) / (1 + np.abs(next_intercept)),
+                np.abs(next_time - coef_time) / (1 + np.abs(next_time))
+            )
+            converged = step <= tol
+            coef_intercept, coef_time = next_intercept, next_time
+            if converged.all():
+                break
+            eta = coef_intercept[group] + coef_time[group] * t
+            mu = 1 / (1 + np.exp(-eta))
+
+        # NB: var(coef_time) is the bottom-right entry of the inverse Fisher information (X'WX)^-1
+        mu = 1 / (1 + np.exp(-(coef_intercept[group] + coef_time[group] * t)))
+        weights = trials * mu * (1 - mu)
+        s_w = segment_sum(weights)
+        s_wt = segment_sum(weights * t)
+        s_wtt = segment_sum(weights * t * t)
+        bse_time = np.sqrt(s_w / (s_w * s_wtt - s_wt ** 2))
+        rse_time = bse_time / np.abs(coef_time)
+        # NB: equivalent to `2 * scipy.stats.norm.sf(|z|)` without importing all of `scipy.stats`
+        from scipy import special
+        p_value_time = 2 * special.ndtr(-np.abs(coef_time / bse_time))
+
+    valid = converged & np.isfinite(coef_intercept) & np.isfinite(coef_time) & np.isfinite(bse_time)
+    for term in batch.terms[~valid]:
+        logger.warning(f"Erroneous fitting detected for term ID {term}; negating output.")
+    return pd.DataFrame(
+        {
+            "coef_intercept": np.where(valid, coef_intercept, np.nan),
+            "coef_time": np.where(valid, coef_time, np.nan),
+            "rse_time": np.where(valid, rse_time, np.nan),
+            "p_value_time": np.where(valid, p_value_time, np.nan),
+            "converged": valid
+        }
+    )
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,81 @@
+"""Multi-core execution of the trend fitting exercise.
+
+Terms are partitioned into contiguous chunks of (roughly) equal row counts and each chunk is
+shipped to a worker process as a `TermBatch` of flat NumPy arrays (which pickle far more compactly
+than a `pd.DataFrame`). Since chunks preserve term order, results are merged deterministically by
+simple concatenation.
+"""
+import numpy as np
+import pandas as pd
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+from src.model.irls import TermBatch
+from src.model.schema import get_validation_level, set_validation_level
+
+
+logger = logging.getLogger(__name__)
+
+# NB: over-partitioning (relative to the number of workers) smooths out uneven per-chunk fit times
+CHUNKS_PER_WORKER = 4
+
+
+def partition_batch(
+    batch: TermBatch,
+    n_chunks: int
+) -> list[TermBatch]:
+    """Partitions `batch` into at most `n_chunks` contiguous chunks that are balanced by row count.
+
+    :param batch: group-sorted inputs (cf. `group_terms()`)
+    :param n_chunks: desired number of chunks
+    :return: a list of `TermBatch` objects which, concatenated, reproduce `batch`
+    """
+    n_rows = batch.offsets[-1]
+    targets = np.linspace(0, n_rows, n_chunks + 1)[1:-1]
+    bounds = np.unique(np.concatenate([
+        [0],
+        np.searchsorted(batch.offsets, targets),
+        [len(batch.terms)]
+    ]))
+    chunks = []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        start, stop = batch.offsets[first], batch.offsets[last]
+        chunks.append(
+            TermBatch(
+                terms=batch.terms[first:last],
+                offsets=batch.offsets[first:last + 1] - start,
+                cum_time_elapsed=batch.cum_time_elapsed[start:stop],
+                successes=batch.successes[start:stop],
+                failures=batch.failures[start:stop],
+                init_intercept=None if batch.init_intercept is None else batch.init_intercept[first:last],
+                init_time=None if batch.init_time is None else batch.init_time[first:last]
+            )
+        )
+    return chunks
+
+
+def fit_batch_parallel(
+    batch: TermBatch,
+    fit_chunk: Callable[[TermBatch], pd.DataFrame],
+    n_workers: int
+) -> pd.DataFrame:
+    """Fits every chunk of `batch` in a pool of `n_workers` processes.
+
+    :param batch: group-sorted inputs (cf. `group_terms()`)
+    :param fit_chunk: a picklable (i.e. module-level) callable mapping a `TermBatch` to one row of
+                      fitting output per term
+    :param n_workers: number of worker processes
+    :return: the concatenated fitting output, in the order of `batch.terms`
+    """
+    chunks = partition_batch(batch, n_workers * CHUNKS_PER_WORKER)
+    if len(chunks) <= 1:
+        return fit_chunk(batch)
+    logger.info(f"Fitting {len(batch.terms)} terms in {len(chunks)} chunks across {n_workers} processes")
+    # NB: the validation level is scoped to the calling context, so it is handed down explicitly
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=set_validation_level, initargs=(get_validation_level(),)) as executor:
+        results = list(executor.map(fit_chunk, chunks))
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == '__main__':
+    pass
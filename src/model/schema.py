@@ -1,36 +1,225 @@
 """Contains the relevant schema definitions for performing data validation on modelling input.
+
+The amount of validation performed on the modelling 'hot path' is configurable per flow run (cf.
+`validation_scope()`) or else via the `MODEL_VALIDATION_LEVEL` environment variable:
+
+* `full`: every schema is validated by `pandera` (including the per-term `TERM_DF` check)
+* `batch`: only batch-level schemas are validated, in a single vectorized pass (cf. `validate_fast()`)
+* `sampled`: as per `batch` but only on a random sample of `SAMPLE_SIZE` rows
+* `off`: no validation
+
+NB: `pandera` is only imported (and the schemas built) on first use, so importing this module (and
+decorating functions with `check_input()` / `check_output()`) is cheap; schemas can be referred to by
+name (e.g. `check_input("LOGIT_INPUTS")`) to defer building them until the first call.
 """
-import pandera as pa
+import os
+import functools
+import contextlib
+import contextvars
+import pandas as pd
+from typing import TYPE_CHECKING
 
-CHECK_NON_NEGATIVE = pa.Check.greater_than_or_equal_to(0)
+if TYPE_CHECKING:
+    import pandera as pa
 
-# Model - Inputs
+VALIDATION_LEVELS = ("full", "batch", "sampled", "off")
+SAMPLE_SIZE = 10_000
+VALIDATION_LEVEL: contextvars.ContextVar[str | None] = contextvars.ContextVar("VALIDATION_LEVEL", default=None)
+SCHEMA_NAMES = ("TERM_DF", "LOGIT_INPUTS", "LOGIT_OUTPUTS")
 
-TERM_DF = pa.DataFrameSchema(
-    {
-        "successes": pa.Column(int, CHECK_NON_NEGATIVE),
-        "failures": pa.Column(int, CHECK_NON_NEGATIVE),
-        "cum_time_elapsed": pa.Column(int, CHECK_NON_NEGATIVE)
-    }
-)
-
-LOGIT_INPUTS = pa.DataFrameSchema(
-    {
-        "headline_term": pa.Column(str),
-        "successes": pa.Column(int, CHECK_NON_NEGATIVE),
-        "failures": pa.Column(int, CHECK_NON_NEGATIVE),
-        "cum_time_elapsed": pa.Column(int, CHECK_NON_NEGATIVE)
-    }
-)
 
-# Model - Outputs
+@functools.cache
+def build_schemas() -> dict:
+    """Builds the schemas of this module (and the checks they share) by name.
+    """
+    import pandera as pa
+
+    CHECK_NON_NEGATIVE = pa.Check.greater_than_or_equal_to(0)
+
+    # Model - Inputs
+
+    TERM_DF = pa.DataFrameSchema(
+        {
+            "successes": pa.Column(int, CHECK_NON_NEGATIVE),
+            "failures": pa.Column(int, CHECK_NON_NEGATIVE),
+            "cum_time_elapsed": pa.Column(int, CHECK_NON_NEGATIVE)
+        }
+    )
+
+    LOGIT_INPUTS = pa.DataFrameSchema(
+        {
+            "term_id": pa.Column("int32"),
+            "successes": pa.Column(int, CHECK_NON_NEGATIVE),
+            "failures": pa.Column(int, CHECK_NON_NEGATIVE),
+            "cum_time_elapsed": pa.Column(int, CHECK_NON_NEGATIVE)
+        }
+    )
+
+    # Model - Outputs
 
-LOGIT_OUTPUTS = pa.DataFrameSchema(
-    {   
-        "headline_term": pa.Column(str, unique=True),
-        "coef_intercept": pa.Column(float),
-        "coef_time": pa.Column(float),
-        "rse_time": pa.Column(float),
-        "p_value_time": pa.Column(float)
+    LOGIT_OUTPUTS = pa.DataFrameSchema(
+        {
+            "term_id": pa.Column("int32", unique=True),
+            "coef_intercept": pa.Column(float),
+            "coef_time": pa.Column(float),
+            "rse_time": pa.Column(float),
+            "p_value_time": pa.Column(float)
+        }
+    )
+
+    return {
+        "CHECK_NON_NEGATIVE": CHECK_NON_NEGATIVE,
+        "TERM_DF": TERM_DF,
+        "LOGIT_INPUTS": LOGIT_INPUTS,
+        "LOGIT_OUTPUTS": LOGIT_OUTPUTS
     }
-)
\ No newline at end of file
+
+
+def get_schema(schema):
+    """Resolves `schema` (either a schema or the name of one of the schemas of this module).
+    """
+    return build_schemas()[schema] if isinstance(schema, str) else schema
+
+
+def __getattr__(name: str):
+    if name in SCHEMA_NAMES or name == "CHECK_NON_NEGATIVE":
+        return build_schemas()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Validation
+
+
+def get_validation_level() -> str:
+    """Returns the validation level of the current context, else that of the `MODEL_VALIDATION_LEVEL`
+    environment variable (defaults to "full").
+    """
+    level = VALIDATION_LEVEL.get() or os.getenv("MODEL_VALIDATION_LEVEL", "full")
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"Unknown validation level '{level}' (expected one of {VALIDATION_LEVELS})")
+    return level
+
+
+def set_validation_level(level: str) -> contextvars.Token:
+    """Sets the validation level for the current context only (i.e. not for later flow runs in the same
+    process); pass the returned token to `reset_validation_level()` to restore the previous level.
+
+    NB: worker processes (cf. `src.model.parallel`) are initialised with the level of their parent
+    """
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"Unknown validation level '{level}' (expected one of {VALIDATION_LEVELS})")
+    return VALIDATION_LEVEL.set(level)
+
+
+def reset_validation_level(token: contextvars.Token) -> None:
+    VALIDATION_LEVEL.reset(token)
+
+
+@contextlib.contextmanager
+def validation_scope(level: str):
+    """Applies validation level `level` within the enclosed block.
+    """
+    token = set_validation_level(level)
+    try:
+        yield
+    finally:
+        reset_validation_level(token)
+
+
+def validate_fast(
+    df: pd.DataFrame,
+    schema: "pa.DataFrameSchema | str"
+) -> pd.DataFrame:
+    """Validates `df` against `schema` with (at most) one vectorized pass per type of check rather
+    than one `pandera` check per column.
+
+    Covers the features used by the schemas in this module: column presence, data types, nullability,
+    uniqueness and non-negativity (any other check falls back to `pandera`).
+
+    :param df: `pd.DataFrame` object to validate
+    :param schema: schema (or name of the schema) to validate against
+    :return: `df` (unmodified) if valid
+    :raises pa.errors.SchemaError: if `df` does not conform to `schema`
+    """
+    import pandera as pa
+    from pandera.engines import pandas_engine
+    schema = get_schema(schema)
+    CHECK_NON_NEGATIVE = build_schemas()["CHECK_NON_NEGATIVE"]
+    missing = [name for name in schema.columns if name not in df.columns]
+    if missing:
+        raise pa.errors.SchemaError(schema, df, f"columns {missing} not in dataframe")
+    for name, column in schema.columns.items():
+        series = df[name]
+        if column.dtype is not None and not column.dtype.check(pandas_engine.Engine.dtype(series.dtype)):
+            raise pa.errors.SchemaError(schema, df, f"expected series '{name}' to have type {column.dtype}")
+        if str(column.dtype) == "str" and pd.api.types.infer_dtype(series, skipna=True) not in ("string", "empty"):
+            raise pa.errors.SchemaError(schema, df, f"expected series '{name}' to have type str")
+
+    not_nullable = [name for name, column in schema.columns.items() if not column.nullable]
+    null_columns = df[not_nullable].columns[df[not_nullable].isna().to_numpy().any(axis=0)]
+    if len(null_columns):
+        raise pa.errors.SchemaError(schema, df, f"non-nullable series {list(null_columns)} contain null values")
+
+    non_negative = [name for name, column in schema.columns.items() if CHECK_NON_NEGATIVE in column.checks]
+    negative_columns = df[non_negative].columns[(df[non_negative].to_numpy() < 0).any(axis=0)]
+    if len(negative_columns):
+        raise pa.errors.SchemaError(schema, df, f"series {list(negative_columns)} contain negative values")
+
+    for name, column in schema.columns.items():
+        if column.unique and df[name].duplicated().any():
+            raise pa.errors.SchemaError(schema, df, f"series '{name}' contains duplicate values")
+        for check in column.checks:
+            if check != CHECK_NON_NEGATIVE and not check(df[name]).check_passed:
+                raise pa.errors.SchemaError(schema, df, f"series '{name}' failed check '{check}'")
+    return df
+
+
+def validate(
+    df: pd.DataFrame,
+    schema: "pa.DataFrameSchema | str",
+    scope: str = "batch"
+) -> pd.DataFrame:
+    """Validates `df` against `schema` in accordance with the configured validation level.
+
+    :param df: `pd.DataFrame` object to validate
+    :param schema: schema (or name of the schema) to validate against
+    :param scope: either "term" (i.e. validated once per term) or "batch", defaults to "batch"
+    :return: `df` (unmodified) if valid
+    """
+    level = get_validation_level()
+    if level == "full":
+        return get_schema(schema).validate(df)
+    if level == "off" or scope == "term":
+        return df
+    if level == "sampled" and len(df) > SAMPLE_SIZE:
+        validate_fast(df.sample(n=SAMPLE_SIZE), schema)
+        return df
+    return validate_fast(df, schema)
+
+
+def check_input(
+    schema: "pa.DataFrameSchema | str",
+    scope: str = "batch"
+):
+    """Decorator which validates the first argument of a function (cf. `validate()`).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(df, *args, **kwargs):
+            return fn(validate(df, schema, scope), *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def check_output(
+    schema: "pa.DataFrameSchema | str",
+    scope: str = "batch"
+):
+    """Decorator which validates the output of a function (cf. `validate()`).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return validate(fn(*args, **kwargs), schema, scope)
+        return wrapper
+    return decorator
@@ -0,0 +1,2 @@
+"""Instrumentation of the Prefect flows (e.g. per-stage timing, throughput and memory metrics).
+"""
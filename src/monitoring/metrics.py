@@ -0,0 +1,322 @@
+"""Lightweight, per-stage metrics of the Prefect flows.
+
+A flow run collects its metrics in a `FlowMetrics` object (cf. `track_flow()`), whilst each task
+declares the 'stage' it belongs to (cf. `instrument()` and `stage_timer()`) and the volume of data it
+processed (cf. `observe()`). The following are recorded per stage:
+
+* wall time (in seconds) and the number of calls
+* rows and bytes processed
+* peak resident set size (RSS) of the process at the end of the stage
+
+Alongside ad hoc counters (cf. `count()`) e.g. the number of failed (or negated) term fits. Once the
+run has finished, its metrics are exported as a Prometheus textfile (i.e. for the `node_exporter`
+textfile collector) and attached to the run as a Prefect table artifact, so that they can be trended
+across runs.
+
+Outside of a tracked flow run (e.g. in unit tests or when a task's `.fn` is called directly), every
+function in this module is a no-op.
+"""
+import os
+import sys
+import time
+import inspect
+import datetime
+import threading
+import functools
+import contextlib
+import contextvars
+import logging
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Sized
+
+try:
+    import resource
+except ImportError:
+    # NB: `resource` is unavailable on Windows, in which case peak RSS is not recorded
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "headline_pipeline"
+ACTIVE_METRICS: contextvars.ContextVar["FlowMetrics | None"] = contextvars.ContextVar("ACTIVE_METRICS", default=None)
+
+
+def peak_rss_bytes() -> int:
+    """Returns the peak resident set size of the current process (i.e. its high-water mark).
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NB: `ru_maxrss` is reported in bytes on macOS but in kibibytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class FlowMetrics:
+    """Metrics of a single flow run.
+
+    :param flow: name of the flow e.g. "main_nytas"
+    """
+
+    def __init__(
+        self,
+        flow: str
+    ):
+        self.flow = flow
+        self.stages: dict[str, dict] = {}
+        self.counters: dict[str, float] = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.seconds = 0.0
+
+    @property
+    def open_stages(self) -> list[dict]:
+        """Stages currently open in the calling thread (innermost last).
+
+        NB: stages may be timed concurrently from several threads (cf. `src.data_loader.pipeline`), so
+        each thread attributes its observations to its own innermost stage
+        """
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        return self.local.stages
+
+    @contextlib.contextmanager
+    def stage(
+        self,
+        name: str
+    ) -> Iterator[dict]:
+        """Times the enclosed block as (another call of) stage `name`.
+        """
+        with self.lock:
+            stats = self.stages.setdefault(
+                name,
+                {"seconds": 0.0, "calls": 0, "rows": 0, "bytes": 0, "peak_rss_bytes": 0}
+            )
+        self.open_stages.append(stats)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            self.open_stages.pop()
+            with self.lock:
+                stats["seconds"] += time.perf_counter() - start
+                stats["calls"] += 1
+                stats["peak_rss_bytes"] = max(stats["peak_rss_bytes"], peak_rss_bytes())
+
+    def observe(
+        self,
+        rows: int = 0,
+        nbytes: int = 0
+    ) -> None:
+        """Adds `rows` and `nbytes` to the innermost open stage (if any).
+        """
+        open_stages = self.open_stages
+        if open_stages:
+            with self.lock:
+                open_stages[-1]["rows"] += int(rows)
+                open_stages[-1]["bytes"] += int(nbytes)
+
+    def count(
+        self,
+        name: str,
+        value: float = 1
+    ) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def table(self) -> list[dict]:
+        """Tabulates the metrics of each stage (one row per stage, in order of first call).
+        """
+        return [{"stage": name, **stats} for name, stats in self.stages.items()]
+
+    def write_textfile(
+        self,
+        directory: str | Path
+    ) -> Path:
+        """Writes the metrics to `<directory>/<flow>.prom` in the Prometheus text format (atomically, so
+        that the textfile collector never reads a partial file).
+        """
+        # NB: only required once a run has finished, so it is not imported by every instrumented module
+        from prometheus_client import CollectorRegistry, Gauge, write_to_textfile
+        registry = CollectorRegistry()
+        labels = ["flow", "stage"]
+        gauges = {
+            "seconds": Gauge(f"{METRIC_PREFIX}_stage_duration_seconds", "Wall time of each stage", labels, registry=registry),
+            "calls": Gauge(f"{METRIC_PREFIX}_stage_calls", "Number of calls of each stage", labels, registry=registry),
+            "rows": Gauge(f"{METRIC_PREFIX}_stage_rows", "Rows processed by each stage", labels, registry=registry),
+            "bytes": Gauge(f"{METRIC_PREFIX}_stage_bytes", "Bytes processed by each stage", labels, registry=registry),
+            "peak_rss_bytes": Gauge(f"{METRIC_PREFIX}_stage_peak_rss_bytes", "Peak RSS of the process at the end of each stage", labels, registry=registry)
+        }
+        for name, stats in self.stages.items():
+            for key, gauge in gauges.items():
+                gauge.labels(self.flow, name).set(stats[key])
+        events = Gauge(f"{METRIC_PREFIX}_events", "Ad hoc counts e.g. failed term fits", ["flow", "event"], registry=registry)
+        for name, value in self.counters.items():
+            events.labels(self.flow, name).set(value)
+        Gauge(f"{METRIC_PREFIX}_flow_duration_seconds", "Wall time of the flow run", ["flow"], registry=registry).labels(self.flow).set(self.seconds)
+        Gauge(f"{METRIC_PREFIX}_last_run_timestamp_seconds", "Start time of the last flow run", ["flow"], registry=registry).labels(self.flow).set(self.started_at)
+
+        path = Path(directory) / f"{self.flow}.prom"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_to_textfile(str(path), registry)
+        return path
+
+    def publish_artifact(self) -> None:
+        """Attaches the metrics to the current Prefect flow run as a table artifact.
+        """
+        from prefect.artifacts import create_table_artifact
+        from prefect.context import FlowRunContext
+        if FlowRunContext.get() is None:
+            return
+        rows = self.table() + [{"stage": f"event:{name}", "rows": value} for name, value in self.counters.items()]
+        create_table_artifact(
+            key=f"{self.flow.replace('_', '-')}-metrics",
+            table=rows,
+            description=f"Per-stage metrics of `{self.flow}` (started {datetime.datetime.fromtimestamp(self.started_at):%Y-%m-%d %H:%M:%S}, {self.seconds:.1f}s)"
+        )
+
+
+@contextlib.contextmanager
+def stage_timer(
+    name: str
+) -> Iterator[None]:
+    """Times the enclosed block as stage `name` of the current flow run (if tracked).
+    """
+    metrics = ACTIVE_METRICS.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+def instrument(
+    stage: str | None = None
+) -> Callable:
+    """Decorator which times every call of a task as stage `stage` (defaults to the name of the function).
+
+    NB: apply beneath `@task` so that calls of the task's `.fn` are timed too.
+    """
+    def decorator(fn):
+        name = stage or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            metrics = ACTIVE_METRICS.get()
+            if metrics is None:
+                return fn(*args, **kwargs)
+            with metrics.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(
+    rows: int = 0,
+    nbytes: int = 0
+) -> None:
+    """Records `rows` and `nbytes` processed by the current stage (if tracked).
+    """
+    metrics = ACTIVE_METRICS.get()
+    if metrics is not None:
+        metrics.observe(rows, nbytes)
+
+
+def observe_records(
+    records: Iterable
+) -> Iterable:
+    """Passes `records` through, recording their number against the stage which consumes them.
+
+    NB: sized collections (e.g. an `ArchiveBatch`) are returned as is, so consumers can still
+    recognise (and e.g. write column-wise) them
+    """
+    if isinstance(records, Sized):
+        observe(rows=len(records))
+        return records
+    return observed_records(records)
+
+
+def observed_records(
+    records: Iterable
+) -> Iterator:
+    n_records = 0
+    for n_records, record in enumerate(records, start=1):
+        yield record
+    observe(rows=n_records)
+
+
+def count(
+    name: str,
+    value: float = 1
+) -> None:
+    """Increments counter `name` of the current flow run (if tracked).
+    """
+    metrics = ACTIVE_METRICS.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def file_size(
+    path: str | Path | None
+) -> int:
+    """Size of the file at `path` in bytes (or 0 if it does not exist).
+    """
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def track_flow(fn: Callable) -> Callable:
+    """Decorator which tracks the metrics of every run of a flow and exports them once it finishes.
+
+    Apply beneath `@flow`. The textfile is written to the flow's `metrics_dir` parameter (if it has
+    one) or else to the `METRICS_TEXTFILE_DIR` environment variable (if set).
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        metrics_dir = arguments.arguments.get("metrics_dir") or os.getenv("METRICS_TEXTFILE_DIR")
+        metrics = FlowMetrics(fn.__name__)
+        token = ACTIVE_METRICS.set(metrics)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.seconds = time.perf_counter() - start
+            ACTIVE_METRICS.reset(token)
+            export_metrics(metrics, metrics_dir)
+    return wrapper
+
+
+def export_metrics(
+    metrics: FlowMetrics,
+    metrics_dir: str | Path | None = None
+) -> None:
+    """Exports `metrics` as a Prometheus textfile (if `metrics_dir` is given) and a Prefect artifact.
+
+    NB: export failures are logged rather than raised, so they never fail the flow run itself
+    """
+    for stats in metrics.table():
+        logger.info(
+            f"Stage '{stats['stage']}': {stats['seconds']:.2f}s over {stats['calls']} call(s), "
+            f"{stats['rows']} rows, {stats['bytes']} bytes, peak RSS {stats['peak_rss_bytes'] / 2 ** 20:.0f}MiB"
+        )
+    if metrics_dir:
+        try:
+            path = metrics.write_textfile(metrics_dir)
+            logger.info(f"Wrote metrics of '{metrics.flow}' to '{path}'")
+        except OSError as err:
+            logger.warning(f"Unable to write metrics of '{metrics.flow}' to '{metrics_dir}': '{err}'")
+    try:
+        metrics.publish_artifact()
+    except Exception as err:
+        logger.warning(f"Unable to publish metrics of '{metrics.flow}' as a Prefect artifact: '{err}'")
+
+
+if __name__ == "__main__":
+    pass
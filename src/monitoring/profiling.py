@@ -0,0 +1,234 @@
+"""Opt-in profiling of the hot paths of the fitter and the loader.
+
+Functions decorated with `profiled()` (e.g. `compute_batch_trend`, `nytas_filter_archive`, `ingest`
+and `read_sql`) are profiled whilst a profiling session is open (cf. `profile_run()` and
+`profile_flow()`). The mode is taken from the `profiling` flow parameter or else from the
+`PROFILING_MODE` environment variable:
+
+* `off`: no profiling (the default)
+* `cpu`: every call is profiled with `cProfile`
+* `memory`: allocations of every call are traced with `tracemalloc` (cf. below)
+* `full`: both of the above
+
+Each call writes its reports to `<PROFILE_DIR>/<run>/` (where `PROFILE_DIR` defaults to
+`staging/profiles`) as:
+
+* `<seq>_<name>.prof`: a `pstats` dump (e.g. for `snakeviz` or `python -m pstats`)
+* `<seq>_<name>.txt`: the top `TOP_N` functions by cumulative time
+* `<seq>_<name>_alloc.txt`: the peak traced memory and the top `TOP_N` allocation sites
+
+The session is held in a context variable, so it only applies to the flow run which opened it (and to
+the threads which run in a copy of its context, cf. `run_pipeline()`) rather than to every flow
+running in the same process. When no session is open, the only overhead of a decorated function is a
+lookup of that context variable.
+Nested calls (e.g. `read_sql` within a profiled task) are attributed to the outermost profiled call,
+and work done in other processes (e.g. `n_workers > 1` when fitting) is not captured.
+
+NB: `tracemalloc` traces every thread of the process, so the allocations of a call are only traced if
+no other profiled call is active when it starts; calls which overlap it (e.g. the stages of
+`run_pipeline()`) write no `_alloc.txt` report, and their allocations are attributed to the traced call.
+"""
+import os
+import time
+import threading
+import functools
+import contextlib
+import inspect
+import logging
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+PROFILING_MODES = ("off", "cpu", "memory", "full")
+TOP_N = 25
+SESSION: ContextVar["ProfileSession | None"] = ContextVar("profiling_session", default=None)
+
+
+def get_profiling_mode() -> str:
+    """Returns the configured profiling mode (defaults to "off").
+    """
+    mode = os.getenv("PROFILING_MODE", "off")
+    if mode not in PROFILING_MODES:
+        raise ValueError(f"Unknown profiling mode '{mode}' (expected one of {PROFILING_MODES})")
+    return mode
+
+
+class ProfileSession:
+    """Writes the profiles of every profiled call made during a run to `directory`.
+
+    :param directory: directory in which to write the reports (created if it does not exist)
+    :param mode: one of "cpu", "memory" or "full" (cf. `PROFILING_MODES`)
+    :param top_n: number of functions (and allocation sites) to include in each report, defaults to `TOP_N`
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        mode: str,
+        top_n: int = TOP_N
+    ):
+        if mode not in PROFILING_MODES[1:]:
+            raise ValueError(f"Unknown profiling mode '{mode}' (expected one of {PROFILING_MODES[1:]})")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cpu = mode in ("cpu", "full")
+        self.memory = mode in ("memory", "full")
+        self.top_n = top_n
+        self.seq = 0
+        self.active_calls = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def call(
+        self,
+        name: str,
+        fn: Callable,
+        args: tuple,
+        kwargs: dict
+    ):
+        """Calls `fn(*args, **kwargs)` under the profilers and writes its reports.
+
+        Memory is only traced if no other profiled call is active (cf. `active_calls`), since `tracemalloc`
+        is process-wide and one call would otherwise stop (or report) the tracing of another.
+        """
+        # NB: only one profiler can be active per thread, so nested calls are profiled by the outermost
+        if getattr(self.local, "active", False):
+            return fn(*args, **kwargs)
+        import cProfile
+        import tracemalloc
+        with self.lock:
+            self.seq += 1
+            prefix = self.directory / f"{self.seq:03d}_{name}"
+            trace = self.memory and self.active_calls == 0 and not tracemalloc.is_tracing()
+            self.active_calls += 1
+            # NB: started under the lock, so that no concurrent call can start tracing in the meantime
+            if trace:
+                tracemalloc.start()
+        if self.memory and not trace:
+            logger.warning(f"Not tracing memory of '{name}' since another profiled call is active")
+        profiler = cProfile.Profile() if self.cpu else None
+        self.local.active = True
+        start = time.perf_counter()
+        try:
+            if profiler:
+                return profiler.runcall(fn, *args, **kwargs)
+            return fn(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            self.local.active = False
+            # NB: snapshot before writing any report, so that its allocations are not traced
+            if trace:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            with self.lock:
+                self.active_calls -= 1
+            if profiler:
+                self.write_cpu_report(profiler, prefix, seconds)
+            if trace:
+                self.write_memory_report(snapshot, peak, prefix)
+            logger.info(f"Profiled '{name}' ({seconds:.2f}s) @ '{prefix}'")
+
+    def write_cpu_report(
+        self,
+        profiler,
+        prefix: Path,
+        seconds: float
+    ) -> None:
+        import io
+        import pstats
+        profiler.dump_stats(prefix.with_suffix(".prof"))
+        report = io.StringIO()
+        report.write(f"Wall time: {seconds:.3f}s\n\n")
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(self.top_n)
+        prefix.with_suffix(".txt").write_text(report.getvalue())
+
+    def write_memory_report(
+        self,
+        snapshot,
+        peak: int,
+        prefix: Path
+    ) -> None:
+        import tracemalloc
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")
+        ])
+        lines = [f"Peak traced memory: {peak / 2 ** 20:.1f}MiB", "", f"Top {self.top_n} allocation sites (still allocated on return):"]
+        for stat in snapshot.statistics("lineno")[:self.top_n]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 2 ** 10:>12.1f}KiB {stat.count:>9} blocks  {frame.filename}:{frame.lineno}")
+        Path(f"{prefix}_alloc.txt").write_text("\n".join(lines) + "\n")
+
+
+def profiled(
+    name: str | None = None
+) -> Callable:
+    """Decorator which profiles every call of a function whilst a profiling session is open.
+
+    :param name: name of the reports, defaults to the name of the function
+    """
+    def decorator(fn):
+        report_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            session = SESSION.get()
+            if session is None:
+                return fn(*args, **kwargs)
+            return session.call(report_name, fn, args, kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def profile_run(
+    run_name: str,
+    mode: str | None = None,
+    profile_dir: str | Path | None = None
+) -> Iterator["ProfileSession | None"]:
+    """Opens a profiling session for the enclosed block (unless the mode is "off").
+
+    :param run_name: name of the run (the reports are written to `<profile_dir>/<run_name>`)
+    :param mode: profiling mode, defaults to `get_profiling_mode()`
+    :param profile_dir: root directory of the reports, defaults to the `PROFILE_DIR` environment
+                        variable (or else "staging/profiles")
+    :return: the open session (or None if profiling is off)
+    """
+    mode = mode or get_profiling_mode()
+    if mode == "off" or SESSION.get() is not None:
+        yield SESSION.get()
+        return
+    directory = Path(profile_dir or os.getenv("PROFILE_DIR", "staging/profiles")) / run_name
+    session = ProfileSession(directory, mode)
+    token = SESSION.set(session)
+    logger.info(f"Profiling ('{mode}') hot paths of '{run_name}' @ '{directory}'")
+    try:
+        yield session
+    finally:
+        SESSION.reset(token)
+
+
+def profile_flow(fn: Callable) -> Callable:
+    """Decorator which profiles the hot paths of every run of a flow (cf. `profile_run()`).
+
+    Apply beneath `@flow`. The mode is taken from the flow's `profiling` parameter (if it has one and
+    it is set) or else from the `PROFILING_MODE` environment variable.
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        mode = arguments.arguments.get("profiling")
+        run_name = f"{fn.__name__}_{time.strftime('%Y%m%dT%H%M%S')}"
+        with profile_run(run_name, mode=mode):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+if __name__ == "__main__":
+    pass
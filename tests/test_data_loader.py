@@ -1,6 +1,28 @@
+import io
+import csv
 import pytest
+import json
+import time
+import threading
+import random
+import datetime as dt
+import requests
+import psycopg2
+import pandas as pd
 from datetime import datetime
-from src.data_loader.transform import nytas_transform_date, nytas_transform_author
+import re
+import hashlib
+from src.data_loader.transform import nytas_transform_date, nytas_transform_author, nytas_tokenize_headline, nytas_count_terms
+from src.data_loader import extract
+from src.data_loader.extract import nytas_iter_docs, nytas_stream_archive, nytas_filter_docs
+from src.data_loader import backfill
+from src.data_loader.pipeline import PipelineStage, run_pipeline
+from src.data_loader.cache import ArchiveCache, iter_cached_chunks
+from src.data_loader.extract import stage
+from src.data_loader.load import ingest_records, split_csv
+from src.data_loader.extract import nytas_filter_archive, nytas_filter_article
+from src.db.utils import encode_column
+from benchmarks.synthetic import synthetic_archive
 
 
 def test_nytas_transform_date():
@@ -31,3 +53,330 @@ def test_nytas_transform_author():
     raw_author = "By Johnny By Breen"
     expected_author = "Johnny By Breen"
     assert nytas_transform_author(raw_author) == expected_author
+
+
+def test_nytas_iter_docs():
+
+    archive = {
+        "copyright": "Copyright (c) 2024 The New York Times Company. All Rights Reserved.",
+        "response": {
+            "docs": [
+                {"headline": {"main": "Café “docs”: [1, 2]"}, "web_url": "https://www.nytimes.com/a"},
+                {"headline": {"main": "Second {headline}"}, "web_url": "https://www.nytimes.com/b"}
+            ],
+            "meta": {"hits": 2}
+        }
+    }
+    raw = json.dumps(archive, ensure_ascii=False, indent=2).encode("utf-8")
+
+    # Test case 1: byte-at-a-time chunks (which split multi-byte characters)
+    chunks = [raw[i:i + 1] for i in range(len(raw))]
+    assert list(nytas_iter_docs(chunks)) == archive["response"]["docs"]
+
+    # Test case 2: a single chunk
+    assert list(nytas_iter_docs([raw])) == archive["response"]["docs"]
+
+    # Test case 3: truncated response (should raise ValueError)
+    with pytest.raises(ValueError):
+        list(nytas_iter_docs([raw[:len(raw) // 2]]))
+
+
+
+def test_nytas_stream_archive_fails_loudly(monkeypatch):
+
+    raw = json.dumps({"response": {"docs": [{"headline": {"main": "A"}, "web_url": "https://www.nytimes.com/a"}] * 3}}).encode("utf-8")
+
+    def dropped_connection(chunk_size):
+        yield raw[:len(raw) // 2]
+        raise requests.exceptions.ChunkedEncodingError("Connection broken: IncompleteRead")
+
+    def fake_get(url, params=None, headers=None, stream=False):
+        res = make_response(200)
+        res.iter_content = dropped_connection
+        return res
+
+    monkeypatch.setattr(extract.requests, "get", fake_get)
+
+    # NB: neither a dropped connection nor a malformed article may pass for a (truncated) complete month
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        list(nytas_stream_archive("dummy", 2024, 1))
+    with pytest.raises(KeyError):
+        list(nytas_filter_docs([{"headline": {"main": "A"}}]))
+
+def test_nytas_backfill(monkeypatch):
+
+    def fake_download(session, limiter, api_key, year, month, cache=None):
+        if (year, month) == (2024, 1):
+            raise backfill.requests.HTTPError("429 Client Error: Too Many Requests")
+        return {"response": {"docs": [], "meta": {"year": year, "month": month}}}
+
+    def process(year, month, nyt_archive):
+        if (year, month) == (2023, 12):
+            raise psycopg2.DatabaseError("COPY failed")
+        processed.append((year, month))
+
+    monkeypatch.setattr(backfill, "nytas_download_archive", fake_download)
+    processed = []
+    failed = backfill.nytas_backfill(
+        api_key="dummy",
+        months=backfill.nytas_months(2023, 11, 2024, 2),
+        process=process,
+        max_workers=2,
+        requests_per_minute=6000,
+        skip_on=(psycopg2.DatabaseError,)
+    )
+
+    # NB: a failed load is recorded alongside the failed downloads
+    assert sorted(failed) == [(2023, 12), (2024, 1)]
+    assert sorted(processed) == [(2023, 11), (2024, 2)]
+
+
+def make_response(status_code, content=b"", headers=None):
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = content
+    res._content_consumed = True
+    res.headers.update(headers or {})
+    return res
+
+
+def test_archive_cache(tmp_path):
+
+    cache = ArchiveCache(tmp_path, max_bytes=10_000)
+    today = dt.date.today()
+    requested_headers = []
+
+    def request(status_code, content=b""):
+        def fn(headers):
+            requested_headers.append(headers)
+            return make_response(status_code, content, {"ETag": '"v1"'})
+        return fn
+
+    # Test case 1: open months are revalidated with their ETag (and served from cache if unmodified)
+    path = cache.fetch(request(200, b'{"response": {"docs": []}}'), "v1", today.year, today.month)
+    assert cache.fetch(request(304), "v1", today.year, today.month) == path
+    assert requested_headers == [{}, {"If-None-Match": '"v1"'}]
+    assert b"".join(iter_cached_chunks(path)) == b'{"response": {"docs": []}}'
+
+    # Test case 2: closed months are never requested twice
+    cache.fetch(request(200, b'{"response": {"docs": [1]}}'), "v1", 2020, 1)
+    cache.fetch(request(500), "v1", 2020, 1)
+    assert len(requested_headers) == 3
+
+    # Test case 3: least recently used entries are evicted beyond `max_bytes`
+    cache.fetch(request(200, random.Random(0).randbytes(20_000)), "v1", 2020, 2)
+    assert "v1/2020/2" in cache.index and f"v1/{today.year}/{today.month}" not in cache.index
+
+    # Test case 4: a truncated object is evicted rather than served again
+    path = cache.object_path(cache.index["v1/2020/2"]["digest"])
+    path.write_bytes(path.read_bytes()[:100])
+    with pytest.raises(backfill.CORRUPT_ARCHIVE_ERRORS):
+        backfill.nytas_download_archive(None, None, "dummy", 2020, 2, cache=cache)
+    assert "v1/2020/2" not in cache.index and not path.exists()
+    assert "v1/2020/2" not in json.loads(cache.index_path.read_text())
+
+    # Test case 5: a download which fails part way through leaves no partial object behind
+    def dropped_chunks(chunk_size):
+        yield b'{"response": '
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    res = make_response(200)
+    res.iter_content = dropped_chunks
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        cache.fetch(lambda headers: res, "v1", 2020, 3)
+    assert "v1/2020/3" not in cache.index and not list(cache.objects.glob("*.tmp"))
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def copy_expert(self, statement, fp):
+        # NB: mimics `psycopg2`, which reads the source in fixed-size blocks
+        while block := fp.read(8192):
+            self.conn.copied.append(block)
+
+
+class FailingCursor(FakeCursor):
+
+    def copy_expert(self, statement, fp):
+        fp.read(8192)
+        raise psycopg2.DatabaseError("COPY failed")
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.copied = []
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def test_ingest_records(tmp_path):
+
+    field_names = ["headline", "url"]
+    records = [{"headline": f"Headline | {i}\nwith \"quotes\"", "url": f"https://nyt.com/{i}"} for i in range(5_000)]
+    stage(records, field_names, tmp_path / "staged.csv")
+
+    conn = FakeConnection()
+    n_records = ingest_records(conn, "raw", "nytas", field_names, iter(records), tee_path=tmp_path / "tee.csv")
+
+    assert n_records == len(records)
+    assert conn.committed
+    # NB: streamed records must be byte-for-byte identical to those staged on disk
+    expected = open(tmp_path / "staged.csv", newline="").read()
+    assert "".join(conn.copied) == expected
+    assert open(tmp_path / "tee.csv", newline="").read() == expected
+
+    # NB: a failed `COPY` is rolled back (so that the connection can be reused) and raised
+    conn = FakeConnection()
+    conn.cursor = lambda: FailingCursor(conn)
+    with pytest.raises(psycopg2.DatabaseError):
+        ingest_records(conn, "raw", "nytas", field_names, iter(records))
+    assert conn.rolled_back and not conn.committed
+
+
+def test_split_csv(tmp_path):
+
+    field_names = ["headline", "url"]
+    # NB: quoted fields containing newlines must never be split across chunks
+    records = [{"headline": f"Headline\n| \"{i}\"" * (i % 3), "url": f"https://nyt.com/{i}"} for i in range(1_000)]
+    stage(records, field_names, tmp_path / "staged.csv")
+    data = (tmp_path / "staged.csv").read_bytes()
+
+    chunks = split_csv(tmp_path / "staged.csv", n_chunks=7, block_size=1_000)
+    assert len(chunks) == 7
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+    assert all(end == start for (_, end), (start, _) in zip(chunks[:-1], chunks[1:]))
+
+    rows = []
+    for start, end in chunks:
+        rows.extend(csv.reader(io.StringIO(data[start:end].decode(), newline=""), delimiter="|"))
+    assert rows[0] == field_names
+    assert rows[1:] == [[record["headline"], record["url"]] for record in records]
+
+
+def test_nytas_tokenize_headline():
+
+    def tokenize_as_sql(headline):
+        # NB: a step-by-step transcription of `int_nyt_unnested` and `int_nyt_cleansed`
+        terms = headline.split(" ")
+        terms = [term for term in terms if not re.search("[0-9]", term)]
+        terms = [re.sub("’s", "", term) for term in terms]
+        terms = [re.sub("[^A-Za-z0-9]", "", term) for term in terms]
+        return [term.lower() for term in terms]
+
+    headlines = [
+        "Biden’s 2 Big  Tests: U.S.-China ’’s Café $100 It’s",
+        "’’ss ’s’s 'Quoted' — Dash… COVID-19 Trump’S",
+        " leading and trailing ",
+        "Ünïcode Ωmega naïve"
+    ]
+    for headline in headlines:
+        assert nytas_tokenize_headline(headline) == tokenize_as_sql(headline)
+
+    counts = list(nytas_count_terms([{"headline": "A Tale of a City", "url": "u"}, {"headline": "", "url": "v"}]))
+    assert {row["headline_term"]: row["frequency"] for row in counts} == {"a": 2, "tale": 1, "of": 1, "city": 1}
+    assert {row["headline_md5"] for row in counts} == {hashlib.md5("A Tale of a City".encode()).hexdigest()}
+
+
+def test_synthetic_archive():
+
+    archive = synthetic_archive(500, year=2024, month=2, n_terms=1_000, seed=7)
+    # NB: the generator must be deterministic (so that benchmark runs are comparable)
+    assert json.dumps(archive) == json.dumps(synthetic_archive(500, year=2024, month=2, n_terms=1_000, seed=7))
+    assert json.dumps(archive) != json.dumps(synthetic_archive(500, year=2024, month=2, n_terms=1_000, seed=8))
+
+    records = nytas_filter_archive(archive)
+    assert len(records) == 500
+    assert len({record["url"] for record in records}) == 500
+    assert all(record["publication_date"].startswith("2024-02") for record in records)
+    assert list(nytas_iter_docs([json.dumps(archive).encode()])) == archive["response"]["docs"]
+    assert sum(map(len, map(nytas_tokenize_headline, (record["headline"] for record in records)))) > 500
+
+
+def test_archive_batch(tmp_path):
+
+    archive = synthetic_archive(1_000, seed=3)
+    archive["response"]["docs"][1]["pub_date"] = "2024-01-05T10:00:00-0530"
+    archive["response"]["docs"][2]["news_desk"] = ""
+    archive["response"]["docs"][3]["news_desk"] = None
+    archive["response"]["docs"][4]["headline"]["main"] = None
+    expected = [nytas_filter_article(article) for article in archive["response"]["docs"]]
+
+    batch = nytas_filter_archive(archive)
+    assert len(batch) == 1_000 and list(batch) == expected and batch[1] == expected[1]
+    assert batch[1]["publication_date"] == "2024-01-05T10:00:00-05:30"
+    assert len(batch.news_desks) < 12 and batch.news_desk_codes.dtype.kind == "i"
+    assert batch[3]["news_desk"] is None and batch.to_frame(["news_desk"]).loc[3, "news_desk"] is None
+
+    # NB: staging a batch must produce exactly the same file as staging its records
+    field_names = list(expected[0])
+    stage(expected, field_names, tmp_path / "records.csv")
+    stage(batch, field_names, tmp_path / "batch.csv")
+    assert (tmp_path / "records.csv").read_bytes() == (tmp_path / "batch.csv").read_bytes()
+
+    df = batch.to_frame(["url", "publication_date"])
+    assert list(df.columns) == ["url", "publication_date"]
+    # NB: the wall time as published is stored, whether a batch or its (staged) records are loaded
+    assert df.loc[1, "publication_date"] == dt.datetime(2024, 1, 5, 10, 0)
+    records_encoded = encode_column(pd.Series([record["publication_date"] for record in expected]), "timestamp")
+    batch_encoded = encode_column(df["publication_date"], "timestamp")
+    assert all((a == b).all() for a, b in zip(records_encoded, batch_encoded))
+
+    assert len(nytas_filter_archive({"response": {"docs": []}})) == 0
+    with pytest.raises(ValueError):
+        nytas_filter_archive({"response": {"docs": [dict(archive["response"]["docs"][0], pub_date="invalid-date")]}})
+
+
+def test_run_pipeline():
+
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+
+    def extract(item, _):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        if item == 3:
+            raise requests.HTTPError("429 Client Error: Too Many Requests")
+        return item * 10
+
+    def load(item, value):
+        time.sleep(0.01)
+        with lock:
+            in_flight["now"] -= 1
+        return value + 1
+
+    stages = [PipelineStage("extract", extract, workers=2), PipelineStage("stage", lambda item, value: value), PipelineStage("load", load)]
+    outputs, skipped = run_pipeline(range(1, 21), stages, maxsize=1, skip_on=(requests.RequestException,))
+
+    assert skipped == [3]
+    assert sorted(outputs) == [(item, item * 10 + 1) for item in range(1, 21) if item != 3]
+    # NB: backpressure i.e. the load stage is the bottleneck, yet extraction never runs far ahead of it
+    # (at most one item per worker and per queue, plus the skipped item which is never loaded)
+    assert in_flight["max"] <= (2 + 1 + 1) + 3 * 1 + 1
+
+    def failing_load(item, value):
+        if item == 5:
+            raise ValueError("COPY failed")
+        return value
+
+    with pytest.raises(ValueError, match="COPY failed"):
+        run_pipeline(range(1, 100), [stages[0], PipelineStage("load", failing_load)], skip_on=(requests.RequestException,))
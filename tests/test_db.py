@@ -0,0 +1,327 @@
+import struct
+import contextlib
+import datetime
+import pytest
+import psycopg2.pool
+import numpy as np
+import pandas as pd
+from src.db import rankings
+from src.db.cube import TermCube, refresh_cube
+from psycopg2 import sql
+from psycopg2.errors import OperationalError
+from src.db.utils import PG_COPY_HEADER, encode_numeric, write_frame, iter_sql_typed, get_pool
+
+
+TERM_IDS = {"trump": 3, "biden": 1, "election": 7, "ukraine": 2, "": 5}
+
+
+def make_daily_counts(
+    start_date: datetime.date,
+    n_days: int,
+    terms: list[str],
+    seed: int = 0
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Simulates the contents of `fct_daily_term_counts` (joined to `dim_terms`) and `fct_daily_counts`
+    for `n_days` days
+    """
+    rng = np.random.default_rng(seed)
+    days = [start_date + datetime.timedelta(days=i) for i in range(n_days)]
+    daily_term_counts = pd.DataFrame(
+        [(day, TERM_IDS[term], term, int(rng.integers(1, 20))) for day in days for term in terms if rng.random() < 0.6],
+        columns=["publication_date", "term_id", "headline_term", "frequency"]
+    ).astype({"term_id": "int32"})
+    daily_counts = pd.DataFrame({
+        "publication_date": days,
+        "total_frequency": rng.integers(1_000, 2_000, size=n_days)
+    })
+    return daily_term_counts, daily_counts
+
+
+def test_term_cube_generations(tmp_path):
+
+    (tmp_path / "profiles").mkdir()
+    (tmp_path / "2024_1_nytas.csv").write_text("")
+    generation_names = []
+    for month in (1, 2, 3):
+        refresh_cube(tmp_path, *make_daily_counts(datetime.date(2024, month, 1), 28, ["trump"], seed=month))
+        generation_names.append(TermCube(tmp_path).generation_name)
+
+    # NB: unrelated data in a shared directory survives and the previous generation is kept for one cycle
+    assert (tmp_path / "profiles").is_dir() and (tmp_path / "2024_1_nytas.csv").exists()
+    assert sorted(path.name for path in (tmp_path / "generations").iterdir()) == sorted(generation_names[1:])
+    assert TermCube(tmp_path).counts.shape == (88, 1)
+
+def test_term_cube_logit_inputs(tmp_path):
+
+    january = make_daily_counts(datetime.date(2024, 1, 1), 31, ["trump", "biden", "election"], seed=1)
+    february = make_daily_counts(datetime.date(2024, 2, 1), 29, ["trump", "ukraine", ""], seed=2)
+    refresh_cube(tmp_path, *january)
+    refresh_cube(tmp_path, *february)
+    # NB: refreshing the same month twice must be idempotent
+    refresh_cube(tmp_path, *february)
+
+    cube = TermCube(tmp_path)
+    assert cube.counts.shape == (60, 5)
+    assert isinstance(cube.window(datetime.date(2024, 1, 10), datetime.date(2024, 2, 10))[0], np.memmap)
+
+    start_date, end_date = datetime.date(2024, 1, 15), datetime.date(2024, 2, 15)
+    actual = cube.logit_inputs(start_date, end_date, min_frequency=100)
+
+    daily_term_counts = pd.concat([january[0], february[0]])
+    daily_counts = pd.concat([january[1], february[1]])
+    expected = (
+        daily_term_counts
+        .merge(daily_counts, on="publication_date")
+        .loc[lambda df: df["publication_date"].between(start_date, end_date)]
+        # NB: the frequency threshold applies to the window rather than to all-time totals
+        .loc[lambda df: df.groupby("headline_term")["frequency"].transform("sum").ge(100) & df["headline_term"].ne("")]
+        .assign(
+            cum_time_elapsed=lambda df: df["publication_date"].map(lambda day: (day - start_date).days),
+            successes=lambda df: df["frequency"],
+            failures=lambda df: df["total_frequency"] - df["frequency"]
+        )
+    )
+
+    def canonical(df):
+        return (
+            df[["term_id", "cum_time_elapsed", "successes", "failures"]]
+            .astype({"term_id": "int32", "cum_time_elapsed": "int64", "successes": "int64", "failures": "int64"})
+            .sort_values(["term_id", "cum_time_elapsed"])
+            .reset_index(drop=True)
+        )
+
+    pd.testing.assert_frame_equal(canonical(actual), canonical(expected))
+
+
+def decode_binary_copy(data: bytes) -> list[tuple]:
+    """Splits a binary `COPY` stream into rows of raw (bytes-encoded) fields
+    """
+    assert data.startswith(PG_COPY_HEADER) and data.endswith(b"\xff\xff")
+    rows, pos = [], len(PG_COPY_HEADER)
+    while (n_fields := struct.unpack_from(">h", data, pos)[0]) != -1:
+        pos += 2
+        row = []
+        for _ in range(n_fields):
+            length = struct.unpack_from(">i", data, pos)[0]
+            pos += 4
+            row.append(None if length == -1 else data[pos:pos + length])
+            pos += max(length, 0)
+        rows.append(tuple(row))
+    return rows
+
+
+def test_encode_numeric():
+
+    # NB: ndigits, weight, sign, dscale followed by base-10000 digits
+    assert encode_numeric(12345.678) == struct.pack(">hhHhhhh", 3, 1, 0, 3, 1, 2345, 6780)
+    assert encode_numeric(-0.0001) == struct.pack(">hhHhh", 1, -1, 0x4000, 4, 1)
+    assert encode_numeric(0.0) == struct.pack(">hhHh", 0, 0, 0, 1)
+    assert encode_numeric(1e20) == struct.pack(">hhHhh", 1, 5, 0, 0, 1)
+
+
+def test_write_frame():
+
+    class FakeCursor:
+        def __init__(self, copied):
+            self.copied = copied
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def copy_expert(self, statement, fp):
+            while block := fp.read(100):
+                self.copied.append(block)
+
+    copied = []
+    conn = type("FakeConnection", (), {"cursor": lambda self: FakeCursor(copied)})()
+    df = pd.DataFrame({
+        "headline_term": ["trump", None, "élection"],
+        "coef_time": [0.1, np.nan, -2.5],
+        "model_run_id": [1, 2, 3],
+        "publication_date": pd.to_datetime(["2000-01-02", "2024-01-01T12:00:00", "1999-12-31"], format="ISO8601")
+    })
+    assert write_frame(conn, df, "model", "output", types={"model_run_id": "int4"}, batch_size=2) == 3
+
+    rows = decode_binary_copy(b"".join(copied))
+    assert rows[0] == (b"trump", struct.pack(">d", 0.1), struct.pack(">i", 1), struct.pack(">q", 86_400 * 10 ** 6))
+    assert rows[1][:2] == (None, None)
+    assert rows[2][0] == "élection".encode("utf-8")
+    assert struct.unpack(">q", rows[2][3])[0] == -86_400 * 10 ** 6
+
+
+def test_iter_sql_typed():
+
+    rows = [f"NYT\tterm\\t{i}\t{i}\t{i}\t{i * 0.5}\t2024-01-{i % 28 + 1:02d}\n" for i in range(1_000)]
+    rows[3] = "NYT\t\\N\t3\t3\t\\N\t\\N\n"
+
+    class FakeCursor:
+        description = [type("Column", (), {"name": name}) for name in ["publication", "headline_term", "cum_time_elapsed", "successes", "p_estimate", "publication_date"]]
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def execute(self, query):
+            pass
+        def copy_expert(self, statement, fp):
+            # NB: `COPY` output arrives in blocks which do not respect row boundaries
+            data = "".join(rows).encode()
+            for i in range(0, len(data), 333):
+                fp.write(data[i:i + 333])
+
+    conn = type("FakeConnection", (), {"cursor": lambda self: FakeCursor()})()
+    dtypes = {"cum_time_elapsed": "int64", "successes": "int32", "p_estimate": "float64", "publication_date": "datetime64[D]"}
+    chunks = list(iter_sql_typed(conn, sql.SQL("select 1"), dtypes, chunk_bytes=5_000, max_pending=2))
+    assert len(chunks) > 1
+
+    df = pd.concat(chunks, ignore_index=True)
+    assert len(df) == 1_000
+    assert df["successes"].dtype == np.int32
+    assert df["cum_time_elapsed"].tolist() == list(range(1_000))
+    assert df.loc[0, "headline_term"] == "term\t0"
+    assert df.loc[3, "headline_term"] is None
+    assert np.isnan(df.loc[3, "p_estimate"]) and pd.isna(df.loc[3, "publication_date"])
+    assert df.loc[999, "publication_date"] == pd.Timestamp("2024-01-20")
+
+
+def test_iter_sql_typed_stopped_early():
+
+    class FakeConnection:
+        def __init__(self):
+            self.cancelled, self.rolled_back = False, False
+        def cursor(self):
+            return FakeCursor(self)
+        def cancel(self):
+            self.cancelled = True
+        def rollback(self):
+            self.rolled_back = True
+
+    class FakeCursor:
+        description = [type("Column", (), {"name": "headline_term"})]
+        def __init__(self, conn):
+            self.conn = conn
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def execute(self, query):
+            pass
+        def copy_expert(self, statement, fp):
+            # NB: mimics an unbounded `COPY`, which only stops once the query has been cancelled
+            while not self.conn.cancelled:
+                fp.write(b"term\n" * 100)
+            raise psycopg2.errors.QueryCanceled("canceling statement due to user request")
+
+    conn = FakeConnection()
+    chunks = iter_sql_typed(conn, sql.SQL("select 1"), {}, chunk_bytes=1_000, max_pending=2)
+    assert len(next(chunks)) >= 200
+    chunks.close()
+    assert conn.cancelled and conn.rolled_back
+
+
+def test_connection_pool(monkeypatch):
+
+    class FakeConnection:
+        def __init__(self, broken=False):
+            self.broken, self.closed, self.commits, self.rollbacks = broken, 0, 0, 0
+        def cursor(self):
+            conn = self
+            class FakeCursor:
+                def __enter__(self):
+                    return self
+                def __exit__(self, *args):
+                    return False
+                def execute(self, query):
+                    if conn.broken:
+                        raise OperationalError("server closed the connection unexpectedly")
+            return FakeCursor()
+        def commit(self):
+            self.commits += 1
+        def rollback(self):
+            self.rollbacks += 1
+
+    class FakeThreadedConnectionPool:
+        def __init__(self, minconn, maxconn, **kwargs):
+            self.idle, self.closed = [FakeConnection(broken=True)], False
+        def getconn(self):
+            return self.idle.pop() if self.idle else FakeConnection()
+        def putconn(self, conn, close=False):
+            if close:
+                conn.closed = 1
+            else:
+                self.idle.append(conn)
+
+    monkeypatch.setattr(psycopg2.pool, "ThreadedConnectionPool", FakeThreadedConnectionPool)
+    pool = get_pool("publications", "user", "password", max_size=2)
+    assert get_pool("publications", "user", "password", max_size=2) is pool
+
+    # NB: the broken (idle) connection must be discarded in favour of a new one
+    with pool.lease() as conn:
+        assert not conn.broken
+    assert conn.commits == 1 and pool.pool.idle == [conn]
+
+    with pytest.raises(ValueError):
+        with pool.lease() as conn:
+            raise ValueError()
+    assert conn.rollbacks == 3 and pool.pool.idle == [conn]
+
+
+def test_ranking_cache(monkeypatch):
+
+    latest = {"model_run_id": 1}
+    calls = []
+
+    class FakePool:
+        @contextlib.contextmanager
+        def lease(self):
+            yield None
+
+    def read_top_terms(conn, model_run_id, n=10, direction="trending"):
+        calls.append(("terms", model_run_id, n, direction))
+        return pd.DataFrame({"rank": np.arange(1, n + 1, dtype=np.int32), "model_run_id": model_run_id})
+
+    monkeypatch.setattr(rankings, "get_latest_model_run_id", lambda conn: latest["model_run_id"])
+    monkeypatch.setattr(rankings, "find_model_run_id", lambda conn, as_at, time_horizon_months: latest["model_run_id"])
+    monkeypatch.setattr(rankings, "read_top_terms", read_top_terms)
+    monkeypatch.setattr(rankings, "refresh_rankings", lambda *args: pytest.fail("rankings were already precomputed"))
+
+    cache = rankings.RankingCache(FakePool(), maxsize=3)
+    as_at = datetime.date(2025, 1, 1)
+    assert len(cache.top_terms(as_at, n=5)) == 5
+    # NB: results are served from the cache (and copies, so that callers cannot corrupt it)
+    cache.top_terms(as_at, n=5).drop(index=0, inplace=True)
+    assert len(cache.top_terms(as_at, n=5)) == 5
+    assert calls == [("terms", 1, 1, "trending"), ("terms", 1, 5, "trending")]
+
+    # NB: least recently used entries are evicted first
+    cache.top_terms(as_at, n=3, direction="shrinking")
+    cache.top_terms(as_at, n=5)
+    assert ("terms", 1, 5, "trending") in cache.entries and len(cache.entries) == 3
+
+    # NB: a new model run invalidates every cached result
+    latest["model_run_id"] = 2
+    assert cache.top_terms(as_at, n=5)["model_run_id"].eq(2).all()
+    assert calls[-1] == ("terms", 2, 5, "trending") and len(cache.entries) == 3
+
+    with pytest.raises(ValueError):
+        cache.top_terms(as_at, n=rankings.MAX_RANK + 1)
+
+
+def test_refresh_rankings_locks_run():
+
+    executed = []
+
+    class FakeCursor:
+        rowcount = 7
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def execute(self, query, params):
+            executed.append((" ".join(query.split()), params["model_run_id"]))
+
+    conn = type("FakeConnection", (), {"cursor": lambda self: FakeCursor()})()
+    assert rankings.refresh_rankings(conn, 42) == 7
+
+    # NB: concurrent refreshes of the same run are serialized before its rankings are replaced
+    assert executed[0] == ("SELECT pg_advisory_xact_lock(hashtext('model.ranking'), %(model_run_id)s)", 42)
+    assert executed[1][0].startswith("DELETE FROM model.ranking")
@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+import pytest
+
+
+ROOT = Path(__file__).resolve().parents[1]
+# NB: budgets are generous (cf. ~1.5s to import `statsmodels`, `scipy.stats` and `pandera`) and can be
+# scaled on slow machines via `IMPORT_BUDGET_SCALE`
+BUDGET_SCALE = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+
+
+def cold_import(statement: str) -> tuple[float, set[str]]:
+    """Executes `statement` in a fresh interpreter and returns its wall time and the modules it loaded
+    """
+    code = (
+        "import sys, time, json\n"
+        "loaded = set(sys.modules)\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(json.dumps([time.perf_counter() - start, sorted(set(sys.modules) - loaded)]))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    seconds, modules = json.loads(result.stdout.splitlines()[-1])
+    return seconds, set(modules)
+
+
+@pytest.mark.parametrize(
+    "statement, budget, deferred",
+    [
+        ("import src.model", 0.1, ["pandas", "pandera", "scipy", "statsmodels"]),
+        ("import src.data_loader", 0.1, ["pandas", "psycopg2", "requests"]),
+        ("from src.model import compute_batch_trend", 1.0, ["pandera", "scipy", "statsmodels"]),
+        ("import src.monitoring.metrics", 0.1, ["prometheus_client"]),
+        ("import tools._pipeline_run, tools._logit_run", 0.2, ["prefect"])
+    ]
+)
+def test_import_time_budget(statement, budget, deferred):
+
+    seconds, modules = cold_import(statement)
+
+    assert not [module for module in deferred if module in modules], f"'{statement}' eagerly imports {deferred}"
+    assert seconds <= budget * BUDGET_SCALE, f"'{statement}' took {seconds:.3f}s (budget: {budget * BUDGET_SCALE:.3f}s)"
@@ -0,0 +1,207 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import pandera as pa
+import src.model.schema as schema
+from src.model.algorithm import compute_batch_trend
+from src.model.horizons import compute_horizon_trends
+from src.model.irls import group_terms
+from src.model.parallel import partition_batch
+from src.model.incremental import build_state, load_state, roll_window, save_state, state_path
+from src.monitoring.metrics import ACTIVE_METRICS, FlowMetrics
+
+
+def make_logit_inputs(
+    n_terms: int = 25,
+    n_days: int = 120,
+    seed: int = 0
+) -> pd.DataFrame:
+    """Simulates daily term counts (with a random trend per term) in the shape of `get_logit_inputs()`
+    """
+    rng = np.random.default_rng(seed)
+    daily_totals = rng.integers(8_000, 12_000, size=n_days)
+    frames = []
+    for i in range(n_terms):
+        days = np.sort(rng.choice(n_days, size=rng.integers(20, n_days), replace=False))
+        logit = rng.uniform(-8, -5) + rng.normal(0, 0.01) * days
+        successes = rng.binomial(daily_totals[days], 1 / (1 + np.exp(-logit))) + 1
+        frames.append(
+            pd.DataFrame({
+                "term_id": np.int32(i + 1),
+                "cum_time_elapsed": days,
+                "successes": successes,
+                "failures": daily_totals[days] - successes
+            })
+        )
+    # NB: interleave terms so that fitting does not rely on pre-sorted input
+    return pd.concat(frames).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_compute_batch_trend_irls_matches_statsmodels():
+
+    logit_inputs = make_logit_inputs()
+    expected = compute_batch_trend(logit_inputs, engine="statsmodels")
+    actual = compute_batch_trend(logit_inputs, engine="irls")
+
+    assert list(actual["term_id"]) == list(expected["term_id"])
+    # NB: `statsmodels` stops on a (looser) deviance criterion so agreement is only to ~4 s.f.
+    for col in ["coef_intercept", "coef_time", "rse_time", "p_value_time"]:
+        np.testing.assert_allclose(actual[col], expected[col], rtol=1e-4, atol=1e-10)
+
+
+def test_compute_batch_trend_unknown_engine():
+
+    with pytest.raises(ValueError):
+        compute_batch_trend(make_logit_inputs(n_terms=2), engine="unknown")
+
+
+def test_partition_batch_is_balanced_and_complete():
+
+    batch = group_terms(make_logit_inputs(n_terms=40))
+    chunks = partition_batch(batch, 4)
+
+    assert 1 < len(chunks) <= 4
+    assert np.concatenate([chunk.terms for chunk in chunks]).tolist() == batch.terms.tolist()
+    np.testing.assert_array_equal(
+        np.concatenate([chunk.successes for chunk in chunks]),
+        batch.successes
+    )
+    assert all(chunk.offsets[0] == 0 for chunk in chunks)
+    assert max(chunk.offsets[-1] for chunk in chunks) < 0.5 * batch.offsets[-1]
+
+
+@pytest.mark.parametrize("engine", ["irls", "statsmodels"])
+def test_compute_batch_trend_parallel_matches_serial(engine):
+
+    logit_inputs = make_logit_inputs(n_terms=12)
+    expected = compute_batch_trend(logit_inputs, engine=engine)
+    actual = compute_batch_trend(logit_inputs, engine=engine, n_workers=2)
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_incremental_refit_matches_full_refit(tmp_path):
+
+    panel = make_logit_inputs(n_terms=15, n_days=200).rename(columns={"cum_time_elapsed": "day"})
+
+    def window(first_day, last_day, origin):
+        rows = panel[panel["day"].between(first_day, last_day)]
+        return rows.assign(cum_time_elapsed=rows["day"] - origin).drop(columns="day")
+
+    previous_inputs = window(0, 150, origin=0)
+    previous_outputs = compute_batch_trend(previous_inputs)
+    path = state_path(tmp_path, datetime.date(2024, 1, 1), datetime.date(2024, 5, 30))
+    save_state(path, build_state(datetime.date(2024, 1, 1), datetime.date(2024, 5, 30), previous_inputs, previous_outputs))
+
+    logit_inputs, warm_start = roll_window(
+        load_state(path),
+        window(151, 180, origin=30),
+        datetime.date(2024, 1, 31),
+        datetime.date(2024, 6, 29)
+    )
+    actual = compute_batch_trend(logit_inputs, warm_start=warm_start).set_index("term_id").sort_index()
+    expected = compute_batch_trend(window(30, 180, origin=30)).set_index("term_id").sort_index()
+
+    pd.testing.assert_frame_equal(actual, expected, rtol=1e-8)
+
+    # NB: the frequency threshold applies to the rolled (i.e. new) window
+    window_frequency = window(30, 180, origin=30).groupby("term_id")["successes"].sum()
+    min_frequency = int(window_frequency.median())
+    logit_inputs, _ = roll_window(
+        load_state(path),
+        window(151, 180, origin=30),
+        datetime.date(2024, 1, 31),
+        datetime.date(2024, 6, 29),
+        min_frequency=min_frequency
+    )
+    assert set(logit_inputs["term_id"]) == set(window_frequency[window_frequency >= min_frequency].index)
+
+    # NB: states persisted before terms were keyed by `term_id` are ignored (i.e. the window is refit in full)
+    np.savez_compressed(path, terms=np.array(["trump"]))
+    assert load_state(path) is None
+
+
+def test_compute_horizon_trends_matches_separate_fits():
+
+    logit_inputs = make_logit_inputs(n_terms=20, n_days=180)
+    shifts = {6: 0, 3: 90, 1: 150}
+    min_frequency = int(logit_inputs.groupby("term_id")["successes"].sum().median() / 6)
+    actual = compute_horizon_trends(logit_inputs, shifts, min_frequency=min_frequency)
+
+    assert list(actual) == [6, 3, 1]
+    for horizon, shift in shifts.items():
+        window = logit_inputs[logit_inputs["cum_time_elapsed"] >= shift].assign(
+            cum_time_elapsed=lambda df: df["cum_time_elapsed"] - shift
+        )
+        window = window[window.groupby("term_id")["successes"].transform("sum") >= min_frequency]
+        expected = compute_batch_trend(window).set_index("term_id").sort_index()
+        # NB: narrower windows retain fewer terms
+        assert len(actual[horizon]) == len(expected) and (horizon == 6 or len(expected) < len(actual[6]))
+        pd.testing.assert_frame_equal(actual[horizon].set_index("term_id").sort_index(), expected, rtol=1e-8)
+
+
+
+def test_failed_fits_are_dropped():
+
+    # NB: term 2 is observed on a single day and term 3 is perfectly separated in time
+    logit_inputs = pd.concat([
+        make_logit_inputs(n_terms=1, n_days=60),
+        pd.DataFrame({
+            "term_id": np.int32([2] + [3] * 10),
+            "cum_time_elapsed": [5] + list(range(10)),
+            "successes": [80] + [0] * 5 + [100] * 5,
+            "failures": [9_920] + [100] * 5 + [0] * 5
+        })
+    ], ignore_index=True)
+
+    metrics = FlowMetrics("demo_flow")
+    token = ACTIVE_METRICS.set(metrics)
+    try:
+        logit_outputs = compute_batch_trend(logit_inputs)
+        horizon_outputs = compute_horizon_trends(logit_inputs, {2: 0, 1: 3})
+    finally:
+        ACTIVE_METRICS.reset(token)
+
+    assert logit_outputs["term_id"].tolist() == [1]
+    assert [outputs["term_id"].tolist() for outputs in horizon_outputs.values()] == [[1], [1]]
+    assert not logit_outputs.isna().any().any()
+    # NB: failed fits are counted where they are dropped
+    assert metrics.counters["failed_fits"] == 2 + 2 * 2
+
+
+@pytest.mark.parametrize("level", ["full", "batch", "sampled"])
+def test_validation_levels_reject_invalid_inputs(level):
+
+    # NB: the "sampled" level checks every row of a batch no larger than `SAMPLE_SIZE`
+    logit_inputs = make_logit_inputs(n_terms=2)
+    logit_inputs.loc[0, "failures"] = -1
+
+    with schema.validation_scope(level), pytest.raises(pa.errors.SchemaError):
+        compute_batch_trend(logit_inputs)
+
+
+def test_validation_level_sampled_checks_a_sample(monkeypatch):
+
+    monkeypatch.setattr(schema, "SAMPLE_SIZE", 5)
+    checked = []
+    monkeypatch.setattr(schema, "validate_fast", lambda df, name: checked.append((name, len(df))) or df)
+    logit_inputs = make_logit_inputs(n_terms=2)
+
+    with schema.validation_scope("sampled"):
+        compute_batch_trend(logit_inputs)
+
+    assert len(logit_inputs) > 5 and checked == [("LOGIT_INPUTS", 5), ("LOGIT_OUTPUTS", 2)]
+
+
+def test_validation_level_off_skips_validation(monkeypatch):
+
+    monkeypatch.delenv("MODEL_VALIDATION_LEVEL", raising=False)
+    logit_inputs = make_logit_inputs(n_terms=2).astype({"successes": "int32"})
+
+    with schema.validation_scope("off"):
+        assert len(compute_batch_trend(logit_inputs)) == 2
+    # NB: the level does not leak beyond its scope
+    assert schema.get_validation_level() == "full"
+    with pytest.raises(pa.errors.SchemaError):
+        compute_batch_trend(logit_inputs)
@@ -0,0 +1,138 @@
+import threading
+import contextvars
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+from src.monitoring.metrics import track_flow, instrument, stage_timer, observe, observe_records, count
+from src.monitoring import profiling
+from src.data_loader.pipeline import PipelineStage, run_pipeline
+from src.monitoring.profiling import profile_run, profiled
+
+
+def test_track_flow(tmp_path):
+
+    @instrument("stage")
+    def stage_records(records):
+        return sum(1 for _ in observe_records(records))
+
+    @instrument()
+    def fit(n_terms):
+        with stage_timer("solve"):
+            observe(rows=n_terms)
+        count("failed_fits", 2)
+        observe(nbytes=1_024)
+
+    # NB: outside of a tracked flow run, instrumented functions behave as usual
+    assert stage_records(range(3)) == 3
+
+    @track_flow
+    def demo_flow(n_docs: int, metrics_dir: str | None = None):
+        stage_records(range(n_docs))
+        stage_records(range(n_docs))
+        fit(10)
+        raise ValueError()
+
+    # NB: metrics are exported even when the flow run fails
+    with pytest.raises(ValueError):
+        demo_flow(100, metrics_dir=str(tmp_path))
+
+    samples = {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families((tmp_path / "demo_flow.prom").read_text())
+        for sample in family.samples
+    }
+
+    def sample(name, **labels):
+        return samples[(f"headline_pipeline_{name}", tuple(sorted({"flow": "demo_flow", **labels}.items())))]
+
+    assert sample("stage_calls", stage="stage") == 2
+    assert sample("stage_rows", stage="stage") == 200
+    assert sample("stage_rows", stage="solve") == 10
+    assert sample("stage_rows", stage="fit") == 0
+    assert sample("stage_bytes", stage="fit") == 1_024
+    assert sample("stage_peak_rss_bytes", stage="fit") > 0
+    assert sample("stage_duration_seconds", stage="fit") >= sample("stage_duration_seconds", stage="solve")
+    assert sample("events", event="failed_fits") == 2
+
+
+def test_track_flow_pipeline(tmp_path):
+
+    def timed(name, rows):
+        def fn(item, value):
+            with stage_timer(name):
+                observe(rows=rows)
+        return fn
+
+    # NB: stages timed concurrently (in other threads) are each attributed their own observations
+    @track_flow
+    def demo_pipeline(metrics_dir: str | None = None):
+        run_pipeline(range(50), [PipelineStage("extract", timed("extract", 1), workers=4), PipelineStage("load", timed("load", 2))])
+
+    demo_pipeline(metrics_dir=str(tmp_path))
+
+    samples = {
+        (sample.name, sample.labels.get("stage")): sample.value
+        for family in text_string_to_metric_families((tmp_path / "demo_pipeline.prom").read_text())
+        for sample in family.samples
+    }
+    assert samples[("headline_pipeline_stage_calls", "extract")] == 50
+    assert samples[("headline_pipeline_stage_rows", "extract")] == 50
+    assert samples[("headline_pipeline_stage_rows", "load")] == 100
+
+def test_profile_run(tmp_path, monkeypatch):
+
+    @profiled()
+    def inner(n):
+        return [str(i) for i in range(n)]
+
+    @profiled("outer")
+    def outer(n):
+        return len(inner(n))
+
+    monkeypatch.setenv("PROFILING_MODE", "off")
+    with profile_run("disabled", profile_dir=tmp_path) as session:
+        assert session is None and outer(10) == 10
+    assert not (tmp_path / "disabled").exists()
+
+    with profile_run("enabled", mode="full", profile_dir=tmp_path):
+        assert outer(10_000) == 10_000
+        assert inner(10) == [str(i) for i in range(10)]
+    assert profiling.SESSION.get() is None
+
+    # NB: the nested call of `inner` is attributed to `outer`
+    assert sorted(path.name for path in (tmp_path / "enabled").iterdir()) == [
+        "001_outer.prof", "001_outer.txt", "001_outer_alloc.txt",
+        "002_inner.prof", "002_inner.txt", "002_inner_alloc.txt"
+    ]
+    assert "inner" in (tmp_path / "enabled" / "001_outer.txt").read_text()
+    assert (tmp_path / "enabled" / "001_outer_alloc.txt").read_text().startswith("Peak traced memory")
+
+
+def test_profile_run_concurrent_calls(tmp_path):
+
+    started, release = threading.Barrier(2), threading.Event()
+
+    @profiled()
+    def blocking(n):
+        started.wait(timeout=5)
+        release.wait(timeout=5)
+        return [str(i) for i in range(n)]
+
+    with profile_run("concurrent", mode="memory", profile_dir=tmp_path) as session:
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(blocking, 1_000))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert session.active_calls == 0
+
+        # NB: the session does not leak into other contexts (e.g. another flow run in the same process)
+        other = threading.Thread(target=lambda: profiled("other")(len)([]))
+        other.start()
+        other.join()
+
+    # NB: the second call overlaps the first, so only the first traces memory
+    assert [path.name for path in (tmp_path / "concurrent").iterdir()] == ["001_blocking_alloc.txt"]
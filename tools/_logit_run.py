@@ -7,10 +7,8 @@ You can alternatively run the same logic presented here from the command line li
 prefect deployment run --params '{"year": 2024, "month": 10}' 'main-nytas/headline-analytics-pipeline'
 ````
 """
-import prefect.main # must be imported due to known issue: https://github.com/PrefectHQ/prefect/issues/15957
 import click
 import datetime
-from prefect.deployments import run_deployment
 
 
 TODAY = datetime.date.today()
@@ -19,16 +17,22 @@ FIRST = TODAY.replace(day=1)
 
 @click.command
 @click.option("-a", "--as-at", type=int, help="As at date (in fomat 'Yyyy-mm-dd')")
-@click.option("-t", "--time-horizon-months", type=int, help="# of training months in advance of 'as at'")
+@click.option("-t", "--time-horizon-months", type=int, multiple=True, default=(6,), help="# of training months in advance of 'as at' (repeat to fit several horizons in one run)")
+@click.option("-w", "--n-workers", type=int, default=1, help="# of processes across which to fit the model")
 def run_logit_growth_fitting(
     as_at: datetime.date | str = FIRST,
-    time_horizon_months: int = 6
+    time_horizon_months: tuple[int, ...] = (6,),
+    n_workers: int = 1
 ) -> None:
+    # NB: `prefect` is imported on invocation (rather than at import time) so that e.g. `--help` is instant
+    import prefect.main # must be imported due to known issue: https://github.com/PrefectHQ/prefect/issues/15957
+    from prefect.deployments import run_deployment
     run_deployment(
         name="main-logit-growth/headline-analytics-logit-model",
         parameters={
             "as_at": as_at,
-            "time_horizon_months": time_horizon_months
+            "time_horizon_months": list(time_horizon_months),
+            "n_workers": n_workers
         }
     )
 
@@ -7,10 +7,8 @@ You can alternatively run the same logic presented here from the command line li
 prefect deployment run --params '{"year": 2024, "month": 10}' 'main-nytas/headline-analytics-pipeline'
 ````
 """
-import prefect.main # must be imported due to known issue: https://github.com/PrefectHQ/prefect/issues/15957
 import click
 import datetime
-from prefect.deployments import run_deployment
 
 
 TODAY = datetime.date.today()
@@ -24,6 +22,9 @@ def run_pipeline(
     year: int = LATEST_PERIOD.year,
     month: int = LATEST_PERIOD.month
 ) -> None:
+    # NB: `prefect` is imported on invocation (rather than at import time) so that e.g. `--help` is instant
+    import prefect.main # must be imported due to known issue: https://github.com/PrefectHQ/prefect/issues/15957
+    from prefect.deployments import run_deployment
     run_deployment(
         name="main-nytas/headline-analytics-pipeline",
         parameters={